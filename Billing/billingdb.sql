@@ -15,21 +15,33 @@ CREATE TABLE IF NOT EXISTS `Provider` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `name` varchar(255) DEFAULT NULL,
   PRIMARY KEY (`id`)
-) ENGINE=MyISAM  AUTO_INCREMENT=10001 ;
+) ENGINE=InnoDB  AUTO_INCREMENT=10001 ;
 
 CREATE TABLE IF NOT EXISTS `Rates` (
   `product_id` varchar(50) NOT NULL,
   `rate` int(11) DEFAULT 0,
   `scope` varchar(50) DEFAULT NULL,
-  FOREIGN KEY (scope) REFERENCES `Provider`(`id`)
-) ENGINE=MyISAM ;
+  KEY `idx_scope_product` (`scope`, `product_id`)
+) ENGINE=InnoDB ;
 
 CREATE TABLE IF NOT EXISTS `Trucks` (
   `id` varchar(10) NOT NULL,
   `provider_id` int(11) DEFAULT NULL,
   PRIMARY KEY (`id`),
-  FOREIGN KEY (`provider_id`) REFERENCES `Provider`(`id`)
-) ENGINE=MyISAM ;
+  KEY `idx_provider` (`provider_id`)
+) ENGINE=InnoDB ;
+
+-- Versions applied by src/migrations.py, this script creates the current schema so it records all of them
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` int(11) NOT NULL,
+  `description` varchar(255) NOT NULL,
+  `applied_at` datetime NOT NULL,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB ;
+
+INSERT IGNORE INTO `schema_migrations` (`version`, `description`, `applied_at`) VALUES
+(1, 'Convert tables to InnoDB', NOW()),
+(2, 'Indexes for bill and truck lookups', NOW());
 --
 -- Dumping data
 --
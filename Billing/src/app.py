@@ -4,6 +4,7 @@ import os
 from openpyxl import load_workbook
 import requests
 from datetime import datetime
+from migrations import migrate
 
 
 
@@ -12,6 +13,8 @@ app = Flask(__name__)
 # Base URL of the external service
 container_name = os.getenv('CONTAINER_NAME')
 WEIGHT_APP_URL = f"http://{container_name}:5000"
+# Session ids resolved per POST /sessions request of the weight service
+SESSION_LOOKUP_BATCH = 1000
 
 #db connaction-------------------------------------------------------------------------------------
 db_host = os.getenv("DATABASE_HOST", "localhost")
@@ -525,24 +528,28 @@ def get_bill(id):
             transactions = weight_response.json()
         except requests.RequestException as e:
             return jsonify({"error": f"Failed to fetch data from weight service: {str(e)}"}), 503
+        # check the out direction and not null productions
+        transactions = [t for t in transactions if t.get("direction") == "out" and t.get("produce") != "na"]
+        # Get session details from /sessions, SESSION_LOOKUP_BATCH ids per request
+        sessions = {}
+        try:
+            for start in range(0, len(transactions), SESSION_LOOKUP_BATCH):
+                ids = [str(t.get("id")) for t in transactions[start:start + SESSION_LOOKUP_BATCH]]
+                session_response = requests.post(f"{WEIGHT_APP_URL}/sessions", json=ids, timeout=5)
+                session_response.raise_for_status()
+                sessions.update(session_response.json())
+        except requests.RequestException as e:
+            return jsonify({"error": f"Failed to fetch sessions from weight service: {str(e)}"}), 503
         # Process transactions and calculate billing
         products = {}
         session_count = 0
         missing_rates = set()
         for transaction in transactions:
             transaction_id = transaction.get("id")
-            direction = transaction.get("direction")
             produce = transaction.get("produce")
-            # check the out direction and not null productions
-            if direction != "out" or produce == "na":
-                continue
-            try:
-                # Get session details from /session/<id>
-                session_response = requests.get(f"{WEIGHT_APP_URL}/session/{transaction_id}", timeout=5)
-                session_response.raise_for_status()
-                session = session_response.json()
-            except requests.RequestException as e:
-                print(f"Failed to fetch session {transaction_id}: {str(e)}")
+            session = sessions.get(str(transaction_id))
+            if not session or "error" in session:
+                print(f"Failed to fetch session {transaction_id}: {session}")
                 continue
             # get just the provider truck
             truck_id = session.get("truck")
@@ -610,4 +617,11 @@ def health_check():
 
 # main--------------------------------------------------------------------------------------------
 if __name__ == "__main__":
+    # Bring existing databases up to the billingdb.sql schema
+    try:
+        conn = get_db_connection()
+        print(f"Applied migrations: {migrate(conn) or 'none pending'}")
+        conn.close()
+    except mysql.connector.Error as err:
+        print(f"Migrations not applied: {err}")
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,114 @@
+import sys
+from datetime import datetime
+
+# MySQL error code for an index name that already exists
+ER_DUP_KEYNAME = 1061
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version int(11) NOT NULL,
+        description varchar(255) NOT NULL,
+        applied_at datetime NOT NULL,
+        PRIMARY KEY (version)
+    ) ENGINE=InnoDB
+"""
+
+# (version, description, statements), applied in order and recorded in schema_migrations.
+# billingdb.sql creates the final schema and records every version, so new versions must be added there too.
+# The MyISAM foreign keys were never enforced, Rates.scope also holds 'ALL', so they become plain indexes.
+MIGRATIONS = (
+    (1, "Convert tables to InnoDB", (
+        "ALTER TABLE Provider ENGINE=InnoDB",
+        "ALTER TABLE Rates ENGINE=InnoDB",
+        "ALTER TABLE Trucks ENGINE=InnoDB",
+    )),
+    (2, "Indexes for bill and truck lookups", (
+        "ALTER TABLE Rates ADD INDEX idx_scope_product (scope, product_id)",
+        "ALTER TABLE Trucks ADD INDEX idx_provider (provider_id)",
+    )),
+)
+
+# Queries issued by app.py with sample parameters, checked by check_query_plans().
+# "DELETE FROM Rates" clears the whole table by design and is not listed.
+PLAN_CHECKED_QUERIES = (
+    ("SELECT id, name FROM Provider WHERE id = %s", (10001,)),
+    ("SELECT name FROM Provider WHERE id = %s", (10001,)),
+    ("SELECT COUNT(*) FROM Provider WHERE id = %s", (10001,)),
+    ("SELECT id FROM Trucks WHERE id = %s", ("134-33-443",)),
+    ("SELECT COUNT(*) FROM Trucks WHERE id = %s", ("134-33-443",)),
+    ("SELECT id FROM Trucks WHERE provider_id = %s", (10001,)),
+    ("UPDATE Trucks SET provider_id = %s WHERE id = %s", (10001, "134-33-443")),
+    ("UPDATE Provider SET name = %s WHERE id = %s", ("pro1", 10001)),
+    ("SELECT product_id, rate, scope FROM Rates WHERE scope = %s OR scope = 'ALL' ORDER BY scope DESC", ("10001",)),
+)
+
+def migrate(conn):
+    """
+    Apply the pending migrations on a mysql.connector connection.
+    Indexes that already exist are skipped. Returns the versions applied
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SCHEMA_MIGRATIONS_DDL)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+        done = []
+        for version, description, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except Exception as e:
+                    if getattr(e, "errno", None) != ER_DUP_KEYNAME:
+                        raise
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                (version, description, datetime.now().replace(microsecond=0))
+            )
+            conn.commit()
+            done.append(version)
+        return done
+    finally:
+        cursor.close()
+
+def check_query_plans(conn, min_rows=1000):
+    """
+    EXPLAIN every query in PLAN_CHECKED_QUERIES and report full table or index scans.
+    A scan is always reported when no index could serve it, and otherwise only when the table
+    holds at least min_rows rows, as the optimizer rightly scans small tables.
+    """
+    problems = []
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for query, params in PLAN_CHECKED_QUERIES:
+            cursor.execute("EXPLAIN " + query, params)
+            for plan in cursor.fetchall():
+                if plan.get("type") not in ("ALL", "index"):
+                    continue
+                if plan.get("possible_keys") and (plan.get("rows") or 0) < min_rows:
+                    continue
+                problems.append(f"{query}: full scan of {plan.get('table')} "
+                                f"(rows={plan.get('rows')}, possible_keys={plan.get('possible_keys')})")
+    finally:
+        cursor.close()
+    return problems
+
+# main--------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    # python migrations.py [migrate|check-query-plans]
+    from app import get_db_connection
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    conn = get_db_connection()
+    try:
+        if command == "migrate":
+            print(f"Applied migrations: {migrate(conn) or 'none pending'}")
+        elif command == "check-query-plans":
+            problems = check_query_plans(conn)
+            for problem in problems:
+                print(problem)
+            sys.exit(1 if problems else 0)
+        else:
+            sys.exit(f"Unknown command {command}, expected migrate or check-query-plans")
+    finally:
+        conn.close()
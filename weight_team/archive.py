@@ -0,0 +1,236 @@
+import os
+import re
+import heapq
+import tempfile
+from datetime import datetime
+from typing import List, Dict, Optional, Iterator, Iterable, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc
+except ImportError:  # Archiving is disabled without pyarrow
+    pa = None
+
+# Rows per record batch, the unit of decompression when a month file is read
+ARCHIVE_BATCH_ROWS = 65536
+# One Arrow IPC file per month of transactions, plus the part files written since the month was last compacted
+MONTH_FILE = re.compile(r'^transactions-(\d{4})-(\d{2})(?:\.part(\d+))?\.arrow$')
+
+def archive_available() -> bool:
+    return pa is not None
+
+def month_key(value: datetime) -> Tuple[int, int]:
+    return value.year, value.month
+
+def transaction_schema():
+    """Columns of the transactions table, with containers as a list column"""
+    return pa.schema([
+        ('id', pa.int64()),
+        ('datetime', pa.timestamp('s')),
+        ('direction', pa.string()),
+        ('truck', pa.string()),
+        ('containers', pa.list_(pa.string())),
+        ('bruto', pa.int64()),
+        ('truckTara', pa.int64()),
+        ('neto', pa.int64()),
+        ('produce', pa.string()),
+    ])
+
+
+class TransactionArchive:
+    """
+    Closed transactions moved out of the live table, zstd compressed Arrow IPC files per month: each write
+    adds a part file, compact() merges a month's parts into its single file once the archive run is done.
+    Files are memory-mapped when read and only the months overlapping a requested range are opened.
+    Rows inside a file are sorted by id, so id ordered reads merge the files lazily.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _path(self, month: Tuple[int, int], part: Optional[int] = None) -> str:
+        suffix = f".part{part}" if part is not None else ""
+        return os.path.join(self.folder, f"transactions-{month[0]:04d}-{month[1]:02d}{suffix}.arrow")
+
+    def _files(self) -> Dict[Tuple[int, int], List[Optional[int]]]:
+        """Files of every archived month: None for the compacted file, then the part numbers in write order"""
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return {}
+        files: Dict[Tuple[int, int], List[Optional[int]]] = {}
+        for name in names:
+            match = MONTH_FILE.match(name)
+            if match:
+                month = (int(match.group(1)), int(match.group(2)))
+                files.setdefault(month, []).append(int(match.group(3)) if match.group(3) else None)
+        return {month: sorted(parts, key=lambda part: -1 if part is None else part) for month, parts in files.items()}
+
+    def _paths(self, months: Iterable[Tuple[int, int]]) -> List[str]:
+        files = self._files()
+        return [self._path(month, part) for month in months for part in files.get(month, [])]
+
+    def months(self, t1: Optional[datetime] = None, t2: Optional[datetime] = None) -> List[Tuple[int, int]]:
+        """Archived months overlapping [t1, t2], all of them by default"""
+        return sorted(month for month in self._files()
+                      if (t1 is None or month >= month_key(t1)) and (t2 is None or month <= month_key(t2)))
+
+    def covers(self, t1: datetime, t2: datetime) -> bool:
+        """True if any archived month overlaps the range, i.e. readers must consult the archive"""
+        return bool(self.months(t1, t2))
+
+    def _batches(self, path: str) -> Iterator:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+
+    def _id_range(self, path: str) -> Tuple[int, int]:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        return int(metadata.get(b'min_id', 0)), int(metadata.get(b'max_id', 0))
+
+    def _filtered(self, paths: Iterable[str], t1: Optional[datetime], t2: Optional[datetime],
+                  condition) -> Iterator[Dict]:
+        """Rows of the files matching the condition(batch) mask and datetime in [t1, t2] if given, in id order per file"""
+        for path in paths:
+            for batch in self._batches(path):
+                mask = condition(batch)
+                if t1 is not None:
+                    mask = pc.and_(mask, pc.and_(
+                        pc.greater_equal(batch['datetime'], pa.scalar(t1, pa.timestamp('s'))),
+                        pc.less_equal(batch['datetime'], pa.scalar(t2, pa.timestamp('s')))))
+                yield from batch.filter(mask).to_pylist()
+
+    def write(self, rows: List[Dict]) -> int:
+        """
+        Add transaction rows (dicts with the live table columns) to their months as a new part file each.
+        A row archived again after an interrupted archive run replaces the earlier copy when the month is compacted.
+        Each file is written to a temporary file and renamed into place. Returns the number of rows written
+        """
+        by_month: Dict[Tuple[int, int], Dict[int, Dict]] = {}
+        for row in rows:
+            by_month.setdefault(month_key(row['datetime']), {})[row['id']] = row
+        os.makedirs(self.folder, exist_ok=True)
+
+        files = self._files()
+        for month, month_rows in by_month.items():
+            part = max([part for part in files.get(month, []) if part is not None], default=0) + 1
+            ordered = [{**month_rows[session_id],
+                        'containers': [c.strip() for c in (month_rows[session_id]['containers'] or '').split(',')
+                                       if c.strip()]}
+                       for session_id in sorted(month_rows)]
+            self._write_file(self._path(month, part), ordered)
+        return sum(len(month_rows) for month_rows in by_month.values())
+
+    def compact(self) -> int:
+        """
+        Merge every month's part files into its single file, the last written copy of a row wins.
+        Run once at the end of an archive run. Returns the number of months compacted
+        """
+        compacted = 0
+        for month, parts in self._files().items():
+            if parts == [None]:
+                continue
+            paths = [self._path(month, part) for part in parts]
+            merged = {}
+            for path in paths:
+                for batch in self._batches(path):
+                    for row in batch.to_pylist():
+                        merged[row['id']] = row
+            self._write_file(self._path(month), [merged[session_id] for session_id in sorted(merged)])
+            for part in parts:
+                if part is not None:
+                    os.unlink(self._path(month, part))
+            compacted += 1
+        return compacted
+
+    def _write_file(self, path: str, ordered: List[Dict]) -> None:
+        """Write id ordered rows (containers as lists) to path through a temporary file"""
+        schema = transaction_schema().with_metadata({'min_id': str(ordered[0]['id']),
+                                                     'max_id': str(ordered[-1]['id'])})
+        table = pa.Table.from_pylist(ordered, schema=schema)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.transactions')
+        try:
+            with os.fdopen(fd, 'wb') as sink:
+                options = pa.ipc.IpcWriteOptions(compression='zstd')
+                with pa.ipc.new_file(sink, schema, options=options) as writer:
+                    writer.write_table(table, max_chunksize=ARCHIVE_BATCH_ROWS)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def iter_transactions(self, t1: datetime, t2: datetime, directions: List[str]) -> Iterator[tuple]:
+        """Archived rows in the live table column order (containers comma delimited), merged across months by id"""
+        def condition(batch):
+            return pc.is_in(batch['direction'], value_set=pa.array(directions, pa.string()))
+
+        names = transaction_schema().names
+
+        def rows(path):
+            for row in self._filtered([path], t1, t2, condition):
+                yield tuple(",".join(row[name] or []) if name == 'containers' else row[name] for name in names)
+
+        return heapq.merge(*(rows(path) for path in self._paths(self.months(t1, t2))), key=lambda row: row[0])
+
+    def iter_weighings(self, t1: datetime, t2: datetime, directions: List[str],
+                       after_id: Optional[int] = None) -> Iterator[tuple]:
+        """Archived rows in the same (id, direction, bruto, neto, produce, containers) shape as the live table"""
+        def condition(batch):
+            mask = pc.is_in(batch['direction'], value_set=pa.array(directions, pa.string()))
+            if after_id is not None:
+                mask = pc.and_(mask, pc.greater(batch['id'], after_id))
+            return mask
+
+        def rows(path):
+            for row in self._filtered([path], t1, t2, condition):
+                yield (row['id'], row['direction'], row['bruto'], row['neto'], row['produce'],
+                       ",".join(row['containers'] or []))
+
+        return heapq.merge(*(rows(path) for path in self._paths(self.months(t1, t2))), key=lambda row: row[0])
+
+    def get_session(self, session_id: int) -> Optional[Dict]:
+        # Newest files first, a part holds the latest copy of a row archived again
+        for path in reversed(self._paths(self.months())):
+            min_id, max_id = self._id_range(path)
+            if min_id <= session_id <= max_id:
+                for batch in self._batches(path):
+                    found = batch.filter(pc.equal(batch['id'], session_id)).to_pylist()
+                    if found:
+                        return {**found[0], 'containers': ",".join(found[0]['containers'] or [])}
+        return None
+
+    def container_sessions(self, container_id: str, t1: datetime, t2: datetime) -> List[Tuple[datetime, int]]:
+        """(datetime, session_id) of archived sessions that weighed the container"""
+        return self.containers_sessions([container_id], t1, t2).get(container_id, [])
+
+    def containers_sessions(self, container_ids: List[str], t1: datetime,
+                            t2: datetime) -> Dict[str, List[Tuple[datetime, int]]]:
+        """Archived (datetime, session_id) of each container that has any, in one pass over the months"""
+        wanted = pa.array(container_ids, pa.string())
+
+        def condition(batch):
+            containers = batch['containers']
+            matches = pc.is_in(pc.list_flatten(containers), value_set=wanted)
+            parents = pc.filter(pc.list_parent_indices(containers), matches)
+            return pc.is_in(pa.array(range(len(batch)), pa.int64()), value_set=parents.cast(pa.int64()))
+
+        sessions: Dict[str, List[Tuple[datetime, int]]] = {}
+        requested = set(container_ids)
+        for row in self._filtered(self._paths(self.months(t1, t2)), t1, t2, condition):
+            for container_id in set(row['containers']) & requested:
+                sessions.setdefault(container_id, []).append((row['datetime'], row['id']))
+        return {container_id: sorted(found) for container_id, found in sessions.items()}
+
+    def truck_sessions(self, truck: str, t1: datetime, t2: datetime) -> List[Tuple[datetime, int]]:
+        return self.trucks_sessions([truck], t1, t2).get(truck, [])
+
+    def trucks_sessions(self, trucks: List[str], t1: datetime, t2: datetime) -> Dict[str, List[Tuple[datetime, int]]]:
+        wanted = pa.array(trucks, pa.string())
+        sessions: Dict[str, List[Tuple[datetime, int]]] = {}
+        for row in self._filtered(self._paths(self.months(t1, t2)), t1, t2,
+                                  lambda batch: pc.is_in(batch['truck'], value_set=wanted)):
+            sessions.setdefault(row['truck'], []).append((row['datetime'], row['id']))
+        return {truck: sorted(found) for truck, found in sessions.items()}
@@ -0,0 +1,86 @@
+import os
+import asyncio
+import threading
+from typing import Callable, Dict, Optional
+
+from a2wsgi.wsgi import WSGIMiddleware, WSGIResponder
+
+# Request handlers running at once, idle and slow client connections don't hold a thread
+ASGI_WORKER_THREADS = int(os.environ.get('ASGI_WORKER_THREADS', '200'))
+
+class WSGIToASGI(WSGIMiddleware):
+    """
+    ASGI application serving a WSGI app (the Flask weight service) from an asyncio event loop, on a2wsgi.
+    The loop owns the connections, the blocking handlers run on a pool of max_threads threads and
+    response bodies are sent chunk by chunk, so streamed routes stay streamed. on_startup runs on the
+    pool when the server sends the lifespan startup
+    """
+
+    def __init__(self, wsgi_app: Callable, max_threads: int = ASGI_WORKER_THREADS,
+                 on_startup: Optional[Callable[[], None]] = None):
+        super().__init__(wsgi_app, workers=max_threads)
+        self.on_startup = on_startup
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] == 'http':
+            await Responder(self.app, self.executor, self.send_queue_size)(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if self.on_startup is not None:
+                        await asyncio.get_running_loop().run_in_executor(self.executor, self.on_startup)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+class Responder(WSGIResponder):
+    """
+    Serves one http request, the request body ends where the client's last message says, with or without a length.
+    A listener task reads the client's messages for the whole request, once the client disconnects the response
+    iterator is not stepped any further and is closed, so an abandoned stream gives its thread back at its next chunk
+    """
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable) -> None:
+        self.disconnected = threading.Event()
+        messages: asyncio.Queue = asyncio.Queue()
+        listener = self.loop.create_task(self._listen(receive, messages))
+        try:
+            await super().__call__(scope, messages.get, send)
+        finally:
+            listener.cancel()
+
+    async def _listen(self, receive: Callable, messages: asyncio.Queue) -> None:
+        while True:
+            message = await receive()
+            # The request body is read from the queue, a disconnect also ends a body still being read
+            await messages.put(message)
+            if message['type'] == 'http.disconnect':
+                self.disconnected.set()
+                return
+
+    def wsgi(self, environ: Dict, start_response: Callable) -> None:
+        environ['wsgi.input_terminated'] = True
+        chunks = self.app(environ, start_response)
+        try:
+            for chunk in chunks:
+                if self.disconnected.is_set():
+                    return
+                self.send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            self.send({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Runs the app context teardown, which hands the repository connection back
+            if hasattr(chunks, 'close'):
+                chunks.close()
@@ -0,0 +1,211 @@
+import csv
+import json
+import time
+import itertools
+from pathlib import Path
+from typing import Union, List, Tuple, Dict, Optional, Iterator, Callable
+
+# Parsers of the /batch-weight files, kept apart from the service so that
+# parse_batch_file can run in worker processes without importing Flask or the storage
+
+def convert_to_kg(weight: Union[int, float, str], unit: str = 'kg') -> int:
+    """
+    Convert weight to kilograms
+    Args:
+        weight: The weight value to convert
+        unit: The unit of the weight (kg/lbs), defaults to 'kg'
+    Returns:
+        Weight in kilograms as integer
+    """
+    weight = float(weight)
+    if unit.lower() == 'lbs':
+        return int(weight * 0.453592)
+    return int(weight)
+
+# Bytes read per call by the incremental JSON array parser
+JSON_READ_SIZE = 64 * 1024
+
+class BatchRecordError(ValueError):
+    """An invalid record that aborts its file, line is the CSV line or the number of the JSON item"""
+
+    def __init__(self, message: str, line: int):
+        super().__init__(message, line)
+        self.line = line
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+def parse_csv_row(row: List[str], default_unit: str = 'kg') -> Optional[Tuple[str, int]]:
+    """
+    Parse a single CSV row into a (container_id, weight_kg) tuple
+    Supports both formats:
+    - id,weight (in default_unit)
+    - id,weight,unit
+    Returns None for empty rows
+    """
+    if not row:
+        return None
+
+    if len(row) >= 3:  # Format: id,weight,unit
+        container_id, weight, unit = row[0], row[1], row[2]
+    else:  # Format: id,weight
+        container_id, weight, unit = row[0], row[1], default_unit
+
+    return container_id, convert_to_kg(weight, unit)
+
+def iter_csv_records(f, on_error: Optional[Callable[[str], None]] = None) -> Iterator[Tuple[str, int]]:
+    """
+    Lazily yield (container_id, weight_kg) tuples from an open CSV file
+    A header row ("id","kg" or "id","lbs") is skipped and sets the unit of two column rows
+    Invalid rows abort the file, unless on_error is given, in which case they are reported and skipped
+    """
+    try:
+        csv_reader = csv.reader(f)
+        header = next(csv_reader, None)
+        default_unit = 'kg'
+
+        rows = csv_reader
+        if header and header[0].lower() == 'id':
+            if len(header) >= 2 and header[1].lower() in ('kg', 'lbs'):
+                default_unit = header[1].lower()
+        elif header is not None:
+            # If no header, process the first row as data
+            rows = itertools.chain([header], csv_reader)
+
+        for row in rows:
+            try:
+                record = parse_csv_row(row, default_unit)
+            except (ValueError, IndexError) as e:
+                if on_error is None:
+                    raise BatchRecordError(f"Invalid row {row} on line {csv_reader.line_num}: {e}",
+                                           csv_reader.line_num)
+                on_error(f"Invalid row {row}: {e}")
+                continue
+            if record:
+                yield record
+
+    except BatchRecordError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error processing CSV file: {str(e)}")
+
+def iter_json_array(f, read_size: int = JSON_READ_SIZE) -> Iterator:
+    """
+    Incrementally parse a top level JSON array from a text file object,
+    yielding one element at a time while holding at most one element plus one read in memory
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(read_size)
+    eof = not buffer
+    pos = 0
+    started = False
+    expect_value = True
+    count = 0
+
+    while True:
+        # Skip whitespace, refilling the buffer when it runs out
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer = f.read(read_size)
+            pos = 0
+            eof = not buffer
+
+        if pos >= len(buffer):
+            raise json.JSONDecodeError("Unterminated array", buffer, pos)
+
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise ValueError("JSON file must contain an array of objects")
+            started = True
+            pos += 1
+            continue
+        if char == ']':
+            if expect_value and count:
+                raise json.JSONDecodeError("Trailing comma in array", buffer, pos)
+            return
+        if char == ',' and not expect_value:
+            expect_value = True
+            pos += 1
+            continue
+        if not expect_value:
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+
+        if not complete:
+            # Element spans the end of the buffer, read more and decode again
+            more = f.read(read_size)
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+
+        yield item
+        count += 1
+        expect_value = False
+        pos = end
+        if pos > read_size:
+            buffer = buffer[pos:]
+            pos = 0
+
+def parse_json_item(item) -> Tuple[str, int]:
+    """Parse a single {"id": ..., "weight": ..., "unit": ...} object into a (container_id, weight_kg) tuple"""
+    if not isinstance(item, dict):
+        raise ValueError("Each item in JSON must be an object")
+    if 'id' not in item or 'weight' not in item:
+        raise ValueError("Each item must have 'id' and 'weight' fields")
+    return item['id'], convert_to_kg(item['weight'], item.get('unit', 'kg'))
+
+def iter_json_records(f, on_error: Optional[Callable[[str], None]] = None) -> Iterator[Tuple[str, int]]:
+    """
+    Lazily yield (container_id, weight_kg) tuples from an open JSON file
+    Expected format: [{"id": "...", "weight": ..., "unit": "..."}]
+    Invalid items abort the file, unless on_error is given, in which case they are reported and skipped
+    """
+    try:
+        for number, item in enumerate(iter_json_array(f), 1):
+            try:
+                yield parse_json_item(item)
+            except ValueError as e:
+                if on_error is None:
+                    raise BatchRecordError(f"Invalid item {item} (item {number}): {e}", number)
+                on_error(f"Invalid item {item}: {e}")
+    except BatchRecordError:
+        raise
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON format: {str(e)}")
+    except Exception as e:
+        raise ValueError(f"Error processing JSON file: {str(e)}")
+
+# File types accepted by /batch-weight
+BATCH_FILE_EXTENSIONS = ('.csv', '.json')
+
+def iter_batch_records(f, ext: str, on_error: Optional[Callable[[str], None]] = None) -> Iterator[Tuple[str, int]]:
+    """Dispatch an open batch file to the CSV or JSON record parser by extension"""
+    if ext == '.json':
+        return iter_json_records(f, on_error)
+    return iter_csv_records(f, on_error)
+
+def parse_batch_file(path: str) -> Dict:
+    """
+    Parse a whole batch file, the unit of work of the multi-file mode's process pool
+    Returns {"file", "records": [(container_id, weight_kg)], "seconds"}, invalid records abort the file
+    """
+    started = time.monotonic()
+    file_path = Path(path)
+    with open(file_path, 'r', newline='') as f:
+        try:
+            records = list(iter_batch_records(f, file_path.suffix.lower()))
+        except BatchRecordError as e:
+            raise BatchRecordError(f"{file_path.name}: {e}", e.line)
+    return {"file": file_path.name, "records": records, "seconds": time.monotonic() - started}
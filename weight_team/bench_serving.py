@@ -0,0 +1,113 @@
+"""
+Compares the sync (Flask development server) and async (uvicorn) serving modes of the weight service.
+Each mode is started as a subprocess on its own port with the current environment (storage settings
+included), seeded with a few weighings, then loaded by --concurrency keep-alive clients that mix
+scale posts with dashboard reads.
+
+    WEIGHT_STORAGE=sqlite python bench_serving.py --concurrency 300 --requests 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+from typing import Dict, List
+
+MODES = ('wsgi', 'asgi')
+
+def request(connection: http.client.HTTPConnection, method: str, path: str, body: Dict = None) -> int:
+    payload = json.dumps(body).encode() if body is not None else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    connection.request(method, path, body=payload, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+def wait_until_up(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            request(http.client.HTTPConnection('127.0.0.1', port, timeout=2), 'GET', '/unknown')
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Service on port {port} did not start within {timeout}s")
+
+def client(port: int, index: int, requests: int, latencies: List[float], errors: List[int]) -> None:
+    """One scale or dashboard: every fourth client posts weighings, the others read sessions and the latest weighings"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    for i in range(requests):
+        if index % 4 == 0:
+            call = ('POST', '/weight', {"direction": "none", "truck": "na", "containers": f"BENCH-{index}-{i}",
+                                        "weight": 100, "unit": "kg", "force": False, "produce": "na"})
+        elif i % 2:
+            call = ('GET', f'/session/{10001 + i % 10}', None)
+        else:
+            call = ('GET', '/weight?limit=50', None)
+        started = time.perf_counter()
+        try:
+            status = request(connection, *call)
+        except (OSError, http.client.HTTPException):
+            status = 0
+            connection.close()
+        latencies.append(time.perf_counter() - started)
+        if status >= 400 or status == 0:
+            errors.append(status)
+    connection.close()
+
+def percentile(values: List[float], p: int) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] if ordered else 0.0
+
+def run_mode(mode: str, port: int, concurrency: int, requests: int) -> Dict:
+    env = dict(os.environ, WEIGHT_SERVING_MODE=mode, WEIGHT_PORT=str(port))
+    # Its own session, so the development server's reloader child is stopped with it
+    server = subprocess.Popen([sys.executable, 'weight_service.py'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        wait_until_up(port, 30)
+        seed = http.client.HTTPConnection('127.0.0.1', port)
+        for i in range(10):
+            request(seed, 'POST', '/weight', {"direction": "in", "truck": f"BENCH-T{i}", "containers": "",
+                                              "weight": 1000, "unit": "kg", "force": True, "produce": "na"})
+        latencies: List[float] = []
+        errors: List[int] = []
+        threads = [threading.Thread(target=client, args=(port, i, requests, latencies, errors))
+                   for i in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        os.killpg(server.pid, 15)
+        server.wait()
+    return {
+        "mode": mode,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 2),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=200, help="Concurrent client connections")
+    parser.add_argument('--requests', type=int, default=20, help="Requests per connection")
+    parser.add_argument('--port', type=int, default=5100, help="First port, each mode takes the next one")
+    parser.add_argument('--modes', default=','.join(MODES), help="Comma separated modes to run")
+    args = parser.parse_args()
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} storage={os.environ.get('WEIGHT_STORAGE', 'mysql')} "
+          f"concurrency={args.concurrency} requests={args.requests}")
+    for offset, mode in enumerate(args.modes.split(',')):
+        print(json.dumps(run_mode(mode, args.port + offset, args.concurrency, args.requests)))
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,9 @@ CREATE TABLE IF NOT EXISTS `containers_registered` (
   `container_id` varchar(15) NOT NULL,       -- Unique container identifier
   `weight` int(12) DEFAULT NULL,            -- Container's weight
   `unit` varchar(10) DEFAULT NULL,          -- Weight unit (e.g., kg)
-  PRIMARY KEY (`container_id`)              -- Set container_id as primary key
-) ENGINE=MyISAM;
+  PRIMARY KEY (`container_id`),             -- Set container_id as primary key
+  KEY `idx_weight` (`weight`)               -- Seeds unknown_containers in migration 4
+) ENGINE=InnoDB;
 
 -- Create transactions table
 -- Records all weighing transactions including truck and container details
@@ -25,7 +26,112 @@ CREATE TABLE IF NOT EXISTS `transactions` (
   `truckTara` int(12) DEFAULT NULL,        -- Truck's empty weight
   `neto` int(12) DEFAULT NULL,             -- Net weight (bruto - tara)
   `produce` varchar(50) DEFAULT NULL,       -- Type of produce being transported
-  PRIMARY KEY (`id`)                        -- Set id as primary key
-) ENGINE=MyISAM AUTO_INCREMENT=10001;
+  PRIMARY KEY (`id`),                       -- Set id as primary key
+  KEY `idx_datetime_direction` (`datetime`, `direction`),                -- /weight and /weight/summary ranges
+  KEY `idx_truck_direction_datetime` (`truck`, `direction`, `datetime`)  -- /item truck history and last tara
+) ENGINE=InnoDB AUTO_INCREMENT=10001;
+
+-- Create transaction_containers table
+-- Normalized container/session association, one row per container in a transaction.
+-- Lets container history be served by an index range scan instead of scanning the CSV column.
+CREATE TABLE IF NOT EXISTS `transaction_containers` (
+  `container_id` varchar(50) NOT NULL,      -- Container identifier
+  `datetime` datetime NOT NULL,             -- Copy of transactions.datetime for range lookups
+  `session_id` int(12) NOT NULL,            -- transactions.id
+  PRIMARY KEY (`container_id`, `datetime`, `session_id`),
+  KEY `idx_session` (`session_id`)          -- Used to re-index a session on force overwrite
+) ENGINE=InnoDB;
+
+-- Create open_sessions table
+-- One row per truck that is currently weighed in, kept in the same transaction as the in/out weighing.
+-- The primary key guarantees a single open session per truck, InnoDB row locks serialize concurrent weighings.
+CREATE TABLE IF NOT EXISTS `open_sessions` (
+  `truck` varchar(50) NOT NULL,             -- Truck identifier
+  `session_id` int(12) NOT NULL,            -- transactions.id of the "in" weighing
+  `opened_at` datetime DEFAULT NULL,        -- Time of the "in" weighing
+  PRIMARY KEY (`truck`),
+  KEY `idx_session` (`session_id`)          -- Keeps open "in" weighings out of the archive
+) ENGINE=InnoDB;
+
+-- Create batch_jobs table
+-- Progress of asynchronous /batch-weight jobs, updated with every committed chunk
+CREATE TABLE IF NOT EXISTS `batch_jobs` (
+  `id` int(12) NOT NULL AUTO_INCREMENT,     -- Job identifier
+  `file` varchar(255) NOT NULL,             -- File name in the /in folder
+  `status` varchar(10) NOT NULL,            -- queued/running/done/failed
+  `rows_committed` int(12) NOT NULL DEFAULT 0,  -- Records written so far
+  `resumed_from` int(12) NOT NULL DEFAULT 0,    -- rows_committed when the current run started
+  `bytes_committed` bigint NOT NULL DEFAULT 0,  -- File offset reached by the last committed chunk
+  `total_bytes` bigint DEFAULT NULL,        -- File size
+  `error_count` int(12) NOT NULL DEFAULT 0, -- Invalid records skipped
+  `last_error` varchar(1000) DEFAULT NULL,  -- Last error message
+  `created_at` datetime DEFAULT NULL,
+  `started_at` datetime DEFAULT NULL,
+  `updated_at` datetime DEFAULT NULL,
+  `finished_at` datetime DEFAULT NULL,
+  `neto_updated` int(12) NOT NULL DEFAULT 0,    -- Sessions whose NULL neto the job filled in
+  PRIMARY KEY (`id`),
+  KEY `idx_status` (`status`)               -- Used to resume unfinished jobs on startup
+) ENGINE=InnoDB;
+
+-- Create unknown_containers table
+-- Containers whose tara is unknown: registered with no weight, or weighed but never registered.
+-- Maintained by every weighing and batch upload so /unknown reads it instead of scanning the registry.
+CREATE TABLE IF NOT EXISTS `unknown_containers` (
+  `container_id` varchar(50) NOT NULL,      -- Container identifier
+  PRIMARY KEY (`container_id`)
+) ENGINE=InnoDB;
+
+-- Create ingested_files table
+-- Content hashes of the files the folder watcher applied, a file with a known hash is skipped
+CREATE TABLE IF NOT EXISTS `ingested_files` (
+  `sha256` char(64) NOT NULL,               -- SHA-256 of the file content
+  `file` varchar(255) NOT NULL,             -- File name in the /in folder when it was applied
+  `records` int(12) NOT NULL DEFAULT 0,     -- Records read from the file
+  `ingested_at` datetime DEFAULT NULL,
+  PRIMARY KEY (`sha256`)
+) ENGINE=InnoDB;
+
+-- Create daily_rollups table
+-- Weighings per day, produce and direction, updated by every weighing so range totals read a row per day
+CREATE TABLE IF NOT EXISTS `daily_rollups` (
+  `day` date NOT NULL,                      -- Date of the transactions
+  `produce` varchar(50) NOT NULL,           -- Produce, 'na' when the transaction has none
+  `direction` varchar(10) NOT NULL,         -- Direction (in/out/none)
+  `weighings` int(12) NOT NULL DEFAULT 0,   -- Number of transactions
+  `bruto_sum` bigint NOT NULL DEFAULT 0,    -- Sum of bruto
+  `neto_sum` bigint NOT NULL DEFAULT 0,     -- Sum of the known netos
+  `neto_unknown` int(12) NOT NULL DEFAULT 0, -- Transactions with a NULL neto
+  PRIMARY KEY (`day`, `produce`, `direction`)
+) ENGINE=InnoDB;
+
+-- Create trucks table
+-- Registry of the weighed trucks, updated by every in/out weighing so /item reads a single row per truck
+CREATE TABLE IF NOT EXISTS `trucks` (
+  `truck` varchar(50) NOT NULL,             -- Truck license plate
+  `last_tara` int(12) DEFAULT NULL,         -- truckTara of the latest "out"
+  `tara_at` datetime DEFAULT NULL,          -- Time of the latest "out"
+  `last_seen` datetime DEFAULT NULL,        -- Time of the latest weighing
+  `sessions` int(12) NOT NULL DEFAULT 0,    -- Number of completed (weighed out) sessions
+  PRIMARY KEY (`truck`)
+) ENGINE=InnoDB;
+
+-- Create schema_migrations table
+-- Versions applied by migrations.py, this script creates the current schema so it records all of them
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` int(12) NOT NULL,               -- migrations.MIGRATIONS version
+  `description` varchar(255) NOT NULL,
+  `applied_at` datetime NOT NULL,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB;
+
+INSERT IGNORE INTO `schema_migrations` (`version`, `description`, `applied_at`) VALUES
+  (1, 'Convert tables to InnoDB', NOW()),
+  (2, 'Indexes for the /weight, /item and weigh-out access paths', NOW()),
+  (3, 'Count of sessions whose neto a batch job filled in', NOW()),
+  (4, 'Materialized set of containers with an unknown tara', NOW()),
+  (5, 'Content hashes of the files applied by the folder watcher', NOW()),
+  (6, 'Daily rollups per produce and direction', NOW()),
+  (7, 'Truck registry with the last tara, last weighing and session count', NOW());
 
 -- End of initialization script
\ No newline at end of file
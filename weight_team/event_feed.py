@@ -0,0 +1,59 @@
+import os
+import itertools
+import threading
+from collections import deque
+from typing import Any, List, Optional, Tuple
+
+class EventFeed:
+    """
+    In-process fan-out of published events to any number of subscribers, the last buffer_size events
+    are kept in a ring buffer so a subscriber resuming after the id of the last event it got misses nothing.
+    Event ids are "<feed epoch>-<sequence>", an id from another process (or before a restart)
+    or older than the buffer can't be resumed
+    """
+
+    def __init__(self, buffer_size: int = 1000):
+        self._events: "deque[Tuple[int, Any]]" = deque(maxlen=buffer_size)
+        self._sequence = 0
+        self._epoch = os.urandom(4).hex()
+        self._changed = threading.Condition()
+
+    def event_id(self, sequence: int) -> str:
+        return f"{self._epoch}-{sequence}"
+
+    def position(self) -> int:
+        """Sequence of the last published event, subscribe after it to get only new events"""
+        with self._changed:
+            return self._sequence
+
+    def publish(self, data: Any) -> str:
+        with self._changed:
+            self._sequence += 1
+            self._events.append((self._sequence, data))
+            self._changed.notify_all()
+            return self.event_id(self._sequence)
+
+    def resume_position(self, last_event_id: str) -> Optional[int]:
+        """Sequence to continue after for a Last-Event-ID, None if the events after it are not all buffered"""
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self._epoch or not sequence.isdigit():
+            return None
+        with self._changed:
+            if not self._readable(int(sequence)):
+                return None
+        return int(sequence)
+
+    def _readable(self, after: int) -> bool:
+        oldest = self._events[0][0] if self._events else self._sequence + 1
+        return oldest - 1 <= after <= self._sequence
+
+    def wait(self, after: int, timeout: float) -> Optional[List[Tuple[int, Any]]]:
+        """
+        The (sequence, data) events published after the given sequence, waiting up to timeout seconds
+        for one. Empty on timeout, None if some of them already left the buffer
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._sequence > after, timeout)
+            if not self._readable(after):
+                return None
+            return list(itertools.islice(self._events, len(self._events) - (self._sequence - after), None))
@@ -0,0 +1,97 @@
+import io
+import csv
+import itertools
+from typing import Iterable, Iterator, Dict
+
+from archive import archive_available, transaction_schema
+from storage import TRANSACTION_COLUMNS, split_containers
+
+if archive_available():
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+
+# Rows per CSV chunk or Arrow record batch (Parquet row group), bounds the memory of an export
+EXPORT_BATCH_ROWS = 10000
+# format -> (mimetype, file extension), Parquet and Arrow need pyarrow
+EXPORT_FORMATS: Dict[str, tuple] = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+def iter_batches(rows: Iterable[tuple], size: int = EXPORT_BATCH_ROWS) -> Iterator[list]:
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def iter_csv(rows: Iterable[tuple]) -> Iterator[bytes]:
+    """CSV with a header row, one chunk per EXPORT_BATCH_ROWS transaction rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TRANSACTION_COLUMNS)
+    for batch in iter_batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink:
+    """Write-only file object that collects what pyarrow writes until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _record_batch(batch: list, schema) -> "pa.RecordBatch":
+    columns = list(zip(*batch))
+    containers = TRANSACTION_COLUMNS.index('containers')
+    columns[containers] = [split_containers(value) for value in columns[containers]]
+    return pa.record_batch([pa.array(column, field.type) for column, field in zip(columns, schema)], schema=schema)
+
+def iter_columnar(rows: Iterable[tuple], export_format: str) -> Iterator[bytes]:
+    """
+    Parquet (one zstd row group per EXPORT_BATCH_ROWS rows) or an Arrow IPC stream (one record batch each),
+    containers as a list column. Bytes are yielded as soon as each batch is written
+    """
+    schema = transaction_schema()
+    sink = _ChunkSink()
+    if export_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for batch in iter_batches(rows):
+            writer.write_batch(_record_batch(batch, schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
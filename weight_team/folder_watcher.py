@@ -0,0 +1,102 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # The folder is polled without inotify_simple
+    INotify = None
+
+def inotify_available() -> bool:
+    return INotify is not None
+
+
+class FolderWatcher:
+    """
+    Calls on_file(path) for files with one of the extensions that are added to or rewritten in a folder.
+    With inotify_simple files are reported when closed after writing or moved in, otherwise the folder
+    is polled every poll_seconds and a file is reported once its size and mtime were stable for a round.
+    Files already present on start are reported too, on_file decides whether they are new.
+    on_file runs on the watcher thread, one file at a time.
+    """
+
+    def __init__(self, folder: str, extensions: Tuple[str, ...], on_file: Callable[[str], None],
+                 poll_seconds: float = 5.0, use_inotify: Optional[bool] = None):
+        self.folder = folder
+        self.extensions = extensions
+        self.on_file = on_file
+        self.poll_seconds = poll_seconds
+        self.use_inotify = inotify_available() if use_inotify is None else use_inotify
+        # path -> (size, mtime_ns) when reported, and when first seen with that state
+        self._reported: Dict[str, Tuple[int, int]] = {}
+        self._pending: Dict[str, Tuple[int, int]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _watched(self, name: str) -> bool:
+        return not name.startswith('.') and os.path.splitext(name)[1].lower() in self.extensions
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        try:
+            entries = list(os.scandir(self.folder))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.is_file() and self._watched(entry.name):
+                st = entry.stat()
+                files[entry.path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def _report(self, path: str) -> None:
+        try:
+            self.on_file(path)
+        except Exception as e:
+            print(f"Error ingesting watched file {path}: {e}")
+
+    def poll_once(self) -> List[str]:
+        """One polling round, reports and returns the files that changed and then stayed unchanged"""
+        files = self._scan()
+        stable = []
+        for path, state in files.items():
+            if self._reported.get(path) == state:
+                continue
+            if self._pending.get(path) == state:
+                del self._pending[path]
+                self._reported[path] = state
+                stable.append(path)
+            else:
+                self._pending[path] = state
+        for known in (self._reported, self._pending):
+            for path in set(known) - set(files):
+                del known[path]
+        for path in stable:
+            self._report(path)
+        return stable
+
+    def _run_polling(self) -> None:
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.poll_seconds)
+
+    def _run_inotify(self) -> None:
+        with INotify() as inotify:
+            inotify.add_watch(self.folder, flags.CLOSE_WRITE | flags.MOVED_TO)
+            for path in sorted(self._scan()):
+                self._report(path)
+            while not self._stop.is_set():
+                for event in inotify.read(timeout=1000):
+                    if self._watched(event.name):
+                        self._report(os.path.join(self.folder, event.name))
+
+    def start(self) -> threading.Thread:
+        os.makedirs(self.folder, exist_ok=True)
+        target = self._run_inotify if self.use_inotify else self._run_polling
+        self._thread = threading.Thread(target=target, name='folder-watcher', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
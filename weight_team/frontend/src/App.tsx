@@ -273,6 +273,14 @@ const App: React.FC = () => {
 
   useEffect(() => {
     fetchTransactions();
+    // New weighings arrive on the stream instead of re-fetching the whole window
+    return weightService.subscribeWeighings(
+      (transaction) => setTransactions((current) => [
+        ...current.filter((t) => t.id !== transaction.id),
+        transaction
+      ]),
+      () => { fetchTransactions(); }
+    );
   }, []);
 
   const handleSubmitWeight = async (formData: WeightFormData): Promise<void> => {
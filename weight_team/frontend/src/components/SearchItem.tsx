@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import {
   TextField,
   Button,
@@ -7,6 +7,7 @@ import {
   DialogContent,
   DialogActions,
   InputAdornment,
+  Autocomplete,
 } from '@mui/material';
 import {
   Search as SearchIcon,
@@ -14,23 +15,47 @@ import {
   Inventory as ContainerIcon
 } from '@mui/icons-material';
 import { useNavigate } from 'react-router-dom';
+import { weightService } from '../services/api';
+import { TruckSuggestion } from '../types/api.types';
+
+// Typing pause before the registered trucks are searched
+const SUGGEST_DELAY_MS = 200;
 
 const SearchItem = () => {
   const [open, setOpen] = useState(false);
   const [itemId, setItemId] = useState('');
+  const [suggestions, setSuggestions] = useState<TruckSuggestion[]>([]);
   const navigate = useNavigate();
 
-  const handleSearch = () => {
-    if (itemId.trim()) {  // רק אם יש ID אחרי הסרת רווחים
-      navigate(`/item/${itemId.trim()}`);  // הסר רווחים לפני הניווט
+  useEffect(() => {
+    if (!open || !itemId) {
+      setSuggestions([]);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      const result = await weightService.searchTrucks(itemId);
+      if (!cancelled) {
+        setSuggestions(result.data || []);
+      }
+    }, SUGGEST_DELAY_MS);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [open, itemId]);
+
+  const handleSearch = (id: string = itemId) => {
+    if (id.trim()) {  // רק אם יש ID אחרי הסרת רווחים
+      navigate(`/item/${id.trim()}`);  // הסר רווחים לפני הניווט
       setOpen(false);
       setItemId('');
     }
   };
 
-  const handleInputChange = (e: React.ChangeEvent<HTMLInputElement>) => {
+  const handleInputChange = (_event: React.SyntheticEvent, value: string) => {
     // נקה רווחים בזמן ההקלדה
-    setItemId(e.target.value.trim());
+    setItemId(value.trim());
   };
 
   return (
@@ -47,32 +72,52 @@ const SearchItem = () => {
       <Dialog open={open} onClose={() => setOpen(false)}>
         <DialogTitle>Search Item</DialogTitle>
         <DialogContent>
-          <TextField
-            autoFocus
-            margin="dense"
-            label="Enter Item ID"
-            fullWidth
-            variant="outlined"
-            value={itemId}
-            onChange={handleInputChange}
-            InputProps={{
-              startAdornment: (
-                <InputAdornment position="start">
-                  {itemId.startsWith('T') ? 
-                    <TruckIcon color="primary" /> : 
-                    <ContainerIcon color="success" />
-                  }
-                </InputAdornment>
-              ),
+          <Autocomplete
+            freeSolo
+            options={suggestions}
+            filterOptions={(options) => options}
+            getOptionLabel={(option) => typeof option === 'string' ? option : option.id}
+            renderOption={(props, option) => (
+              <li {...props} key={option.id}>
+                {option.id} ({option.tara === 'na' ? 'tara unknown' : `${option.tara} kg`}, {option.sessions} sessions)
+              </li>
+            )}
+            inputValue={itemId}
+            onInputChange={handleInputChange}
+            onChange={(_event, value) => {
+              if (value) {
+                handleSearch(typeof value === 'string' ? value : value.id);
+              }
             }}
-            placeholder="T123 for truck, C456 for container"
+            renderInput={(params) => (
+              <TextField
+                {...params}
+                autoFocus
+                margin="dense"
+                label="Enter Item ID"
+                fullWidth
+                variant="outlined"
+                InputProps={{
+                  ...params.InputProps,
+                  startAdornment: (
+                    <InputAdornment position="start">
+                      {itemId.startsWith('T') ?
+                        <TruckIcon color="primary" /> :
+                        <ContainerIcon color="success" />
+                      }
+                    </InputAdornment>
+                  ),
+                }}
+                placeholder="T123 for truck, C456 for container"
+              />
+            )}
           />
         </DialogContent>
         <DialogActions>
           <Button onClick={() => setOpen(false)}>Cancel</Button>
-          <Button 
-            onClick={handleSearch} 
-            variant="contained" 
+          <Button
+            onClick={() => handleSearch()}
+            variant="contained"
             disabled={!itemId.trim()}
           >
             Search
@@ -83,4 +128,4 @@ const SearchItem = () => {
   );
 };
 
-export default SearchItem;
\ No newline at end of file
+export default SearchItem;
@@ -8,19 +8,23 @@ import {
   Tooltip,
   ResponsiveContainer
 } from 'recharts';
-import { WeightTransaction } from '../types/api.types';
+import { WeightSummaryBucket } from '../types/api.types';
 import { Paper, Typography, Box } from '@mui/material';
 
 interface WeightChartProps {
-  transactions: WeightTransaction[];
+  buckets: WeightSummaryBucket[];
 }
 
-const WeightChart: React.FC<WeightChartProps> = ({ transactions }) => {
-  const chartData = transactions.map(t => ({
-    id: t.id,
-    bruto: t.bruto,
-    neto: t.neto || 0
-  }));
+// One point per time bucket, summing over direction and produce
+const WeightChart: React.FC<WeightChartProps> = ({ buckets }) => {
+  const points = new Map<string, { bucket: string; bruto: number; neto: number }>();
+  buckets.forEach(b => {
+    const point = points.get(b.bucket) || { bucket: b.bucket, bruto: 0, neto: 0 };
+    point.bruto += b.bruto.sum || 0;
+    point.neto += b.neto.sum || 0;
+    points.set(b.bucket, point);
+  });
+  const chartData = Array.from(points.values());
 
   return (
     <Paper elevation={2} sx={{ p: 3 }}>
@@ -31,7 +35,7 @@ const WeightChart: React.FC<WeightChartProps> = ({ transactions }) => {
         <ResponsiveContainer>
           <LineChart data={chartData}>
             <CartesianGrid strokeDasharray="3 3" />
-            <XAxis dataKey="id" />
+            <XAxis dataKey="bucket" />
             <YAxis />
             <Tooltip />
             <Line 
@@ -4,7 +4,10 @@ import {
   WeightTransaction, 
   SessionData, 
   ItemData,
-  ApiResponse 
+  TruckSuggestion,
+  ApiResponse,
+  SummaryBucket,
+  WeightSummaryBucket
 } from '../types/api.types';
 
 export const weightService = {
@@ -28,6 +31,26 @@ export const weightService = {
     }
   },
 
+  async getWeightSummary(from: string, to: string, bucket: SummaryBucket = 'hour'): Promise<ApiResponse<WeightSummaryBucket[]>> {
+    try {
+      const response = await fetch(
+        `/api/weight/summary?from=${from}&to=${to}&bucket=${bucket}&filter=in,out`
+      );
+
+      if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.error || 'Failed to fetch weight summary');
+      }
+
+      const data = await response.json();
+      return { data };
+    } catch (error) {
+      return { 
+        error: error instanceof Error ? error.message : 'An error occurred' 
+      };
+    }
+  },
+
   async submitWeight(formData: WeightFormData): Promise<ApiResponse<{ session_id: string }>> {
     try {
       const response = await fetch('/api/weight', {
@@ -86,5 +109,32 @@ export const weightService = {
         error: error instanceof Error ? error.message : 'An error occurred' 
       };
     }
+  },
+
+  async searchTrucks(prefix: string, limit: number = 10): Promise<ApiResponse<TruckSuggestion[]>> {
+    try {
+      const response = await fetch(`/api/trucks?prefix=${encodeURIComponent(prefix)}&limit=${limit}`);
+
+      if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.error || 'Failed to search trucks');
+      }
+
+      const data = await response.json();
+      return { data };
+    } catch (error) {
+      return {
+        error: error instanceof Error ? error.message : 'An error occurred'
+      };
+    }
+  },
+
+  // Committed weighings pushed by the server, EventSource reconnects with Last-Event-ID by itself.
+  // onReset is called when events were missed and the list has to be reloaded. Returns the unsubscribe function
+  subscribeWeighings(onWeighing: (transaction: WeightTransaction) => void, onReset: () => void): () => void {
+    const source = new EventSource('/api/weight/stream?filter=in,out');
+    source.addEventListener('weighing', (event) => onWeighing(JSON.parse((event as MessageEvent).data)));
+    source.addEventListener('reset', () => onReset());
+    return () => source.close();
   }
-};
\ No newline at end of file
+};
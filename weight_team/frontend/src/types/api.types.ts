@@ -44,6 +44,31 @@ export interface ItemData {
   sessions: string[];
 }
 
+export interface TruckSuggestion {
+  id: string;
+  tara: number | 'na';
+  lastSeen: string | null;
+  sessions: number;
+}
+
+export type SummaryBucket = 'hour' | 'day' | 'week';
+
+export interface WeightStats {
+  sum: number | null;
+  p50: number | null;
+  p90: number | null;
+  p99: number | null;
+}
+
+export interface WeightSummaryBucket {
+  bucket: string;
+  direction: Direction;
+  produce: string;
+  count: number;
+  bruto: WeightStats;
+  neto: WeightStats & { known: number };
+}
+
 export interface ApiResponse<T> {
   data?: T;
   error?: string;
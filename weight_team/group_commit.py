@@ -0,0 +1,67 @@
+import threading
+from typing import Any, Callable, List, Optional
+
+class _Group:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.results: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """
+    Coalesces items submitted by concurrent threads into groups applied by a single apply_group(items) call,
+    which returns one result per item, an exception as a result is raised to that item's submitter only.
+    The first submitter of a group waits up to window seconds for others (less once max_items are queued),
+    then runs apply_group on its own thread while later submitters start the next group.
+    apply_group commits before returning, so submit() returns only once its item is durable
+    """
+
+    def __init__(self, apply_group: Callable[[List[Any]], List[Any]], window: float, max_items: int = 64):
+        self.apply_group = apply_group
+        self.window = window
+        self.max_items = max_items
+        self.groups = 0
+        self.items = 0
+        self._pending: Optional[_Group] = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Any:
+        with self._lock:
+            group = self._pending
+            leader = group is None
+            if leader:
+                group = self._pending = _Group()
+            index = len(group.items)
+            group.items.append(item)
+            if len(group.items) >= self.max_items:
+                self._pending = None
+                group.full.set()
+
+        if leader:
+            group.full.wait(self.window)
+            with self._lock:
+                if self._pending is group:
+                    self._pending = None
+                self.groups += 1
+                self.items += len(group.items)
+            try:
+                group.results = self.apply_group(group.items)
+            except BaseException as e:
+                group.error = e
+            finally:
+                group.done.set()
+        else:
+            group.done.wait()
+
+        if group.error is not None:
+            raise group.error
+        result = group.results[index]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def stats(self) -> dict:
+        return {"groups": self.groups, "items": self.items}
@@ -0,0 +1,302 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple, Dict, Optional
+
+from storage import SQLRepository, MySQLRepository
+
+# MySQL error codes for a column or index name that already exists
+ER_DUP_FIELDNAME = 1060
+ER_DUP_KEYNAME = 1061
+
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version int(12) NOT NULL,
+        description varchar(255) NOT NULL,
+        applied_at datetime NOT NULL,
+        PRIMARY KEY (version)
+    ) ENGINE=InnoDB
+"""
+
+# (version, description, statements), applied in order and recorded in schema_migrations.
+# dump.sql creates the final schema and records every version, so new versions must be added there too.
+MIGRATIONS: Tuple[Tuple[int, str, Tuple[str, ...]], ...] = (
+    (1, "Convert tables to InnoDB", (
+        "ALTER TABLE containers_registered ENGINE=InnoDB",
+        "ALTER TABLE transactions ENGINE=InnoDB",
+        "ALTER TABLE transaction_containers ENGINE=InnoDB",
+        "ALTER TABLE batch_jobs ENGINE=InnoDB",
+    )),
+    (2, "Indexes for the /weight, /item and weigh-out access paths", (
+        "ALTER TABLE transactions ADD INDEX idx_datetime_direction (datetime, direction)",
+        "ALTER TABLE transactions ADD INDEX idx_truck_direction_datetime (truck, direction, datetime)",
+        "ALTER TABLE containers_registered ADD INDEX idx_weight (weight)",
+        "ALTER TABLE open_sessions ADD INDEX idx_session (session_id)",
+    )),
+    (3, "Count of sessions whose neto a batch job filled in", (
+        "ALTER TABLE batch_jobs ADD COLUMN neto_updated int(12) NOT NULL DEFAULT 0",
+    )),
+    # Needs transaction_containers backfilled first, flask migrate runs that backfill before migrating
+    (4, "Materialized set of containers with an unknown tara", (
+        """CREATE TABLE IF NOT EXISTS unknown_containers (
+               container_id varchar(50) NOT NULL,
+               PRIMARY KEY (container_id)
+           ) ENGINE=InnoDB""",
+        """INSERT IGNORE INTO unknown_containers (container_id)
+           SELECT container_id FROM containers_registered WHERE weight IS NULL OR weight = 0""",
+        """INSERT IGNORE INTO unknown_containers (container_id)
+           SELECT DISTINCT tc.container_id
+           FROM transaction_containers tc
+           LEFT JOIN containers_registered cr ON cr.container_id = tc.container_id
+           WHERE cr.container_id IS NULL""",
+    )),
+    (5, "Content hashes of the files applied by the folder watcher", (
+        """CREATE TABLE IF NOT EXISTS ingested_files (
+               sha256 char(64) NOT NULL,
+               file varchar(255) NOT NULL,
+               records int(12) NOT NULL DEFAULT 0,
+               ingested_at datetime DEFAULT NULL,
+               PRIMARY KEY (sha256)
+           ) ENGINE=InnoDB""",
+    )),
+    # Seeded from the live table, flask rebuild-rollups adds archived transactions. The startup schema may have
+    # created the table and weighings added to it before this runs, the seed's totals replace theirs
+    (6, "Daily rollups per produce and direction", (
+        """CREATE TABLE IF NOT EXISTS daily_rollups (
+               day date NOT NULL,
+               produce varchar(50) NOT NULL,
+               direction varchar(10) NOT NULL,
+               weighings int(12) NOT NULL DEFAULT 0,
+               bruto_sum bigint NOT NULL DEFAULT 0,
+               neto_sum bigint NOT NULL DEFAULT 0,
+               neto_unknown int(12) NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, produce, direction)
+           ) ENGINE=InnoDB""",
+        """INSERT INTO daily_rollups (day, produce, direction, weighings, bruto_sum, neto_sum, neto_unknown)
+           SELECT DATE(datetime), COALESCE(produce, 'na'), COALESCE(direction, 'na'), COUNT(*),
+                  COALESCE(SUM(bruto), 0), COALESCE(SUM(neto), 0), SUM(neto IS NULL)
+           FROM transactions
+           WHERE datetime IS NOT NULL
+           GROUP BY DATE(datetime), COALESCE(produce, 'na'), COALESCE(direction, 'na')
+           ON DUPLICATE KEY UPDATE weighings = VALUES(weighings), bruto_sum = VALUES(bruto_sum),
+                                   neto_sum = VALUES(neto_sum), neto_unknown = VALUES(neto_unknown)""",
+    )),
+    # Filled by backfill_trucks on startup, which the SQLite engine shares
+    (7, "Truck registry with the last tara, last weighing and session count", (
+        """CREATE TABLE IF NOT EXISTS trucks (
+               truck varchar(50) NOT NULL,
+               last_tara int(12) DEFAULT NULL,
+               tara_at datetime DEFAULT NULL,
+               last_seen datetime DEFAULT NULL,
+               sessions int(12) NOT NULL DEFAULT 0,
+               PRIMARY KEY (truck)
+           ) ENGINE=InnoDB""",
+    )),
+)
+
+def applied_versions(connection) -> Dict[int, datetime]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(SCHEMA_MIGRATIONS_DDL)
+        cursor.execute("SELECT version, applied_at FROM schema_migrations")
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def migrate(connection, target: Optional[int] = None) -> List[int]:
+    """
+    Apply the pending migrations up to target (all by default) on a MySQLdb connection.
+    Columns and indexes that already exist are skipped, tables created by MySQLRepository.SCHEMA come with them.
+    Returns the versions applied
+    """
+    applied = applied_versions(connection)
+    done = []
+    cursor = connection.cursor()
+    try:
+        for version, description, statements in MIGRATIONS:
+            if version in applied or (target is not None and version > target):
+                continue
+            for statement in statements:
+                try:
+                    cursor.execute(statement)
+                except Exception as e:
+                    if getattr(e, 'args', (None,))[0] not in (ER_DUP_FIELDNAME, ER_DUP_KEYNAME):
+                        raise
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                (version, description, datetime.now().replace(microsecond=0))
+            )
+            connection.commit()
+            done.append(version)
+    finally:
+        cursor.close()
+    return done
+
+
+class _NullCursor:
+    """Cursor handed out while recording, so repository methods run without touching the database"""
+    lastrowid = 0
+    rowcount = 0
+    description = None
+
+    def fetchone(self):
+        return (0,)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class RecordingRepository:
+    """Mixin for an SQLRepository engine that records the statements its methods issue instead of executing them"""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.method = None
+        self.statements: List[Tuple[str, str, tuple]] = []
+
+    def _execute(self, query, params=()):
+        self.statements.append((self.method, query, tuple(params)))
+        return _NullCursor()
+
+    def _executemany(self, query, rows):
+        self.statements.append((self.method, query, tuple(rows[0]) if rows else ()))
+
+    def _stream(self, query, params=()):
+        self.statements.append((self.method, query, tuple(params)))
+        return iter(())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+# Methods that read whole tables by design
+FULL_SCAN_ALLOWED = {'iter_container_taras', 'unknown_containers', 'backfill_transaction_containers',
+                     'backfill_open_sessions', 'backfill_trucks', 'clear_daily_rollups'}
+
+def query_plan_workload(now: datetime) -> Tuple[Tuple[str, tuple, dict], ...]:
+    """Every repository method the service calls, with representative arguments"""
+    t1 = now - timedelta(days=30)
+    return (
+        ('iter_weighings', (t1, now, ['in', 'out', 'none']), {}),
+        ('iter_weighings', (t1, now, ['in', 'out'], 10000, 100), {}),
+        ('iter_transactions', (t1, now, ['in', 'out', 'none']), {}),
+        ('weight_summary', (t1, now, ['in', 'out', 'none'], 'day'), {}),
+        ('get_session', (10001,), {}),
+        ('get_sessions', ([10001, 10002],), {}),
+        ('insert_transaction', (now, 'in', 1000, 'T-1', 'C-1', None, None, 'na'), {}),
+        ('get_transaction_bruto', (10001,), {}),
+        ('overwrite_in_transaction', (10001, now, 'C-1', 1000, 'na'), {}),
+        ('index_session_containers', (10001, now, ['C-1']), {}),
+        ('container_sessions', ('C-1', t1, now), {}),
+        ('containers_sessions', (['C-1', 'C-2'], t1, now), {}),
+        ('sessions_missing_neto', (['C-1', 'C-2'],), {}),
+        ('update_netos', ([(10001, 500), (10002, 600)],), {}),
+        ('truck_sessions', ('T-1', t1, now), {}),
+        ('trucks_sessions', (['T-1', 'T-2'], t1, now), {}),
+        ('archivable_transactions', (t1, 100), {}),
+        ('delete_transactions', ([10001],), {}),
+        ('set_transaction_id_floor', (100010001,), {}),
+        ('find_open_session', ('T-1', True), {}),
+        ('claim_open_session', ('T-1', now), {}),
+        ('set_open_session', ('T-1', 10001), {}),
+        ('close_open_session', ('T-1', 10001), {}),
+        ('record_truck', ('T-1', now, 400), {}),
+        ('upsert_trucks', ([('T-1', 400, now, now, 1)],), {}),
+        ('get_truck', ('T-1',), {}),
+        ('get_trucks', (['T-1', 'T-2'],), {}),
+        ('search_trucks', ('T-', 10), {}),
+        ('search_trucks', ('', 10), {}),
+        ('container_tara', ('C-1',), {}),
+        ('container_taras', (['C-1', 'C-2'],), {}),
+        ('upsert_container_taras', ([('C-1', 100)],), {}),
+        ('iter_container_taras', (), {}),
+        ('unknown_containers', (), {}),
+        ('add_unknown_containers', (['C-1', 'C-2'],), {}),
+        ('remove_unknown_containers', (['C-1', 'C-2'],), {}),
+        ('file_ingested', ('0' * 64,), {}),
+        ('record_ingested_file', ('0' * 64, 'containers1.csv', 100, now), {}),
+        ('add_to_daily_rollups', ([(now.date(), 'oranges', 'in', 1, 1000, 0, 1)],), {}),
+        ('daily_rollups', ((now - timedelta(days=30)).date(), now.date(), ['in', 'out']), {}),
+        ('clear_daily_rollups', (), {}),
+        ('create_batch_job', ('containers1.csv', now), {}),
+        ('get_batch_job', (1,), {}),
+        ('update_batch_job', (1,), {'status': 'running'}),
+        ('unfinished_batch_jobs', (), {}),
+        ('backfill_transaction_containers', (), {}),
+        ('backfill_open_sessions', (), {}),
+        ('backfill_trucks', (), {}),
+        ('replication_lag', (), {}),
+    )
+
+def record_queries(connection, engine: type = MySQLRepository) -> Tuple[SQLRepository, List[Tuple[str, str, tuple]]]:
+    """
+    Run the query plan workload on a recording engine.
+    Returns the recorder, whose _sql()/_params() translate for the engine, and the (method, sql, params) statements
+    """
+    repository = type(f"Recording{engine.__name__}", (RecordingRepository, engine), {})(connection)
+    for method, args, kwargs in query_plan_workload(datetime.now().replace(microsecond=0)):
+        repository.method = method
+        result = getattr(repository, method)(*args, **kwargs)
+        if hasattr(result, '__next__'):
+            list(result)
+    return repository, repository.statements
+
+def explainable(method: str, query: str) -> bool:
+    """Statements whose plan is checked: reads and writes that locate rows, outside FULL_SCAN_ALLOWED"""
+    kind = query.split(None, 1)[0].upper()
+    if method in FULL_SCAN_ALLOWED or kind not in ('SELECT', 'UPDATE', 'DELETE', 'INSERT'):
+        return False
+    return kind != 'INSERT' or 'SELECT' in query.upper()
+
+def check_query_plans(connection, min_rows: int = 1000) -> List[str]:
+    """
+    EXPLAIN every statement the service issues and report full table or index scans.
+    A scan is always reported when no index could serve it, and otherwise only when the table
+    holds at least min_rows rows, as the optimizer rightly scans small tables.
+    Returns one message per offending plan row, empty when all plans use an index
+    """
+    problems = []
+    cursor = connection.cursor()
+    try:
+        _, statements = record_queries(connection)
+        for method, query, params in statements:
+            if not explainable(method, query):
+                continue
+            cursor.execute("EXPLAIN " + query, params)
+            columns = [description[0] for description in cursor.description]
+            for row in cursor.fetchall():
+                plan = dict(zip(columns, row))
+                table = plan.get('table') or ''
+                if plan.get('select_type') in ('INSERT', 'REPLACE') or table.startswith('<'):
+                    continue
+                if plan.get('type') not in ('ALL', 'index'):
+                    continue
+                if plan.get('possible_keys') and (plan.get('rows') or 0) < min_rows:
+                    continue
+                problems.append(f"{method}: full {'table' if plan['type'] == 'ALL' else 'index'} scan of "
+                                f"{table} (rows={plan.get('rows')}, possible_keys={plan.get('possible_keys')})")
+    finally:
+        cursor.close()
+    return problems
+
+def check_sqlite_query_plans(connection) -> List[str]:
+    """
+    Same check for the SQLite engine with EXPLAIN QUERY PLAN, which has no row estimates,
+    so every SCAN of a table is reported. Lets the test suite catch plan regressions without MySQL
+    """
+    from storage import SQLiteRepository
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    recorder, statements = record_queries(connection, SQLiteRepository)
+    problems = []
+    for method, query, params in statements:
+        if not explainable(method, query):
+            continue
+        for row in connection.execute("EXPLAIN QUERY PLAN " + recorder._sql(query), recorder._params(params)):
+            words = row[3].split()
+            if words[0] == 'SCAN' and words[1] in tables:
+                problems.append(f"{method}: {row[3]}")
+    return problems
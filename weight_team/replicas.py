@@ -0,0 +1,59 @@
+import time
+import itertools
+from typing import Callable, List, Optional, Tuple
+
+from storage import WeightRepository
+
+class ReplicaRouter:
+    """
+    Hands out repositories on read replicas, in turn, for queries that may lag behind the primary.
+    Each replica's lag is measured on the connection being handed out at most every check_seconds,
+    a replica more than max_lag seconds behind, not replicating or unreachable is skipped until its next check.
+    A replica holds every write committed before its check time minus its lag (and a second, as MySQL
+    reports whole seconds), open(read_after) only returns one that is known to hold the writes up to read_after
+    """
+
+    def __init__(self, factories: List[Callable[[], WeightRepository]], max_lag: float, check_seconds: float = 1.0):
+        self.factories = factories
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        # Per replica: (checked at, lag, fresh as of), fresh as of is None while skipped
+        self._states: List[Tuple[float, Optional[float], Optional[float]]] = [(0.0, None, None)] * len(factories)
+        self._turn = itertools.count()
+
+    def _check(self, index: int, repository: Optional[WeightRepository], now: float) -> None:
+        lag = None
+        if repository is not None:
+            try:
+                lag = repository.replication_lag()
+            except Exception as e:
+                print(f"Error checking read replica {index}: {e}")
+        fresh = now - lag - 1 if lag is not None and lag <= self.max_lag else None
+        self._states[index] = (now, lag, fresh)
+
+    def open(self, read_after: float = 0.0) -> Optional[WeightRepository]:
+        """Repository on a replica holding the writes committed up to read_after (epoch seconds), None if none does"""
+        now = time.time()
+        for _ in range(len(self.factories)):
+            index = next(self._turn) % len(self.factories)
+            checked_at, _, fresh = self._states[index]
+            due = now - checked_at >= self.check_seconds
+            if not due and (fresh is None or fresh < read_after):
+                continue
+            try:
+                repository = self.factories[index]()
+            except Exception as e:
+                print(f"Error connecting to read replica {index}: {e}")
+                self._check(index, None, now)
+                continue
+            if due:
+                self._check(index, repository, now)
+            fresh = self._states[index][2]
+            if fresh is not None and fresh >= read_after:
+                return repository
+            repository.close()
+        return None
+
+    def stats(self) -> List[dict]:
+        return [{"checked_at": checked_at, "lag": lag, "fresh_as_of": fresh}
+                for checked_at, lag, fresh in self._states]
@@ -0,0 +1,71 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+class ResponseCache:
+    """
+    Bounded LRU of rendered GET response bodies, each depending on one tag such as "session:10001" or "item:T-1".
+    Writers call invalidate() with the tags they touched once their transaction is committed, which bumps
+    the tag version, entries stored under an older version are never served again.
+    ETags are derived from the process epoch, the cache key and the tag version, so a matching
+    If-None-Match is answered without rendering anything. State is per process.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        # Versions and invalidation times of recently invalidated tags, bounded like the entries.
+        # Untracked tags are at version _base, which is raised past every evicted version
+        # so that an entry cached before an invalidation can't become current again
+        self.max_tags = 16 * max_entries
+        self._entries: "OrderedDict[str, Tuple[str, int, bytes]]" = OrderedDict()
+        self._versions: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._base = 0
+        self._base_time = 0.0
+        self._epoch = os.urandom(8).hex()
+        self._lock = threading.Lock()
+
+    def version(self, tag: str) -> int:
+        """Current version of a tag, read it before querying the data a response is rendered from"""
+        with self._lock:
+            return self._versions.get(tag, (self._base,))[0]
+
+    def invalidated_at(self, tag: str) -> float:
+        """Time of the last invalidation of a tag (at most that of evicted tags), data read must be newer"""
+        with self._lock:
+            return self._versions.get(tag, (None, self._base_time))[1]
+
+    def etag(self, key: str, version: int) -> str:
+        return hashlib.sha1(f"{self._epoch}:{key}:{version}".encode()).hexdigest()[:24]
+
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        """Cached body of key if it was stored at version, None otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key: str, tag: str, version: int, body: bytes) -> None:
+        """Store a body rendered after reading version, dropped if the tag was invalidated meanwhile"""
+        with self._lock:
+            if self._versions.get(tag, (self._base,))[0] != version:
+                return
+            self._entries[key] = (tag, version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tags: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = (self._versions.get(tag, (self._base,))[0] + 1, now)
+                self._versions.move_to_end(tag)
+            while len(self._versions) > self.max_tags:
+                _, (version, invalidated_at) = self._versions.popitem(last=False)
+                self._base = max(self._base, version)
+                self._base_time = max(self._base_time, invalidated_at)
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from storage import FIRST_TRANSACTION_ID, WeightRepository
+
+# Session ids per site: the site at index i hands out ids from FIRST_TRANSACTION_ID + (i + 1) * SHARD_ID_SPAN,
+# so ids stay unique across sites and tell which site a session belongs to. The ids below the first site's
+# were handed out before sharding, every site may hold some of them
+SHARD_ID_SPAN = 100_000_000
+
+class ShardSet:
+    """
+    The weighing databases of every site, one shard per site, listed in the same order on every instance.
+    The local site's shard is the service's own database, queried by the caller, the remote ones are queried
+    in parallel on a pool of max_threads threads, each on a repository of factories (read-only connections)
+    opened for the query and closed after it. A site's weighings are only written by its own instance,
+    which sets its session id range at startup and invalidates its response cache
+    """
+
+    def __init__(self, sites: List[str], local_site: str, factories: Dict[str, Callable[[], WeightRepository]],
+                 timeout: float = 10.0, max_threads: int = 16):
+        if local_site not in sites:
+            raise ValueError(f"The local site {local_site} is not one of the shards")
+        missing = [site for site in sites if site != local_site and site not in factories]
+        if missing:
+            raise ValueError(f"No database for the sites: {', '.join(missing)}")
+        self.sites = sites
+        self.local_site = local_site
+        self.factories = factories
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_threads, thread_name_prefix='shard')
+
+    def first_id(self, site: str) -> int:
+        return FIRST_TRANSACTION_ID + (self.sites.index(site) + 1) * SHARD_ID_SPAN
+
+    def site_of(self, session_id: int) -> Optional[str]:
+        """The site whose range holds session_id, None for an id from before sharding, which any site may hold"""
+        index = (session_id - FIRST_TRANSACTION_ID) // SHARD_ID_SPAN - 1
+        return self.sites[index] if 0 <= index < len(self.sites) else None
+
+    def _run(self, site: str, query: Callable[[WeightRepository], Any]) -> Any:
+        repository = self.factories[site]()
+        try:
+            return query(repository)
+        finally:
+            repository.close()
+
+    def _submit(self, site: str, query: Callable[[WeightRepository], Any]) -> Future:
+        return self.executor.submit(self._run, site, query)
+
+    def remote_sites(self, sites: Optional[List[str]] = None) -> List[str]:
+        """The remote sites among sites (all by default), in shard order"""
+        return [site for site in self.sites if site != self.local_site and (sites is None or site in sites)]
+
+    def gather(self, query: Callable[[WeightRepository], Any], sites: Optional[List[str]] = None) -> Dict[str, Any]:
+        """query(repository) run on every remote site among sites in parallel, by site in shard order"""
+        futures = {site: self._submit(site, query) for site in self.remote_sites(sites)}
+        return {site: future.result(self.timeout) for site, future in futures.items()}
+
+    def iter_merged(self, fetch_page: Callable[[WeightRepository, Optional[int], int], List[tuple]],
+                    local_rows: Iterator[tuple], after_id: Optional[int], limit: Optional[int],
+                    page_size: int, sites: Optional[List[str]] = None) -> Iterator[tuple]:
+        """
+        Id ordered rows of local_rows and of the remote sites among sites merged by id, at most limit.
+        fetch_page(repository, after_id, size) returns a remote shard's next id ordered page. The first page
+        of every remote shard is requested at once and the next one while the current one is merged,
+        so memory stays bounded by two pages per shard
+        """
+        size = min(page_size, limit) if limit is not None else page_size
+        streams = [local_rows]
+        for site in self.remote_sites(sites):
+            first = self._submit(site, lambda repository: fetch_page(repository, after_id, size))
+            streams.append(self._iter_pages(site, fetch_page, first, size))
+        return itertools.islice(heapq.merge(*streams, key=lambda row: row[0]), limit)
+
+    def _iter_pages(self, site: str, fetch_page: Callable[[WeightRepository, Optional[int], int], List[tuple]],
+                    pending: Future, size: int) -> Iterator[tuple]:
+        while pending is not None:
+            page = pending.result(self.timeout)
+            pending = None
+            if len(page) == size:
+                pending = self._submit(site, lambda repository, after_id=page[-1][0]: fetch_page(repository, after_id, size))
+            yield from page
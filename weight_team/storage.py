@@ -0,0 +1,1571 @@
+import re
+import bisect
+import sqlite3
+import tempfile
+import queue
+import threading
+from math import ceil
+from datetime import date, datetime, timedelta
+from typing import List, Tuple, Dict, Optional, Iterator, Iterable, Callable, Set
+
+try:
+    import MySQLdb
+    from MySQLdb.cursors import SSCursor
+except ImportError:  # Only required by the MySQL engine
+    MySQLdb = None
+    SSCursor = None
+
+# Rows fetched per round trip when streaming a result set
+STREAM_CHUNK_SIZE = 500
+# Time buckets and nearest-rank percentiles of the weight summary
+SUMMARY_BUCKETS = ('hour', 'day', 'week')
+SUMMARY_PERCENTILES = (50, 90, 99)
+# Columns of transactions, in the order get_session() reads them
+TRANSACTION_COLUMNS = ('id', 'datetime', 'direction', 'truck', 'containers',
+                       'bruto', 'truckTara', 'neto', 'produce')
+TRUCK_COLUMNS = ('truck', 'last_tara', 'tara_at', 'last_seen', 'sessions')
+# Columns of batch_jobs, in the order get_batch_job() reads them
+BATCH_JOB_COLUMNS = ('id', 'file', 'status', 'rows_committed', 'resumed_from', 'bytes_committed',
+                     'total_bytes', 'error_count', 'last_error', 'created_at', 'started_at',
+                     'updated_at', 'finished_at', 'neto_updated')
+# MySQL error code for a duplicate key
+ER_DUP_ENTRY = 1062
+# First id handed out for transactions, matches AUTO_INCREMENT=10001 in dump.sql
+FIRST_TRANSACTION_ID = 10001
+
+def split_containers(containers: Optional[str]) -> List[str]:
+    """Split a stored containers CSV value into ids"""
+    if not containers:
+        return []
+    return [c.strip() for c in containers.split(',') if c.strip()]
+
+
+class WeightRepository:
+    """
+    Storage interface of the weight service.
+    Every query the routes issue goes through these methods, so engines are interchangeable:
+    MySQLRepository (production), SQLiteRepository and MemoryRepository (local tests and benchmarks).
+    Writes are not committed until commit() is called.
+    """
+
+    # Lifecycle and transactions
+    def ensure_schema(self) -> None:
+        raise NotImplementedError
+
+    def ping(self) -> None:
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        raise NotImplementedError
+
+    def rollback(self) -> None:
+        raise NotImplementedError
+
+    def savepoint(self, name: str) -> None:
+        raise NotImplementedError
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        raise NotImplementedError
+
+    def release_savepoint(self, name: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def replication_lag(self) -> Optional[float]:
+        """
+        Seconds behind the replication source, 0 when not a replica, None when replication is stopped.
+        Raises when the status can't be read, e.g. without the privilege, which readers treat as not fresh
+        """
+        raise NotImplementedError
+
+    # Transactions (weighings)
+    def iter_weighings(self, t1: datetime, t2: datetime, directions: List[str],
+                       after_id: Optional[int] = None, limit: Optional[int] = None) -> Iterator[tuple]:
+        """Stream (id, direction, bruto, neto, produce, containers) rows in the range, ordered by id"""
+        raise NotImplementedError
+
+    def iter_transactions(self, t1: datetime, t2: datetime, directions: List[str]) -> Iterator[tuple]:
+        """Full rows in TRANSACTION_COLUMNS order, ordered by id and streamed like iter_weighings"""
+        raise NotImplementedError
+
+    def weight_summary(self, t1: datetime, t2: datetime, directions: List[str], bucket: str) -> List[tuple]:
+        """
+        (bucket, direction, produce, count, bruto_sum, neto_sum, neto_known, bruto_p50, neto_p50, ...) rows,
+        percentiles follow SUMMARY_PERCENTILES
+        """
+        raise NotImplementedError
+
+    def get_session(self, session_id) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_sessions(self, session_ids: List[int]) -> Dict[int, Dict]:
+        """The sessions found among session_ids, by id"""
+        raise NotImplementedError
+
+    def insert_transaction(self, timestamp: datetime, direction: str, bruto: int, truck: Optional[str] = None,
+                           containers: Optional[str] = None, truck_tara: Optional[int] = None,
+                           neto: Optional[int] = None, produce: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def overwrite_in_transaction(self, session_id: int, timestamp: datetime, containers: str,
+                                 bruto: int, produce: str) -> None:
+        raise NotImplementedError
+
+    def get_transaction_bruto(self, session_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    def index_session_containers(self, session_id: int, timestamp: datetime, containers_list: List[str]) -> None:
+        """Replace the container/session links of a session"""
+        raise NotImplementedError
+
+    def container_sessions(self, container_id: str, t1: datetime, t2: datetime) -> List[int]:
+        raise NotImplementedError
+
+    def containers_sessions(self, container_ids: List[str], t1: datetime, t2: datetime) -> Dict[str, List[int]]:
+        """container_sessions of several containers, containers without sessions are left out"""
+        raise NotImplementedError
+
+    def sessions_missing_neto(self, container_ids: List[str]) -> List[Tuple[int, int, int, str]]:
+        """(id, bruto, truckTara, containers) of "out" sessions with a NULL neto that weighed any of the containers"""
+        raise NotImplementedError
+
+    def update_netos(self, netos: List[Tuple[int, int]]) -> None:
+        """Set the neto of (session_id, neto) pairs with a single statement"""
+        raise NotImplementedError
+
+    def truck_sessions(self, truck: str, t1: datetime, t2: datetime) -> List[int]:
+        raise NotImplementedError
+
+    # Set-based version of the truck lookup for the batch endpoints
+    def trucks_sessions(self, trucks: List[str], t1: datetime, t2: datetime) -> Dict[str, List[int]]:
+        raise NotImplementedError
+
+    def archivable_transactions(self, cutoff: datetime, limit: int) -> List[Dict]:
+        """Up to limit transactions before cutoff that are not an open "in", oldest first"""
+        raise NotImplementedError
+
+    def delete_transactions(self, session_ids: List[int]) -> None:
+        """Remove transactions and their container links, once they are archived"""
+        raise NotImplementedError
+
+    def set_transaction_id_floor(self, first_id: int) -> None:
+        """Hand out transaction ids from first_id on, unless higher ones were already handed out"""
+        raise NotImplementedError
+
+    # Open sessions
+    def find_open_session(self, truck: str, lock: bool = False) -> Optional[int]:
+        """Session id of the truck's open "in", lock=True holds the row until commit"""
+        raise NotImplementedError
+
+    def claim_open_session(self, truck: str, timestamp: datetime) -> bool:
+        """Insert the truck's open session row, False if the truck already has one, the row is locked either way"""
+        raise NotImplementedError
+
+    def set_open_session(self, truck: str, session_id: int) -> None:
+        raise NotImplementedError
+
+    def close_open_session(self, truck: str, session_id: int) -> None:
+        raise NotImplementedError
+
+    # Truck registry, kept up to date by the weighings
+    def record_truck(self, truck: str, timestamp: datetime, tara: Optional[int] = None) -> None:
+        """Note a weighing of the truck, tara is given for an "out", which also counts a completed session"""
+        raise NotImplementedError
+
+    def upsert_trucks(self, rows: List[Tuple[str, Optional[int], Optional[datetime], datetime, int]]) -> None:
+        """
+        Merge (truck, last_tara, tara_at, last_seen, sessions) rows into the registry as record_truck does,
+        an older tara doesn't replace a newer one and sessions are added
+        """
+        raise NotImplementedError
+
+    def get_truck(self, truck: str) -> Optional[Dict]:
+        """Registry row of a truck (see TRUCK_COLUMNS), None if it was never weighed"""
+        raise NotImplementedError
+
+    def get_trucks(self, trucks: List[str]) -> Dict[str, Dict]:
+        raise NotImplementedError
+
+    def search_trucks(self, prefix: str, limit: int) -> List[Dict]:
+        """Registry rows of the trucks whose id starts with prefix, in id order"""
+        raise NotImplementedError
+
+    # Container registry
+    def container_tara(self, container_id: str) -> Tuple[bool, Optional[int]]:
+        """(registered, weight) of a container"""
+        raise NotImplementedError
+
+    def container_taras(self, container_ids: List[str]) -> Dict[str, Optional[int]]:
+        """Weights of the registered containers among container_ids"""
+        raise NotImplementedError
+
+    def iter_container_taras(self) -> Iterator[Tuple[str, Optional[int]]]:
+        raise NotImplementedError
+
+    # Unknown containers, kept up to date by the weighings and batch uploads
+    def unknown_containers(self) -> List[str]:
+        """Containers registered with no weight or weighed without being registered"""
+        raise NotImplementedError
+
+    def add_unknown_containers(self, container_ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def remove_unknown_containers(self, container_ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def upsert_container_taras(self, chunk: List[Tuple[str, int]]) -> None:
+        raise NotImplementedError
+
+    # Files applied by the folder watcher, by content hash
+    def file_ingested(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    def record_ingested_file(self, sha256: str, filename: str, records: int, ingested_at: datetime) -> None:
+        raise NotImplementedError
+
+    # Daily rollups
+    def add_to_daily_rollups(self, deltas: List[Tuple[date, str, str, int, int, int, int]]) -> None:
+        """Add (day, produce, direction, weighings, bruto_sum, neto_sum, neto_unknown) deltas to the rollup rows"""
+        raise NotImplementedError
+
+    def daily_rollups(self, d1: date, d2: date, directions: List[str]) -> List[tuple]:
+        """(day, produce, direction, weighings, bruto_sum, neto_sum, neto_unknown) rows of the days d1 to d2"""
+        raise NotImplementedError
+
+    def clear_daily_rollups(self) -> None:
+        raise NotImplementedError
+
+    # Batch jobs
+    def create_batch_job(self, filename: str, created_at: datetime) -> int:
+        raise NotImplementedError
+
+    def get_batch_job(self, job_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def update_batch_job(self, job_id: int, **fields) -> None:
+        raise NotImplementedError
+
+    def unfinished_batch_jobs(self) -> List[int]:
+        raise NotImplementedError
+
+    # Backfills run on startup
+    def backfill_transaction_containers(self, chunk_size: int = 5000) -> int:
+        raise NotImplementedError
+
+    def backfill_open_sessions(self) -> int:
+        raise NotImplementedError
+
+    def backfill_trucks(self) -> int:
+        raise NotImplementedError
+
+
+class SQLRepository(WeightRepository):
+    """
+    DB-API implementation shared by the MySQL and SQLite engines.
+    Queries are written for MySQL (format paramstyle), dialect differences are class attributes.
+    """
+
+    INSERT_IGNORE = "INSERT IGNORE"
+    FOR_UPDATE = " FOR UPDATE"
+    UPSERT_TARA = "ON DUPLICATE KEY UPDATE weight=VALUES(weight), unit='kg'"
+    UPSERT_ROLLUP = ("ON DUPLICATE KEY UPDATE weighings = weighings + VALUES(weighings), "
+                     "bruto_sum = bruto_sum + VALUES(bruto_sum), neto_sum = neto_sum + VALUES(neto_sum), "
+                     "neto_unknown = neto_unknown + VALUES(neto_unknown)")
+    # The last tara is the one of the latest "out", which a bulk upload of older readings must not replace
+    UPSERT_TRUCK = ("ON DUPLICATE KEY UPDATE "
+                    "last_tara = IF(VALUES(tara_at) >= COALESCE(tara_at, VALUES(tara_at)), VALUES(last_tara), last_tara), "
+                    "tara_at = IF(VALUES(tara_at) >= COALESCE(tara_at, VALUES(tara_at)), VALUES(tara_at), tara_at), "
+                    "last_seen = GREATEST(COALESCE(last_seen, VALUES(last_seen)), VALUES(last_seen)), "
+                    "sessions = sessions + VALUES(sessions)")
+    # Start of each summary bucket ('%' escaped for the driver)
+    SUMMARY_BUCKET_SQL = {
+        'hour': "DATE_FORMAT(datetime, '%%Y-%%m-%%d %%H:00:00')",
+        'day': "DATE_FORMAT(datetime, '%%Y-%%m-%%d 00:00:00')",
+        'week': "DATE_FORMAT(DATE_SUB(DATE(datetime), INTERVAL WEEKDAY(datetime) DAY), '%%Y-%%m-%%d 00:00:00')",
+    }
+    # Nearest rank of percentile p among n values
+    RANK_SQL = "GREATEST(CEIL({p} / 100 * {n}), 1)"
+    SCHEMA: Tuple[str, ...] = ()
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _sql(self, query: str) -> str:
+        return query
+
+    def _params(self, params: Iterable) -> tuple:
+        return tuple(params)
+
+    def _execute(self, query: str, params: Iterable = ()):
+        cursor = self.connection.cursor()
+        cursor.execute(self._sql(query), self._params(params))
+        return cursor
+
+    def _fetchall(self, query: str, params: Iterable = ()) -> List[tuple]:
+        cursor = self._execute(query, params)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _fetchone(self, query: str, params: Iterable = ()) -> Optional[tuple]:
+        cursor = self._execute(query, params)
+        try:
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    def _executemany(self, query: str, rows: List[tuple]) -> None:
+        cursor = self.connection.cursor()
+        try:
+            cursor.executemany(self._sql(query), [self._params(row) for row in rows])
+        finally:
+            cursor.close()
+
+    def _write(self, query: str, params: Iterable = ()) -> Tuple[int, int]:
+        """Execute a write, returns (lastrowid, rowcount)"""
+        cursor = self._execute(query, params)
+        try:
+            return cursor.lastrowid, cursor.rowcount
+        finally:
+            cursor.close()
+
+    def _stream_cursor(self):
+        return self.connection.cursor()
+
+    def _stream(self, query: str, params: Iterable = ()) -> Iterator[tuple]:
+        """Yield rows fetched in STREAM_CHUNK_SIZE chunks"""
+        cursor = self._stream_cursor()
+        try:
+            cursor.execute(self._sql(query), self._params(params))
+            while True:
+                rows = cursor.fetchmany(STREAM_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def _is_duplicate_key(self, error: Exception) -> bool:
+        raise NotImplementedError
+
+    # Lifecycle and transactions
+    def ensure_schema(self) -> None:
+        for statement in self.SCHEMA:
+            self._write(statement)
+        self.commit()
+
+    def ping(self) -> None:
+        self._fetchone("SELECT 1")
+
+    def replication_lag(self) -> Optional[float]:
+        try:
+            status = self._replica_status("SHOW REPLICA STATUS")
+        except Exception:
+            # Servers before MySQL 8.0.22 only know the older statement and column names
+            status = self._replica_status("SHOW SLAVE STATUS")
+        if status is None:
+            return 0.0
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return float(lag) if lag is not None else None
+
+    def _replica_status(self, query: str) -> Optional[Dict]:
+        cursor = self._execute(query)
+        try:
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description or ()]
+        finally:
+            cursor.close()
+        return dict(zip(columns, row)) if row is not None else None
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.connection.rollback()
+
+    def savepoint(self, name: str) -> None:
+        self._write(f"SAVEPOINT {name}")
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        self._write(f"ROLLBACK TO SAVEPOINT {name}")
+
+    def release_savepoint(self, name: str) -> None:
+        self._write(f"RELEASE SAVEPOINT {name}")
+
+    # Transactions (weighings)
+    def iter_weighings(self, t1, t2, directions, after_id=None, limit=None):
+        query = f"""
+            SELECT id, direction, bruto, neto, produce, containers
+            FROM transactions
+            WHERE datetime BETWEEN %s AND %s
+              AND direction IN ({','.join(['%s'] * len(directions))})
+        """
+        params = [t1, t2, *directions]
+        if after_id is not None:
+            query += " AND id > %s"
+            params.append(after_id)
+        query += " ORDER BY id"
+        if limit is not None:
+            query += " LIMIT %s"
+            params.append(limit)
+        return self._stream(query, params)
+
+    def iter_transactions(self, t1, t2, directions):
+        return self._stream(f"""
+            SELECT {', '.join(TRANSACTION_COLUMNS)}
+            FROM transactions
+            WHERE datetime BETWEEN %s AND %s
+              AND direction IN ({','.join(['%s'] * len(directions))})
+            ORDER BY id
+        """, [t1, t2, *directions])
+
+    def weight_summary(self, t1, t2, directions, bucket):
+        # Percentiles use nearest rank over a ROW_NUMBER() window per group, NULL netos sort last
+        # and are excluded from the neto rank so they never become a percentile
+        bucket_expr = self.SUMMARY_BUCKET_SQL[bucket]
+        partition = f"PARTITION BY {bucket_expr}, direction, produce"
+        percentile_columns = []
+        for p in SUMMARY_PERCENTILES:
+            bruto_rank = self.RANK_SQL.format(p=p, n='bruto_count')
+            neto_rank = self.RANK_SQL.format(p=p, n='neto_count')
+            percentile_columns.append(f"MAX(CASE WHEN bruto_rn = {bruto_rank} THEN bruto END) AS bruto_p{p}")
+            percentile_columns.append(f"MAX(CASE WHEN neto_rn = {neto_rank} THEN neto END) AS neto_p{p}")
+        query = f"""
+            SELECT bucket, direction, produce,
+                   COUNT(*) AS count,
+                   SUM(bruto) AS bruto_sum,
+                   SUM(neto) AS neto_sum,
+                   COUNT(neto) AS neto_known,
+                   {', '.join(percentile_columns)}
+            FROM (
+                SELECT {bucket_expr} AS bucket, direction, produce, bruto, neto,
+                       ROW_NUMBER() OVER ({partition} ORDER BY bruto IS NULL, bruto) AS bruto_rn,
+                       COUNT(bruto) OVER ({partition}) AS bruto_count,
+                       ROW_NUMBER() OVER ({partition} ORDER BY neto IS NULL, neto) AS neto_rn,
+                       COUNT(neto) OVER ({partition}) AS neto_count
+                FROM transactions
+                WHERE datetime BETWEEN %s AND %s
+                  AND direction IN ({','.join(['%s'] * len(directions))})
+            ) AS bucketed
+            GROUP BY bucket, direction, produce
+            ORDER BY bucket, direction, produce
+        """
+        return self._fetchall(query, [t1, t2, *directions])
+
+    def get_session(self, session_id):
+        row = self._fetchone(
+            f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions WHERE id = %s", (session_id,)
+        )
+        return dict(zip(TRANSACTION_COLUMNS, row)) if row else None
+
+    def get_sessions(self, session_ids):
+        placeholders = ", ".join(["%s"] * len(session_ids))
+        rows = self._fetchall(
+            f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions WHERE id IN ({placeholders})", session_ids
+        )
+        return {row[0]: dict(zip(TRANSACTION_COLUMNS, row)) for row in rows}
+
+    def insert_transaction(self, timestamp, direction, bruto, truck=None, containers=None,
+                           truck_tara=None, neto=None, produce=None):
+        session_id, _ = self._write("""
+            INSERT INTO transactions (datetime, direction, truck, containers, bruto, truckTara, neto, produce)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (timestamp, direction, truck, containers, bruto, truck_tara, neto, produce))
+        return session_id
+
+    def overwrite_in_transaction(self, session_id, timestamp, containers, bruto, produce):
+        self._write("""
+            UPDATE transactions
+            SET datetime = %s, containers = %s, bruto = %s, produce = %s
+            WHERE id = %s
+        """, (timestamp, containers, bruto, produce, session_id))
+
+    def get_transaction_bruto(self, session_id):
+        row = self._fetchone("SELECT bruto FROM transactions WHERE id = %s", (session_id,))
+        return row[0] if row else None
+
+    def index_session_containers(self, session_id, timestamp, containers_list):
+        self._write("DELETE FROM transaction_containers WHERE session_id = %s", (session_id,))
+        if containers_list:
+            self._executemany(
+                f"""{self.INSERT_IGNORE} INTO transaction_containers (container_id, datetime, session_id)
+                    VALUES (%s, %s, %s)""",
+                [(container_id, timestamp, session_id) for container_id in set(containers_list)]
+            )
+
+    def container_sessions(self, container_id, t1, t2):
+        # Range scan on the transaction_containers primary key
+        rows = self._fetchall("""
+            SELECT session_id
+            FROM transaction_containers
+            WHERE container_id = %s
+            AND datetime BETWEEN %s AND %s
+            ORDER BY datetime, session_id
+        """, (container_id, t1, t2))
+        return [row[0] for row in rows]
+
+    def containers_sessions(self, container_ids, t1, t2):
+        # One primary key range scan per container
+        placeholders = ", ".join(["%s"] * len(container_ids))
+        rows = self._fetchall(f"""
+            SELECT container_id, session_id
+            FROM transaction_containers
+            WHERE container_id IN ({placeholders})
+            AND datetime BETWEEN %s AND %s
+            ORDER BY container_id, datetime, session_id
+        """, [*container_ids, t1, t2])
+        sessions = {}
+        for container_id, session_id in rows:
+            sessions.setdefault(container_id, []).append(session_id)
+        return sessions
+
+    def sessions_missing_neto(self, container_ids):
+        # Sessions are found by the transaction_containers primary key prefix, then joined by id
+        placeholders = ", ".join(["%s"] * len(container_ids))
+        return self._fetchall(f"""
+            SELECT DISTINCT t.id, t.bruto, t.truckTara, t.containers
+            FROM transaction_containers tc
+            JOIN transactions t ON t.id = tc.session_id
+            WHERE tc.container_id IN ({placeholders})
+              AND t.direction = 'out'
+              AND t.neto IS NULL
+        """, container_ids)
+
+    def update_netos(self, netos):
+        cases = " ".join(["WHEN %s THEN %s"] * len(netos))
+        placeholders = ", ".join(["%s"] * len(netos))
+        self._write(
+            f"UPDATE transactions SET neto = CASE id {cases} END WHERE id IN ({placeholders})",
+            [value for pair in netos for value in pair] + [session_id for session_id, _ in netos]
+        )
+
+    def truck_sessions(self, truck, t1, t2):
+        rows = self._fetchall("""
+            SELECT id
+            FROM transactions
+            WHERE truck = %s
+            AND datetime BETWEEN %s AND %s
+            ORDER BY datetime
+        """, (truck, t1, t2))
+        return [row[0] for row in rows]
+
+    def trucks_sessions(self, trucks, t1, t2):
+        placeholders = ", ".join(["%s"] * len(trucks))
+        rows = self._fetchall(f"""
+            SELECT truck, id
+            FROM transactions
+            WHERE truck IN ({placeholders})
+            AND datetime BETWEEN %s AND %s
+            ORDER BY truck, datetime
+        """, [*trucks, t1, t2])
+        sessions = {}
+        for truck, session_id in rows:
+            sessions.setdefault(truck, []).append(session_id)
+        return sessions
+
+    def archivable_transactions(self, cutoff, limit):
+        rows = self._fetchall(f"""
+            SELECT {', '.join(TRANSACTION_COLUMNS)}
+            FROM transactions
+            WHERE datetime < %s
+              AND NOT EXISTS (SELECT 1 FROM open_sessions WHERE open_sessions.session_id = transactions.id)
+            ORDER BY datetime, id
+            LIMIT %s
+        """, (cutoff, limit))
+        return [dict(zip(TRANSACTION_COLUMNS, row)) for row in rows]
+
+    def delete_transactions(self, session_ids):
+        placeholders = ", ".join(["%s"] * len(session_ids))
+        self._write(f"DELETE FROM transaction_containers WHERE session_id IN ({placeholders})", session_ids)
+        self._write(f"DELETE FROM transactions WHERE id IN ({placeholders})", session_ids)
+
+    def set_transaction_id_floor(self, first_id):
+        # An explicit id moves the auto-increment counter up and never down, unlike ALTER TABLE ... AUTO_INCREMENT,
+        # which would hand out the ids of archived transactions again
+        if self._fetchone("SELECT COALESCE(MAX(id), 0) FROM transactions")[0] < first_id - 1:
+            self._write("INSERT INTO transactions (id) VALUES (%s)", (first_id - 1,))
+            self._write("DELETE FROM transactions WHERE id = %s", (first_id - 1,))
+
+    # Open sessions
+    def find_open_session(self, truck, lock=False):
+        row = self._fetchone(
+            "SELECT session_id FROM open_sessions WHERE truck = %s" + (self.FOR_UPDATE if lock else ""),
+            (truck,)
+        )
+        return row[0] if row else None
+
+    def claim_open_session(self, truck, timestamp):
+        try:
+            self._write("INSERT INTO open_sessions (truck, session_id, opened_at) VALUES (%s, 0, %s)",
+                        (truck, timestamp))
+            return True
+        except Exception as e:
+            if self._is_duplicate_key(e):
+                return False
+            raise
+
+    def set_open_session(self, truck, session_id):
+        self._write("UPDATE open_sessions SET session_id = %s WHERE truck = %s", (session_id, truck))
+
+    def close_open_session(self, truck, session_id):
+        self._write("DELETE FROM open_sessions WHERE truck = %s AND session_id = %s", (truck, session_id))
+
+    # Container registry
+    # Truck registry
+    def record_truck(self, truck, timestamp, tara=None):
+        tara_at = timestamp if tara is not None else None
+        self._write(f"""
+            INSERT INTO trucks ({', '.join(TRUCK_COLUMNS)})
+            VALUES (%s, %s, %s, %s, %s)
+            {self.UPSERT_TRUCK}""",
+            (truck, tara, tara_at, timestamp, 1 if tara is not None else 0)
+        )
+
+    def upsert_trucks(self, rows):
+        if rows:
+            self._executemany(f"""
+                INSERT INTO trucks ({', '.join(TRUCK_COLUMNS)})
+                VALUES (%s, %s, %s, %s, %s)
+                {self.UPSERT_TRUCK}""", rows)
+
+    def get_truck(self, truck):
+        row = self._fetchone(f"SELECT {', '.join(TRUCK_COLUMNS)} FROM trucks WHERE truck = %s", (truck,))
+        return dict(zip(TRUCK_COLUMNS, row)) if row else None
+
+    def get_trucks(self, trucks):
+        placeholders = ", ".join(["%s"] * len(trucks))
+        rows = self._fetchall(f"SELECT {', '.join(TRUCK_COLUMNS)} FROM trucks WHERE truck IN ({placeholders})", trucks)
+        return {row[0]: dict(zip(TRUCK_COLUMNS, row)) for row in rows}
+
+    def search_trucks(self, prefix, limit):
+        # A range on the primary key, which LIKE doesn't use on SQLite
+        query = f"SELECT {', '.join(TRUCK_COLUMNS)} FROM trucks WHERE truck >= %s"
+        params = [prefix]
+        if prefix:
+            query += " AND truck < %s"
+            params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        rows = self._fetchall(query + " ORDER BY truck LIMIT %s", [*params, limit])
+        return [dict(zip(TRUCK_COLUMNS, row)) for row in rows]
+
+    def container_tara(self, container_id):
+        row = self._fetchone("SELECT weight FROM containers_registered WHERE container_id = %s", (container_id,))
+        return (True, row[0]) if row else (False, None)
+
+    def container_taras(self, container_ids):
+        placeholders = ", ".join(["%s"] * len(container_ids))
+        rows = self._fetchall(
+            f"SELECT container_id, weight FROM containers_registered WHERE container_id IN ({placeholders})",
+            container_ids
+        )
+        return dict(rows)
+
+    def iter_container_taras(self):
+        return self._stream("SELECT container_id, weight FROM containers_registered")
+
+    def upsert_container_taras(self, chunk):
+        # A single multi-row statement per chunk
+        placeholders = ", ".join(["(%s, %s, 'kg')"] * len(chunk))
+        self._write(
+            f"""INSERT INTO containers_registered (container_id, weight, unit)
+                VALUES {placeholders}
+                {self.UPSERT_TARA}""",
+            [value for record in chunk for value in record]
+        )
+
+    # Unknown containers
+    def unknown_containers(self):
+        return [row[0] for row in self._fetchall("SELECT container_id FROM unknown_containers")]
+
+    def add_unknown_containers(self, container_ids):
+        placeholders = ", ".join(["(%s)"] * len(container_ids))
+        self._write(f"{self.INSERT_IGNORE} INTO unknown_containers (container_id) VALUES {placeholders}",
+                    container_ids)
+
+    def remove_unknown_containers(self, container_ids):
+        placeholders = ", ".join(["%s"] * len(container_ids))
+        self._write(f"DELETE FROM unknown_containers WHERE container_id IN ({placeholders})", container_ids)
+
+    # Ingested files
+    def file_ingested(self, sha256):
+        return self._fetchone("SELECT 1 FROM ingested_files WHERE sha256 = %s", (sha256,)) is not None
+
+    def record_ingested_file(self, sha256, filename, records, ingested_at):
+        self._write(f"""
+            {self.INSERT_IGNORE} INTO ingested_files (sha256, file, records, ingested_at)
+            VALUES (%s, %s, %s, %s)
+        """, (sha256, filename, records, ingested_at))
+
+    # Daily rollups
+    def add_to_daily_rollups(self, deltas):
+        placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(deltas))
+        self._write(f"""
+            INSERT INTO daily_rollups (day, produce, direction, weighings, bruto_sum, neto_sum, neto_unknown)
+            VALUES {placeholders}
+            {self.UPSERT_ROLLUP}""",
+            [value for delta in deltas for value in delta]
+        )
+
+    def daily_rollups(self, d1, d2, directions):
+        placeholders = ", ".join(["%s"] * len(directions))
+        return self._fetchall(f"""
+            SELECT day, produce, direction, weighings, bruto_sum, neto_sum, neto_unknown
+            FROM daily_rollups
+            WHERE day BETWEEN %s AND %s AND direction IN ({placeholders})
+            ORDER BY day, produce, direction
+        """, (d1, d2, *directions))
+
+    def clear_daily_rollups(self):
+        self._write("DELETE FROM daily_rollups")
+
+    # Batch jobs
+    def create_batch_job(self, filename, created_at):
+        job_id, _ = self._write("""
+            INSERT INTO batch_jobs (file, status, created_at, updated_at)
+            VALUES (%s, 'queued', %s, %s)
+        """, (filename, created_at, created_at))
+        return job_id
+
+    def get_batch_job(self, job_id):
+        row = self._fetchone(f"SELECT {', '.join(BATCH_JOB_COLUMNS)} FROM batch_jobs WHERE id = %s", (job_id,))
+        return dict(zip(BATCH_JOB_COLUMNS, row)) if row else None
+
+    def update_batch_job(self, job_id, **fields):
+        unknown = set(fields) - set(BATCH_JOB_COLUMNS[1:])
+        if unknown:
+            raise ValueError(f"Unknown batch job fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{field} = %s" for field in fields)
+        self._write(f"UPDATE batch_jobs SET {assignments} WHERE id = %s", [*fields.values(), job_id])
+
+    def unfinished_batch_jobs(self):
+        rows = self._fetchall("SELECT id FROM batch_jobs WHERE status IN ('queued', 'running') ORDER BY id")
+        return [row[0] for row in rows]
+
+    # Backfills run on startup
+    def backfill_transaction_containers(self, chunk_size=5000):
+        # Resumes after the highest session already indexed, so running it on every startup is cheap
+        last_id = self._fetchone("SELECT COALESCE(MAX(session_id), 0) FROM transaction_containers")[0]
+        inserted = 0
+        while True:
+            rows = self._fetchall("""
+                SELECT id, datetime, containers
+                FROM transactions
+                WHERE id > %s AND containers IS NOT NULL AND containers <> '' AND datetime IS NOT NULL
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, chunk_size))
+            if not rows:
+                break
+            links = [(container_id, row_datetime, session_id)
+                     for session_id, row_datetime, containers in rows
+                     for container_id in set(split_containers(containers))]
+            if links:
+                self._executemany(
+                    f"""{self.INSERT_IGNORE} INTO transaction_containers (container_id, datetime, session_id)
+                        VALUES (%s, %s, %s)""",
+                    links
+                )
+            self.commit()
+            inserted += len(links)
+            last_id = rows[-1][0]
+        return inserted
+
+    def backfill_open_sessions(self):
+        # Only on first start, from trucks whose latest in/out weighing is an "in"
+        if self._fetchone("SELECT 1 FROM open_sessions LIMIT 1"):
+            return 0
+        _, found = self._write(f"""
+            {self.INSERT_IGNORE} INTO open_sessions (truck, session_id, opened_at)
+            SELECT t.truck, t.id, t.datetime
+            FROM transactions t
+            JOIN (
+                SELECT truck, MAX(id) AS last_id
+                FROM transactions
+                WHERE direction IN ('in', 'out') AND truck IS NOT NULL
+                GROUP BY truck
+            ) AS latest ON t.id = latest.last_id
+            WHERE t.direction = 'in'
+        """)
+        self.commit()
+        return found
+
+    def backfill_trucks(self):
+        # Only on first start, trucks whose weighings are all archived are registered from the archive by the service
+        if self._fetchone("SELECT 1 FROM trucks LIMIT 1"):
+            return 0
+        _, found = self._write(f"""
+            {self.INSERT_IGNORE} INTO trucks ({', '.join(TRUCK_COLUMNS)})
+            SELECT seen.truck, tara.truckTara, tara.datetime, seen.last_seen, seen.sessions
+            FROM (
+                SELECT truck, MAX(datetime) AS last_seen, SUM(CASE WHEN direction = 'out' THEN 1 ELSE 0 END) AS sessions
+                FROM transactions
+                WHERE truck IS NOT NULL
+                GROUP BY truck
+            ) AS seen
+            LEFT JOIN (
+                SELECT truck, truckTara, datetime,
+                       ROW_NUMBER() OVER (PARTITION BY truck ORDER BY datetime DESC, id DESC) AS rn
+                FROM transactions
+                WHERE direction = 'out' AND truckTara IS NOT NULL AND truck IS NOT NULL
+            ) AS tara ON tara.truck = seen.truck AND tara.rn = 1
+        """)
+        self.commit()
+        return found
+
+
+class MySQLRepository(SQLRepository):
+    """MySQL engine over a MySQLdb connection (owned by the caller, e.g. flask_mysqldb)"""
+
+    # Tables added after dump.sql was first deployed, created on startup if missing, see migrations.py for changes
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS transaction_containers (
+            container_id varchar(50) NOT NULL,
+            datetime datetime NOT NULL,
+            session_id int(12) NOT NULL,
+            PRIMARY KEY (container_id, datetime, session_id),
+            KEY idx_session (session_id)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS open_sessions (
+            truck varchar(50) NOT NULL,
+            session_id int(12) NOT NULL,
+            opened_at datetime DEFAULT NULL,
+            PRIMARY KEY (truck),
+            KEY idx_session (session_id)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id int(12) NOT NULL AUTO_INCREMENT,
+            file varchar(255) NOT NULL,
+            status varchar(10) NOT NULL,
+            rows_committed int(12) NOT NULL DEFAULT 0,
+            resumed_from int(12) NOT NULL DEFAULT 0,
+            bytes_committed bigint NOT NULL DEFAULT 0,
+            total_bytes bigint DEFAULT NULL,
+            error_count int(12) NOT NULL DEFAULT 0,
+            last_error varchar(1000) DEFAULT NULL,
+            created_at datetime DEFAULT NULL,
+            started_at datetime DEFAULT NULL,
+            updated_at datetime DEFAULT NULL,
+            finished_at datetime DEFAULT NULL,
+            neto_updated int(12) NOT NULL DEFAULT 0,
+            PRIMARY KEY (id),
+            KEY idx_status (status)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS unknown_containers (
+            container_id varchar(50) NOT NULL,
+            PRIMARY KEY (container_id)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            sha256 char(64) NOT NULL,
+            file varchar(255) NOT NULL,
+            records int(12) NOT NULL DEFAULT 0,
+            ingested_at datetime DEFAULT NULL,
+            PRIMARY KEY (sha256)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            day date NOT NULL,
+            produce varchar(50) NOT NULL,
+            direction varchar(10) NOT NULL,
+            weighings int(12) NOT NULL DEFAULT 0,
+            bruto_sum bigint NOT NULL DEFAULT 0,
+            neto_sum bigint NOT NULL DEFAULT 0,
+            neto_unknown int(12) NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, produce, direction)
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS trucks (
+            truck varchar(50) NOT NULL,
+            last_tara int(12) DEFAULT NULL,
+            tara_at datetime DEFAULT NULL,
+            last_seen datetime DEFAULT NULL,
+            sessions int(12) NOT NULL DEFAULT 0,
+            PRIMARY KEY (truck)
+        ) ENGINE=InnoDB
+        """,
+    )
+
+    def _stream_cursor(self):
+        # Server-side cursor, rows are transferred as they are fetched
+        return self.connection.cursor(SSCursor)
+
+    def _is_duplicate_key(self, error):
+        return isinstance(error, MySQLdb.IntegrityError) and error.args[0] == ER_DUP_ENTRY
+
+    def claim_open_session(self, truck, timestamp):
+        # The upsert locks the row whether it inserts or finds it. A failed insert would hold a shared lock and
+        # a locking read of a missing row a gap lock, concurrent weighings of the truck deadlock upgrading either
+        self._write("""INSERT INTO open_sessions (truck, session_id, opened_at) VALUES (%s, 0, %s)
+                       ON DUPLICATE KEY UPDATE opened_at = opened_at""", (truck, timestamp))
+        # A committed open session has its id set, 0 is the row inserted here
+        return self.find_open_session(truck, lock=True) == 0
+
+    def __init__(self, connection, pool: Optional['MySQLConnectionPool'] = None):
+        super().__init__(connection)
+        self.pool = pool
+
+    def close(self):
+        # A pooled connection is handed back, otherwise flask_mysqldb closes it at app context teardown
+        if self.pool is not None:
+            self.pool.release(self.connection)
+
+
+class MySQLConnectionPool:
+    """
+    Thread-safe pool of up to size MySQLdb connections, opened on demand.
+    acquire() blocks for up to timeout seconds when all of them are taken, a connection that
+    fails its ping is replaced. release() rolls back whatever the borrower left uncommitted
+    """
+
+    def __init__(self, size: int, timeout: float = 30.0, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.connect_args = connect_args
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return MySQLdb.connect(**self.connect_args)
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def acquire(self):
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                return self._connect()
+            try:
+                connection = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No MySQL connection available within {self.timeout}s")
+        try:
+            connection.ping()
+        except MySQLdb.Error:
+            connection.close()
+            return self._connect()
+        return connection
+
+    def release(self, connection) -> None:
+        try:
+            connection.rollback()
+        except MySQLdb.Error:
+            connection.close()
+            with self._lock:
+                self._opened -= 1
+            return
+        self._idle.put(connection)
+
+    def stats(self) -> Dict:
+        return {"size": self.size, "opened": self._opened, "idle": self._idle.qsize()}
+
+
+def _to_sqlite_datetime(value: bytes) -> datetime:
+    text = value.decode()
+    return datetime.fromisoformat(text)
+
+sqlite3.register_converter('datetime', _to_sqlite_datetime)
+sqlite3.register_converter('date', lambda value: date.fromisoformat(value.decode()))
+
+
+class SQLiteRepository(SQLRepository):
+    """SQLite engine, for running the service and its tests without a MySQL server"""
+
+    INSERT_IGNORE = "INSERT OR IGNORE"
+    FOR_UPDATE = ""
+    UPSERT_TARA = "ON CONFLICT(container_id) DO UPDATE SET weight=excluded.weight, unit='kg'"
+    UPSERT_ROLLUP = ("ON CONFLICT(day, produce, direction) DO UPDATE SET "
+                     "weighings = weighings + excluded.weighings, bruto_sum = bruto_sum + excluded.bruto_sum, neto_sum = neto_sum + excluded.neto_sum, "
+                     "neto_unknown = neto_unknown + excluded.neto_unknown")
+    UPSERT_TRUCK = ("ON CONFLICT(truck) DO UPDATE SET "
+                    "last_tara = CASE WHEN excluded.tara_at >= COALESCE(tara_at, excluded.tara_at) "
+                    "THEN excluded.last_tara ELSE last_tara END, "
+                    "tara_at = CASE WHEN excluded.tara_at >= COALESCE(tara_at, excluded.tara_at) "
+                    "THEN excluded.tara_at ELSE tara_at END, "
+                    "last_seen = MAX(COALESCE(last_seen, excluded.last_seen), excluded.last_seen), "
+                    "sessions = sessions + excluded.sessions")
+    SUMMARY_BUCKET_SQL = {
+        'hour': "strftime('%%Y-%%m-%%d %%H:00:00', datetime)",
+        'day': "strftime('%%Y-%%m-%%d 00:00:00', datetime)",
+        'week': "strftime('%%Y-%%m-%%d 00:00:00', datetime, "
+                "'-' || ((CAST(strftime('%%w', datetime) AS INTEGER) + 6) %% 7) || ' days')",
+    }
+    RANK_SQL = "MAX(({p} * {n} + 99) / 100, 1)"
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS containers_registered (
+            container_id TEXT NOT NULL PRIMARY KEY,
+            weight INTEGER DEFAULT NULL,
+            unit TEXT DEFAULT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            datetime DATETIME DEFAULT NULL,
+            direction TEXT DEFAULT NULL,
+            truck TEXT DEFAULT NULL,
+            containers TEXT DEFAULT NULL,
+            bruto INTEGER DEFAULT NULL,
+            truckTara INTEGER DEFAULT NULL,
+            neto INTEGER DEFAULT NULL,
+            produce TEXT DEFAULT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transactions_datetime_direction ON transactions (datetime, direction)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_truck_direction_datetime ON transactions (truck, direction, datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_containers_registered_weight ON containers_registered (weight)",
+        f"""
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'transactions', {FIRST_TRANSACTION_ID - 1}
+        WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions')
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS transaction_containers (
+            container_id TEXT NOT NULL,
+            datetime DATETIME NOT NULL,
+            session_id INTEGER NOT NULL,
+            PRIMARY KEY (container_id, datetime, session_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_transaction_containers_session ON transaction_containers (session_id)",
+        """
+        CREATE TABLE IF NOT EXISTS open_sessions (
+            truck TEXT NOT NULL PRIMARY KEY,
+            session_id INTEGER NOT NULL,
+            opened_at DATETIME DEFAULT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_open_sessions_session ON open_sessions (session_id)",
+        """
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file TEXT NOT NULL,
+            status TEXT NOT NULL,
+            rows_committed INTEGER NOT NULL DEFAULT 0,
+            resumed_from INTEGER NOT NULL DEFAULT 0,
+            bytes_committed INTEGER NOT NULL DEFAULT 0,
+            total_bytes INTEGER DEFAULT NULL,
+            error_count INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT DEFAULT NULL,
+            created_at DATETIME DEFAULT NULL,
+            started_at DATETIME DEFAULT NULL,
+            updated_at DATETIME DEFAULT NULL,
+            finished_at DATETIME DEFAULT NULL,
+            neto_updated INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_batch_jobs_status ON batch_jobs (status)",
+        "CREATE TABLE IF NOT EXISTS unknown_containers (container_id TEXT NOT NULL PRIMARY KEY)",
+        """
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            sha256 TEXT NOT NULL PRIMARY KEY,
+            file TEXT NOT NULL,
+            records INTEGER NOT NULL DEFAULT 0,
+            ingested_at DATETIME DEFAULT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            day DATE NOT NULL,
+            produce TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            weighings INTEGER NOT NULL DEFAULT 0,
+            bruto_sum INTEGER NOT NULL DEFAULT 0,
+            neto_sum INTEGER NOT NULL DEFAULT 0,
+            neto_unknown INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, produce, direction)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS trucks (
+            truck TEXT NOT NULL PRIMARY KEY,
+            last_tara INTEGER DEFAULT NULL,
+            tara_at DATETIME DEFAULT NULL,
+            last_seen DATETIME DEFAULT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    )
+
+    PLACEHOLDER = re.compile(r'%[s%]')
+
+    @staticmethod
+    def connect(path: str, read_only: bool = False) -> sqlite3.Connection:
+        connection = sqlite3.connect(path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                                     check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        if read_only:
+            connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    def _sql(self, query):
+        # Convert the MySQL format paramstyle to qmark
+        return self.PLACEHOLDER.sub(lambda m: '?' if m.group() == '%s' else '%', query)
+
+    def _params(self, params):
+        return tuple(value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime)
+                     else value.isoformat() if isinstance(value, date) else value
+                     for value in params)
+
+    def _is_duplicate_key(self, error):
+        return isinstance(error, sqlite3.IntegrityError)
+
+    def _begin_immediate(self) -> None:
+        # Take the database write lock now, serializing concurrent writers like FOR UPDATE does
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN IMMEDIATE")
+
+    def find_open_session(self, truck, lock=False):
+        if lock:
+            self._begin_immediate()
+        return super().find_open_session(truck, lock)
+
+    def savepoint(self, name):
+        self._begin_immediate()
+        super().savepoint(name)
+
+    def replication_lag(self):
+        # A SQLite file is its own source
+        return 0.0
+
+    def close(self):
+        self.connection.close()
+
+
+class MemoryStore:
+    """Tables of the in-memory engine, shared by every MemoryRepository of the process"""
+
+    def __init__(self):
+        # Held by a repository from its first write until commit or rollback
+        self.lock = threading.RLock()
+        self.transactions: Dict[int, Dict] = {}
+        self.next_transaction_id = FIRST_TRANSACTION_ID
+        self.containers_registered: Dict[str, Optional[int]] = {}
+        # container_id -> sorted [(datetime, session_id)], session_id -> [(container_id, datetime)]
+        self.container_links: Dict[str, List[Tuple[datetime, int]]] = {}
+        self.session_links: Dict[int, List[Tuple[str, datetime]]] = {}
+        self.open_sessions: Dict[str, Tuple[int, datetime]] = {}
+        self.batch_jobs: Dict[int, Dict] = {}
+        self.next_batch_job_id = 1
+        # Used as an insertion ordered set
+        self.unknown_containers: Dict[str, bool] = {}
+        self.ingested_files: Dict[str, Dict] = {}
+        # (day, produce, direction) -> (weighings, bruto_sum, neto_sum, neto_unknown)
+        self.daily_rollups: Dict[Tuple[date, str, str], Tuple[int, int, int, int]] = {}
+        self.trucks: Dict[str, Dict] = {}
+
+
+class MemoryRepository(WeightRepository):
+    """
+    In-memory engine for tests and benchmarks.
+    Writers hold the store lock until commit/rollback, which replays an undo log on rollback.
+    """
+
+    def __init__(self, store: MemoryStore):
+        self.store = store
+        self._undo: List[Callable[[], None]] = []
+        self._savepoints: Dict[str, int] = {}
+        self._locked = False
+
+    def _begin(self) -> None:
+        if not self._locked:
+            self.store.lock.acquire()
+            self._locked = True
+
+    def _end(self) -> None:
+        self._undo = []
+        self._savepoints = {}
+        if self._locked:
+            self._locked = False
+            self.store.lock.release()
+
+    def _set(self, table: Dict, key, value) -> None:
+        """Write table[key] = value (None deletes) with an undo entry"""
+        self._begin()
+        missing = key not in table
+        previous = table.get(key)
+        if value is None:
+            table.pop(key, None)
+        else:
+            table[key] = value
+        self._undo.append(lambda: table.pop(key, None) if missing else table.__setitem__(key, previous))
+
+    # Lifecycle and transactions
+    def ensure_schema(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        self._end()
+
+    def rollback(self):
+        for undo in reversed(self._undo):
+            undo()
+        self._end()
+
+    def savepoint(self, name):
+        self._begin()
+        self._savepoints[name] = len(self._undo)
+
+    def rollback_to_savepoint(self, name):
+        position = self._savepoints[name]
+        while len(self._undo) > position:
+            self._undo.pop()()
+
+    def release_savepoint(self, name):
+        self._savepoints.pop(name, None)
+
+    def close(self):
+        self.rollback()
+
+    def replication_lag(self):
+        return 0.0
+
+    # Transactions (weighings)
+    def iter_weighings(self, t1, t2, directions, after_id=None, limit=None):
+        with self.store.lock:
+            rows = [(t['id'], t['direction'], t['bruto'], t['neto'], t['produce'], t['containers'])
+                    for t in self.store.transactions.values()
+                    if t['datetime'] is not None and t1 <= t['datetime'] <= t2
+                    and t['direction'] in directions
+                    and (after_id is None or t['id'] > after_id)]
+        rows.sort()
+        return iter(rows[:limit] if limit is not None else rows)
+
+    def iter_transactions(self, t1, t2, directions):
+        with self.store.lock:
+            rows = [tuple(t[column] for column in TRANSACTION_COLUMNS) for t in self.store.transactions.values()
+                    if t['datetime'] is not None and t1 <= t['datetime'] <= t2 and t['direction'] in directions]
+        return iter(sorted(rows, key=lambda row: row[0]))
+
+    def weight_summary(self, t1, t2, directions, bucket):
+        starts = {
+            'hour': lambda d: d.replace(minute=0, second=0, microsecond=0),
+            'day': lambda d: d.replace(hour=0, minute=0, second=0, microsecond=0),
+            'week': lambda d: (d - timedelta(days=d.weekday())).replace(hour=0, minute=0, second=0, microsecond=0),
+        }
+        groups: Dict[tuple, List[Dict]] = {}
+        with self.store.lock:
+            for t in self.store.transactions.values():
+                if t['datetime'] is not None and t1 <= t['datetime'] <= t2 and t['direction'] in directions:
+                    key = (starts[bucket](t['datetime']).strftime('%Y-%m-%d %H:%M:%S'), t['direction'], t['produce'])
+                    groups.setdefault(key, []).append(t)
+
+        def percentile(values: List[int], p: int) -> Optional[int]:
+            return values[max(ceil(p * len(values) / 100), 1) - 1] if values else None
+
+        rows = []
+        for key in sorted(groups, key=lambda k: tuple('' if v is None else v for v in k)):
+            members = groups[key]
+            brutos = sorted(t['bruto'] for t in members if t['bruto'] is not None)
+            netos = sorted(t['neto'] for t in members if t['neto'] is not None)
+            row = [*key, len(members), sum(brutos) if brutos else None, sum(netos) if netos else None, len(netos)]
+            for p in SUMMARY_PERCENTILES:
+                row += [percentile(brutos, p), percentile(netos, p)]
+            rows.append(tuple(row))
+        return rows
+
+    def get_session(self, session_id):
+        try:
+            transaction = self.store.transactions.get(int(session_id))
+        except (TypeError, ValueError):
+            return None
+        return dict(transaction) if transaction else None
+
+    def get_sessions(self, session_ids):
+        with self.store.lock:
+            return {session_id: dict(self.store.transactions[session_id]) for session_id in session_ids
+                    if session_id in self.store.transactions}
+
+    def insert_transaction(self, timestamp, direction, bruto, truck=None, containers=None,
+                           truck_tara=None, neto=None, produce=None):
+        self._begin()
+        session_id = self.store.next_transaction_id
+        self.store.next_transaction_id += 1
+        self._set(self.store.transactions, session_id, {
+            'id': session_id, 'datetime': timestamp, 'direction': direction, 'truck': truck,
+            'containers': containers, 'bruto': bruto, 'truckTara': truck_tara, 'neto': neto, 'produce': produce
+        })
+        return session_id
+
+    def overwrite_in_transaction(self, session_id, timestamp, containers, bruto, produce):
+        transaction = self.store.transactions.get(session_id)
+        if transaction:
+            self._set(self.store.transactions, session_id, {
+                **transaction, 'datetime': timestamp, 'containers': containers, 'bruto': bruto, 'produce': produce
+            })
+
+    def get_transaction_bruto(self, session_id):
+        transaction = self.store.transactions.get(session_id)
+        return transaction['bruto'] if transaction else None
+
+    def _link(self, container_id: str, timestamp: datetime, session_id: int, add: bool) -> None:
+        links = self.store.container_links.setdefault(container_id, [])
+        entry = (timestamp, session_id)
+        if add:
+            bisect.insort(links, entry)
+            self._undo.append(lambda: links.remove(entry))
+        else:
+            links.remove(entry)
+            self._undo.append(lambda: bisect.insort(links, entry))
+
+    def index_session_containers(self, session_id, timestamp, containers_list):
+        self._begin()
+        for container_id, linked_at in self.store.session_links.get(session_id, []):
+            self._link(container_id, linked_at, session_id, add=False)
+        links = [(container_id, timestamp) for container_id in sorted(set(containers_list))]
+        for container_id, linked_at in links:
+            self._link(container_id, linked_at, session_id, add=True)
+        self._set(self.store.session_links, session_id, links or None)
+
+    def container_sessions(self, container_id, t1, t2):
+        with self.store.lock:
+            links = self.store.container_links.get(container_id, [])
+            start = bisect.bisect_left(links, (t1, -1))
+            return [session_id for linked_at, session_id in links[start:] if linked_at <= t2]
+
+    def containers_sessions(self, container_ids, t1, t2):
+        sessions = {container_id: self.container_sessions(container_id, t1, t2) for container_id in container_ids}
+        return {container_id: found for container_id, found in sessions.items() if found}
+
+    def sessions_missing_neto(self, container_ids):
+        with self.store.lock:
+            session_ids = {session_id for container_id in container_ids
+                           for _, session_id in self.store.container_links.get(container_id, [])}
+            sessions = [self.store.transactions.get(session_id) for session_id in sorted(session_ids)]
+        return [(t['id'], t['bruto'], t['truckTara'], t['containers']) for t in sessions
+                if t and t['direction'] == 'out' and t['neto'] is None]
+
+    def update_netos(self, netos):
+        for session_id, neto in netos:
+            transaction = self.store.transactions.get(session_id)
+            if transaction:
+                self._set(self.store.transactions, session_id, {**transaction, 'neto': neto})
+
+    def truck_sessions(self, truck, t1, t2):
+        with self.store.lock:
+            sessions = [(t['datetime'], t['id']) for t in self.store.transactions.values()
+                        if t['truck'] == truck and t['datetime'] is not None and t1 <= t['datetime'] <= t2]
+        return [session_id for _, session_id in sorted(sessions)]
+
+    def trucks_sessions(self, trucks, t1, t2):
+        wanted = set(trucks)
+        sessions: Dict[str, List[Tuple[datetime, int]]] = {}
+        with self.store.lock:
+            for t in self.store.transactions.values():
+                if t['truck'] in wanted and t['datetime'] is not None and t1 <= t['datetime'] <= t2:
+                    sessions.setdefault(t['truck'], []).append((t['datetime'], t['id']))
+        return {truck: [session_id for _, session_id in sorted(found)] for truck, found in sessions.items()}
+
+    def archivable_transactions(self, cutoff, limit):
+        with self.store.lock:
+            open_ids = {session_id for session_id, _ in self.store.open_sessions.values()}
+            rows = [dict(t) for session_id, t in self.store.transactions.items()
+                    if t['datetime'] is not None and t['datetime'] < cutoff and session_id not in open_ids]
+        return sorted(rows, key=lambda t: (t['datetime'], t['id']))[:limit]
+
+    def delete_transactions(self, session_ids):
+        self._begin()
+        for session_id in session_ids:
+            self.index_session_containers(session_id, None, [])
+            self._set(self.store.transactions, session_id, None)
+
+    def set_transaction_id_floor(self, first_id):
+        self._begin()
+        self.store.next_transaction_id = max(self.store.next_transaction_id, first_id)
+
+    # Open sessions
+    def find_open_session(self, truck, lock=False):
+        if lock:
+            self._begin()
+        entry = self.store.open_sessions.get(truck)
+        return entry[0] if entry else None
+
+    def claim_open_session(self, truck, timestamp):
+        self._begin()
+        if truck in self.store.open_sessions:
+            return False
+        self._set(self.store.open_sessions, truck, (0, timestamp))
+        return True
+
+    def set_open_session(self, truck, session_id):
+        entry = self.store.open_sessions.get(truck)
+        if entry:
+            self._set(self.store.open_sessions, truck, (session_id, entry[1]))
+
+    def close_open_session(self, truck, session_id):
+        entry = self.store.open_sessions.get(truck)
+        if entry and entry[0] == session_id:
+            self._set(self.store.open_sessions, truck, None)
+
+    # Truck registry
+    def record_truck(self, truck, timestamp, tara=None):
+        row = dict(self.store.trucks.get(truck) or {**dict.fromkeys(TRUCK_COLUMNS), 'truck': truck, 'sessions': 0})
+        if tara is not None:
+            if row['tara_at'] is None or timestamp >= row['tara_at']:
+                row.update(last_tara=tara, tara_at=timestamp)
+            row['sessions'] += 1
+        row['last_seen'] = max(row['last_seen'] or timestamp, timestamp)
+        self._set(self.store.trucks, truck, row)
+
+    def upsert_trucks(self, rows):
+        for truck, tara, tara_at, last_seen, sessions in rows:
+            row = dict(self.store.trucks.get(truck) or {**dict.fromkeys(TRUCK_COLUMNS), 'truck': truck, 'sessions': 0})
+            if tara_at is not None and (row['tara_at'] is None or tara_at >= row['tara_at']):
+                row.update(last_tara=tara, tara_at=tara_at)
+            row['last_seen'] = max(row['last_seen'] or last_seen, last_seen)
+            row['sessions'] += sessions
+            self._set(self.store.trucks, truck, row)
+
+    def get_truck(self, truck):
+        row = self.store.trucks.get(truck)
+        return dict(row) if row else None
+
+    def get_trucks(self, trucks):
+        return {truck: dict(self.store.trucks[truck]) for truck in trucks if truck in self.store.trucks}
+
+    def search_trucks(self, prefix, limit):
+        with self.store.lock:
+            found = sorted(truck for truck in self.store.trucks if truck.startswith(prefix))[:limit]
+            return [dict(self.store.trucks[truck]) for truck in found]
+
+    # Container registry
+    def container_tara(self, container_id):
+        registry = self.store.containers_registered
+        return (True, registry[container_id]) if container_id in registry else (False, None)
+
+    def container_taras(self, container_ids):
+        registry = self.store.containers_registered
+        return {container_id: registry[container_id] for container_id in container_ids if container_id in registry}
+
+    def iter_container_taras(self):
+        with self.store.lock:
+            return iter(list(self.store.containers_registered.items()))
+
+    def upsert_container_taras(self, chunk):
+        registry = self.store.containers_registered
+        self._begin()
+        for container_id, weight in chunk:
+            # Registered containers are stored even with a NULL weight, so None can't mean delete here
+            missing = container_id not in registry
+            previous = registry.get(container_id)
+            registry[container_id] = weight
+            self._undo.append(lambda c=container_id, m=missing, p=previous:
+                              registry.pop(c, None) if m else registry.__setitem__(c, p))
+
+    # Unknown containers
+    def unknown_containers(self):
+        with self.store.lock:
+            return list(self.store.unknown_containers)
+
+    def add_unknown_containers(self, container_ids):
+        for container_id in container_ids:
+            self._set(self.store.unknown_containers, container_id, True)
+
+    def remove_unknown_containers(self, container_ids):
+        for container_id in container_ids:
+            self._set(self.store.unknown_containers, container_id, None)
+
+    # Ingested files
+    def file_ingested(self, sha256):
+        return sha256 in self.store.ingested_files
+
+    def record_ingested_file(self, sha256, filename, records, ingested_at):
+        if sha256 not in self.store.ingested_files:
+            self._set(self.store.ingested_files, sha256,
+                      {'sha256': sha256, 'file': filename, 'records': records, 'ingested_at': ingested_at})
+
+    # Daily rollups
+    def add_to_daily_rollups(self, deltas):
+        rollups = self.store.daily_rollups
+        for day, produce, direction, *values in deltas:
+            current = rollups.get((day, produce, direction), (0, 0, 0, 0))
+            self._set(rollups, (day, produce, direction), tuple(a + b for a, b in zip(current, values)))
+
+    def daily_rollups(self, d1, d2, directions):
+        with self.store.lock:
+            return sorted(key + values for key, values in self.store.daily_rollups.items()
+                          if d1 <= key[0] <= d2 and key[2] in directions)
+
+    def clear_daily_rollups(self):
+        self._begin()
+        for key in list(self.store.daily_rollups):
+            self._set(self.store.daily_rollups, key, None)
+
+    # Batch jobs
+    def create_batch_job(self, filename, created_at):
+        self._begin()
+        job_id = self.store.next_batch_job_id
+        self.store.next_batch_job_id += 1
+        job = dict.fromkeys(BATCH_JOB_COLUMNS)
+        job.update(id=job_id, file=filename, status='queued', rows_committed=0, resumed_from=0,
+                   bytes_committed=0, error_count=0, created_at=created_at, updated_at=created_at, neto_updated=0)
+        self._set(self.store.batch_jobs, job_id, job)
+        return job_id
+
+    def get_batch_job(self, job_id):
+        job = self.store.batch_jobs.get(job_id)
+        return dict(job) if job else None
+
+    def update_batch_job(self, job_id, **fields):
+        unknown = set(fields) - set(BATCH_JOB_COLUMNS[1:])
+        if unknown:
+            raise ValueError(f"Unknown batch job fields: {', '.join(sorted(unknown))}")
+        job = self.store.batch_jobs.get(job_id)
+        if job:
+            self._set(self.store.batch_jobs, job_id, {**job, **fields})
+
+    def unfinished_batch_jobs(self):
+        with self.store.lock:
+            return sorted(job_id for job_id, job in self.store.batch_jobs.items()
+                          if job['status'] in ('queued', 'running'))
+
+    # Backfills run on startup, the in-memory engine never holds data from before them
+    def backfill_transaction_containers(self, chunk_size=5000):
+        return 0
+
+    def backfill_open_sessions(self):
+        return 0
+
+    def backfill_trucks(self):
+        return 0
+
+
+def create_repository_factory(engine: str, sqlite_path: Optional[str] = None,
+                              read_only: bool = False) -> Callable[[], WeightRepository]:
+    """
+    Repository factory for the local engines: 'sqlite' (sqlite_path, a temporary file by default) or 'memory'
+    The MySQL engine is created by the service, which owns the flask_mysqldb connection.
+    read_only SQLite connections refuse writes
+    """
+    if engine == 'sqlite':
+        if not sqlite_path:
+            sqlite_path = tempfile.mkstemp(prefix='weight_', suffix='.sqlite3')[1]
+        return lambda: SQLiteRepository(SQLiteRepository.connect(sqlite_path, read_only))
+    if engine == 'memory':
+        store = MemoryStore()
+        return lambda: MemoryRepository(store)
+    raise ValueError(f"Unknown storage engine: {engine}")
@@ -0,0 +1,177 @@
+import os
+import mmap
+import struct
+import fcntl
+import tempfile
+import threading
+from typing import Iterable, List, Optional, Tuple, Dict
+
+# File layout: header (magic, version, record count) followed by fixed width
+# records (container id padded with NUL bytes, weight) sorted by id bytes,
+# so lookups are a binary search over the mapped file.
+MAGIC = b'TARACHE1'
+# Magic of an invalidated table (header only), lookups fall back to the registry until the next rebuild
+STALE_MAGIC = b'TARASTAL'
+HEADER = struct.Struct('<8sQQ')
+RECORD = struct.Struct('<24sq')
+ID_SIZE = 24
+# Stored in place of a NULL weight (registered container with unknown tara)
+NULL_WEIGHT = -(2 ** 63)
+
+def default_cache_path() -> str:
+    """Prefer /dev/shm so the table lives in shared memory, fall back to the temp folder"""
+    folder = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(folder, 'weight_tara_cache.bin')
+
+class TaraCache:
+    """
+    Container tara table shared by every worker process through a memory-mapped file.
+    rebuild() writes a new file with version + 1 and renames it into place,
+    readers notice the new inode on their next lookup and remap it.
+    invalidate() does the same with an empty stale table while the registry changes.
+    Hit/miss counters are per process.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_cache_path()
+        self.hits = 0
+        self.misses = 0
+        self._map = None
+        self._identity = None
+        self._version = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> bool:
+        """Map the current cache file if it changed since the last call, returns False if there is none"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._map = None
+            self._identity = None
+            return False
+        identity = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if identity == self._identity:
+            return self._map is not None
+        with self._lock:
+            if identity != self._identity:
+                with open(self.path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, count = HEADER.unpack_from(mapped, 0)
+                if magic != MAGIC or len(mapped) != HEADER.size + count * RECORD.size:
+                    mapped = None
+                    version = count = 0
+                # The previous map is released once no reader holds it
+                self._map, self._version, self._count = mapped, version, count
+                self._identity = identity
+        return self._map is not None
+
+    def _find(self, mapped, count: int, key: bytes) -> Tuple[bool, Optional[int]]:
+        """Binary search a container id in the mapped records"""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            offset = HEADER.size + middle * RECORD.size
+            current = mapped[offset:offset + ID_SIZE].rstrip(b'\0')
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                weight = RECORD.unpack_from(mapped, offset)[1]
+                return True, None if weight == NULL_WEIGHT else weight
+        return False, None
+
+    def lookup(self, container_ids: List[str]) -> Optional[Dict[str, Tuple[bool, Optional[int]]]]:
+        """
+        Resolve container ids to (registered, weight) from the shared table.
+        Returns None when the table is not available and the caller has to read the registry
+        """
+        if not self._refresh():
+            self.misses += len(container_ids)
+            return None
+        mapped, count = self._map, self._count
+        result = {}
+        for container_id in container_ids:
+            key = container_id.encode()
+            if len(key) > ID_SIZE:
+                self.misses += len(container_ids)
+                return None
+            result[container_id] = self._find(mapped, count, key)
+        self.hits += len(container_ids)
+        return result
+
+    def unknown_ids(self) -> Optional[List[str]]:
+        """Registered container ids with a NULL or 0 weight, None when the table is not available"""
+        if not self._refresh():
+            self.misses += 1
+            return None
+        mapped, count = self._map, self._count
+        unknown = []
+        for i in range(count):
+            container_id, weight = RECORD.unpack_from(mapped, HEADER.size + i * RECORD.size)
+            if weight in (NULL_WEIGHT, 0):
+                unknown.append(container_id.rstrip(b'\0').decode())
+        self.hits += 1
+        return unknown
+
+    def rebuild(self, rows: Iterable[Tuple[str, Optional[int]]]) -> int:
+        """
+        Write the (container_id, weight) rows as a new table with the version bumped,
+        serialized across processes with a lock file. Returns the new version
+        """
+        records = []
+        for container_id, weight in rows:
+            key = container_id.encode()
+            if len(key) <= ID_SIZE:
+                records.append((key, NULL_WEIGHT if weight is None else int(weight)))
+        records.sort()
+        return self._replace(MAGIC, records)
+
+    def invalidate(self) -> int:
+        """
+        Replace the table with a stale one with the version bumped, so every process reads the registry
+        until the next rebuild. Returns the new version
+        """
+        return self._replace(STALE_MAGIC, [])
+
+    def _replace(self, magic: bytes, records: List[Tuple[bytes, int]]) -> int:
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            version = self.current_version() + 1
+            folder = os.path.dirname(self.path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tara_cache')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(HEADER.pack(magic, version, len(records)))
+                    for key, weight in records:
+                        f.write(RECORD.pack(key, weight))
+                os.replace(tmp_path, self.path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        return version
+
+    def current_version(self) -> int:
+        """Version of the table currently on disk, 0 if there is none"""
+        try:
+            with open(self.path, 'rb') as f:
+                magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+            return version if magic in (MAGIC, STALE_MAGIC) else 0
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def version(self) -> Optional[int]:
+        """Version of the mapped table, None when the table is not available"""
+        return self._version if self._refresh() else None
+
+    def stats(self) -> Dict:
+        """Counters exposed by GET /tara-cache"""
+        self._refresh()
+        return {
+            "path": self.path,
+            "version": self._version if self._map is not None else None,
+            "entries": self._count if self._map is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -1,114 +1,593 @@
-from flask import Flask, jsonify, request
-from flask_mysqldb import MySQL
+from flask import Flask, jsonify, request, Response, stream_with_context, g
 import os
 import json
-import csv
+import time
+import itertools
+import heapq
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from typing import Union, List, Tuple, Dict
-from datetime import datetime
+from typing import Union, List, Tuple, Dict, Optional, Iterator, Iterable, Callable, Set
+from datetime import date, datetime, timedelta
+import tempfile
+import hashlib
+import click
+from tara_cache import TaraCache
+from response_cache import ResponseCache
+import migrations
+from archive import TransactionArchive, archive_available
+from export import EXPORT_FORMATS, iter_csv, iter_columnar
+from batch_files import BATCH_FILE_EXTENSIONS, BatchRecordError, iter_batch_records, parse_batch_file
+from folder_watcher import FolderWatcher
+from group_commit import GroupCommitter
+from replicas import ReplicaRouter
+from event_feed import EventFeed
+from shards import ShardSet
+from asgi_service import WSGIToASGI
+from storage import WeightRepository, MySQLRepository, MySQLConnectionPool, create_repository_factory, SUMMARY_BUCKETS, SUMMARY_PERCENTILES, TRANSACTION_COLUMNS
 
 app = Flask(__name__)
 
-# MySQL configurations from environment variables
-app.config['MYSQL_HOST'] = os.environ.get('MYSQL_HOST')
-app.config['MYSQL_USER'] = os.environ.get('MYSQL_USER')
-app.config['MYSQL_PASSWORD'] = os.environ.get('MYSQL_PASSWORD')
-app.config['MYSQL_DB'] = os.environ.get('MYSQL_DATABASE')
+# Storage engine: mysql (default), sqlite or memory, see storage.py
+STORAGE_ENGINE = os.environ.get('WEIGHT_STORAGE', 'mysql')
 
-# Initialize MySQL
-mysql = MySQL(app)
+if STORAGE_ENGINE == 'mysql':
+    from flask_mysqldb import MySQL
 
-def convert_to_kg(weight: Union[int, float, str], unit: str = 'kg') -> int:
+    # MySQL configurations from environment variables
+    app.config['MYSQL_HOST'] = os.environ.get('MYSQL_HOST')
+    app.config['MYSQL_USER'] = os.environ.get('MYSQL_USER')
+    app.config['MYSQL_PASSWORD'] = os.environ.get('MYSQL_PASSWORD')
+    app.config['MYSQL_DB'] = os.environ.get('MYSQL_DATABASE')
+
+    # Initialize MySQL
+    mysql = MySQL(app)
+    def mysql_pool(host: str, port: int, size: int, read_only: bool = False) -> MySQLConnectionPool:
+        # A read-only pool's connections refuse writes for their whole session
+        session = {'init_command': 'SET SESSION TRANSACTION READ ONLY'} if read_only else {}
+        return MySQLConnectionPool(size, host=host, port=port, user=app.config['MYSQL_USER'],
+                                   passwd=app.config['MYSQL_PASSWORD'], db=app.config['MYSQL_DB'], **session)
+
+    # Connections kept open across requests, 0 opens one per request through flask_mysqldb
+    DB_POOL_SIZE = int(os.environ.get('WEIGHT_DB_POOL_SIZE', '0'))
+    if DB_POOL_SIZE > 0:
+        db_pool = mysql_pool(app.config['MYSQL_HOST'], int(os.environ.get('MYSQL_PORT', '3306')), DB_POOL_SIZE)
+        repository_factory = lambda: MySQLRepository(db_pool.acquire(), db_pool)
+    else:
+        repository_factory = lambda: MySQLRepository(mysql.connection)
+else:
+    repository_factory = create_repository_factory(STORAGE_ENGINE, os.environ.get('WEIGHT_SQLITE_PATH'))
+
+# Read replicas for the GET routes, comma separated: host[:port] with the primary's user and database
+# for mysql, file paths for sqlite (e.g. a local two-instance setup). Writes always go to the primary
+READ_REPLICAS = [address.strip() for address in os.environ.get('WEIGHT_READ_REPLICAS', '').split(',') if address.strip()]
+# Replicas further behind than this many seconds are skipped, their lag is measured every REPLICA_CHECK_SECONDS
+REPLICA_MAX_LAG = float(os.environ.get('WEIGHT_REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_SECONDS = float(os.environ.get('WEIGHT_REPLICA_CHECK_SECONDS', '1'))
+REPLICA_POOL_SIZE = int(os.environ.get('WEIGHT_REPLICA_POOL_SIZE', '8'))
+
+def database_factory(address: str, pool_size: int, read_only: bool = False) -> Callable[[], WeightRepository]:
+    """
+    Repository factory for another database of the engine: host[:port] for mysql, a file path for sqlite.
+    read_only connections refuse writes
+    """
+    if STORAGE_ENGINE == 'mysql':
+        host, _, port = address.partition(':')
+        pool = mysql_pool(host, int(port or 3306), pool_size, read_only)
+        return lambda: MySQLRepository(pool.acquire(), pool)
+    if STORAGE_ENGINE == 'sqlite':
+        return create_repository_factory('sqlite', address, read_only)
+    raise ValueError(f"Other databases are not supported by the {STORAGE_ENGINE} engine")
+
+replica_router = (ReplicaRouter([database_factory(address, REPLICA_POOL_SIZE) for address in READ_REPLICAS],
+                                REPLICA_MAX_LAG, REPLICA_CHECK_SECONDS) if READ_REPLICAS else None)
+
+# Site sharding: every weighbridge site keeps its weighings in its own database. WEIGHT_SITE_SHARDS lists all
+# sites as site=address (as for WEIGHT_READ_REPLICAS) in the same order on every instance, the order sets each
+# site's session id range. WEIGHT_SITE is this instance's site, its shard is the database configured above so
+# its address can be left empty. Unset, the service runs on that single database
+SITE = os.environ.get('WEIGHT_SITE', 'local')
+SITE_SHARDS = [tuple(part.strip() for part in entry.partition('=')[::2])
+               for entry in os.environ.get('WEIGHT_SITE_SHARDS', '').split(',') if entry.strip()]
+SHARD_POOL_SIZE = int(os.environ.get('WEIGHT_SHARD_POOL_SIZE', '8'))
+# Seconds to wait for a remote shard's answer
+SHARD_TIMEOUT = float(os.environ.get('WEIGHT_SHARD_TIMEOUT', '10'))
+# Rows per remote shard page of a scatter-gathered GET /weight
+SHARD_PAGE_SIZE = 1000
+
+site_shards = (ShardSet([site for site, _ in SITE_SHARDS], SITE,
+                        {site: database_factory(address, SHARD_POOL_SIZE, read_only=True)
+                         for site, address in SITE_SHARDS if site != SITE},
+                        SHARD_TIMEOUT)
+               if SITE_SHARDS else None)
+
+def get_repository() -> WeightRepository:
+    """Repository of the current app context, created on first use"""
+    if 'repository' not in g:
+        g.repository = repository_factory()
+    return g.repository
+
+def get_read_repository(fresh_after: float = 0.0) -> WeightRepository:
+    """
+    Repository for the read-only queries of the current request, chosen on first use: a replica holding
+    the writes committed up to fresh_after and the X-Read-After header (epoch seconds, the X-Write-Time
+    a client got from its last write, for read-your-writes), otherwise the primary
+    """
+    if 'read_repository' not in g:
+        repository = None
+        if replica_router is not None:
+            read_after = max(fresh_after, request.headers.get('X-Read-After', 0.0, type=float))
+            repository = replica_router.open(read_after)
+        g.read_repository = repository or get_repository()
+    return g.read_repository
+
+def mark_written() -> None:
+    """Report the commit time of the request's writes in X-Write-Time, call once they are committed"""
+    g.write_time = time.time()
+
+@app.after_request
+def add_write_time(response: Response) -> Response:
+    if 'write_time' in g:
+        response.headers['X-Write-Time'] = f"{g.write_time:.3f}"
+    return response
+
+@app.teardown_appcontext
+def close_repository(exception) -> None:
+    repository = g.pop('repository', None)
+    read_repository = g.pop('read_repository', None)
+    if read_repository is not None and read_repository is not repository:
+        read_repository.close()
+    if repository is not None:
+        repository.close()
+
+# Container taras shared by all worker processes, invalidated by every committed batch-weight chunk
+# and rebuilt once the batch ends
+# Local engines start empty, so they get a private table instead of the shared default one
+tara_cache = TaraCache(os.environ.get('TARA_CACHE_PATH') or (
+    None if STORAGE_ENGINE == 'mysql' else os.path.join(tempfile.mkdtemp(prefix='weight_'), 'tara_cache.bin')))
+
+# Rendered /session and /item bodies, invalidated by the writes that change them
+response_cache = ResponseCache(int(os.environ.get('RESPONSE_CACHE_SIZE', '4096')))
+
+# Committed weighings pushed to GET /weight/stream subscribers, the last WEIGHT_STREAM_BUFFER can be resumed
+weight_feed = EventFeed(int(os.environ.get('WEIGHT_STREAM_BUFFER', '1000')))
+# Comment line sent to idle subscribers, keeps proxies from timing the stream out
+WEIGHT_STREAM_HEARTBEAT_SECONDS = 15
+
+# Closed transactions older than WEIGHT_ARCHIVE_AFTER_DAYS are moved to per-month files by `flask archive`
+ARCHIVE_FOLDER = os.environ.get('WEIGHT_ARCHIVE_FOLDER') or (
+    '/app/archive' if STORAGE_ENGINE == 'mysql' else tempfile.mkdtemp(prefix='weight_archive_'))
+ARCHIVE_AFTER_DAYS = int(os.environ.get('WEIGHT_ARCHIVE_AFTER_DAYS', '180'))
+# Transactions moved per archive round (file merge, delete and commit)
+ARCHIVE_CHUNK_SIZE = 10000
+transaction_archive = TransactionArchive(ARCHIVE_FOLDER) if archive_available() else None
+
+def archive_for(t1: datetime, t2: datetime) -> Optional[TransactionArchive]:
+    """The transaction archive if it holds months overlapping [t1, t2], None when only the live table is needed"""
+    if transaction_archive is not None and transaction_archive.covers(t1, t2):
+        return transaction_archive
+    return None
+
+def merge_by_id(*streams: Iterable[tuple]) -> Iterator[tuple]:
+    """Merge id ordered row streams, a row found in both the archive and the live table is returned once"""
+    last_id = None
+    for row in heapq.merge(*streams, key=lambda row: row[0]):
+        if row[0] != last_id:
+            last_id = row[0]
+            yield row
+
+def parse_containers(containers: str) -> List[str]:
+    """Split a comma delimited containers string into a list of ids, dropping empty entries"""
+    if not containers:
+        return []
+    return [c.strip() for c in containers.split(',') if c.strip()]
+
+def refresh_tara_cache() -> int:
+    """Rebuild the shared tara table from containers_registered, returns the new cache version"""
+    return tara_cache.rebuild(get_repository().iter_container_taras())
+
+def lookup_container_taras(repository: WeightRepository, container_ids: List[str]) -> Dict[str, Optional[int]]:
     """
-    Convert weight to kilograms
-    Args:
-        weight: The weight value to convert
-        unit: The unit of the weight (kg/lbs), defaults to 'kg'
-    Returns:
-        Weight in kilograms as integer
+    Weights of the registered containers among container_ids, served from the shared tara cache
+    A container the cache doesn't hold or holds without a weight is confirmed against the registry,
+    which may have been written since the last rebuild
     """
-    weight = float(weight)
-    if unit.lower() == 'lbs':
-        return int(weight * 0.453592)
-    return int(weight)
+    cached = tara_cache.lookup(container_ids)
+    taras = {} if cached is None else {c: weight for c, (_, weight) in cached.items() if weight is not None}
+    unconfirmed = list(dict.fromkeys(c for c in container_ids if c not in taras))
+    for chunk in iter_chunks(unconfirmed, LOOKUP_CHUNK_SIZE):
+        taras.update(repository.container_taras(chunk))
+    return taras
+
+def get_container_taras(repository: WeightRepository, containers_list: List[str]) -> List[Optional[int]]:
+    """Tara of each container in order, None for unregistered containers or unknown weights"""
+    taras = lookup_container_taras(repository, containers_list)
+    return [taras.get(container_id) for container_id in containers_list]
+
+def mark_unknown_containers(repository: WeightRepository, containers_list: List[str],
+                            taras: List[Optional[int]]) -> None:
+    """Add the weighed containers without a known tara to the unknown set, taras as from get_container_taras"""
+    unknown = list(dict.fromkeys(c for c, tara in zip(containers_list, taras) if not tara))
+    if unknown:
+        repository.add_unknown_containers(unknown)
+
+def update_unknown_containers(repository: WeightRepository, chunk: List[Tuple[str, int]]) -> None:
+    """Move the containers of an upserted batch chunk in or out of the unknown set, the last record wins"""
+    weights = dict(chunk)
+    known = [container_id for container_id, weight in weights.items() if weight]
+    unknown = [container_id for container_id, weight in weights.items() if not weight]
+    if known:
+        repository.remove_unknown_containers(known)
+    if unknown:
+        repository.add_unknown_containers(unknown)
+
+# Sessions indexed per round trip by the transaction_containers startup backfill
+BACKFILL_CHUNK_SIZE = 5000
 
 @app.route('/health', methods=['GET'])
 def health():
     try:
-        cursor = mysql.connection.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
+        get_repository().ping()
         return jsonify({"status": "OK"}), 200
     except Exception as e:
          return jsonify({"status": "Failure"}), 500
         
 
+# Upper bound for the page size of keyset pagination
+WEIGHT_MAX_PAGE_LIMIT = 10000
+
+def format_weight_row(row: tuple) -> Dict:
+    """Format an (id, direction, bruto, neto, produce, containers) row as a /weight result object"""
+    containers = row[5].split(',') if row[5] else []
+    neto = row[3] if row[3] is not None else "na"
+    return {
+        "id": row[0],
+        "direction": row[1],
+        "bruto": row[2],
+        "neto": neto,
+        "produce": row[4],
+        "containers": containers
+    }
+
+def iter_weighings(t1: datetime, t2: datetime, directions: List[str], after_id: Optional[int] = None,
+                   limit: Optional[int] = None, sites: Optional[List[str]] = None) -> Iterator[tuple]:
+    """
+    Weighing rows of the live table, merged with the archive when the range reaches archived months
+    and with the other sites' shards when sharded, sites limits them to some sites
+    """
+    local = sites is None or SITE in sites
+    rows = get_read_repository().iter_weighings(t1, t2, directions, after_id, limit) if local else iter(())
+    if site_shards is not None:
+        rows = site_shards.iter_merged(
+            lambda repository, after, size: list(repository.iter_weighings(t1, t2, directions, after, size)),
+            rows, after_id, limit, SHARD_PAGE_SIZE, sites)
+    archive = archive_for(t1, t2) if local else None
+    if archive is None:
+        return rows
+    return itertools.islice(merge_by_id(archive.iter_weighings(t1, t2, directions, after_id), rows), limit)
+
+def stream_weight_rows(*query) -> Iterator[str]:
+    """
+    Yield NDJSON lines for a /weight query (iter_weighings arguments), the repository streams
+    the rows from the database in chunks so memory stays constant for any time range
+    """
+    for row in iter_weighings(*query):
+        yield json.dumps(format_weight_row(row)) + "\n"
+
 @app.route('/weight', methods=['GET'])
 def get_weights():
+    """
+    List weighings between from/to.
+    Optional keyset pagination: after_id=<last id seen>&limit=<page size>, ordered by id.
+    format=ndjson streams one JSON object per line instead of a single array.
+    When sharded, every site's weighings are listed, site=<site>,... lists only those sites.
+    """
     try:
         t1 = request.args.get('from', datetime.now().strftime('%Y%m%d') + "000000")
         t2 = request.args.get('to', datetime.now().strftime('%Y%m%d%H%M%S'))
         f = request.args.get('filter', 'in,out,none').split(',')
+        after_id = request.args.get('after_id')
+        limit = request.args.get('limit')
+        ndjson = request.args.get('format') == 'ndjson'
+        sites = [site for site in request.args.get('site', '').split(',') if site] or None
 
         try:
-            t1_formatted = datetime.strptime(t1, '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
-            t2_formatted = datetime.strptime(t2, '%Y%m%d%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
+            t1_formatted = datetime.strptime(t1, '%Y%m%d%H%M%S')
+            t2_formatted = datetime.strptime(t2, '%Y%m%d%H%M%S')
         except ValueError as ve:
             return jsonify({"error": "Invalid date format. Expected format: YYYYMMDDHHMMSS"}), 400
 
         if not f or all(not direction for direction in f):
             return jsonify({"error": "Filter parameter cannot be empty"}), 400
 
-        cursor = mysql.connection.cursor()
-        query = f"""
-            SELECT id, direction, bruto, neto, produce, containers
-            FROM transactions
-            WHERE datetime BETWEEN %s AND %s
-              AND direction IN ({','.join(['%s'] * len(f))})
-        """
-        cursor.execute(query, [t1_formatted, t2_formatted, *f])
-        results = cursor.fetchall()
-        cursor.close()
-
-        output = []
-        for row in results:
-            containers = row[5].split(',') if row[5] else [] 
-            neto = row[3] if row[3] is not None else "na"
-            output.append({
-                "id": row[0],
-                "direction": row[1],
-                "bruto": row[2],
-                "neto": neto,
-                "produce": row[4],
-                "containers": containers
-            })
+        try:
+            after_id = int(after_id) if after_id is not None else None
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            return jsonify({"error": "after_id and limit must be integers"}), 400
+        if limit is not None and not 1 <= limit <= WEIGHT_MAX_PAGE_LIMIT:
+            return jsonify({"error": f"limit must be between 1 and {WEIGHT_MAX_PAGE_LIMIT}"}), 400
+        if sites and not set(sites) <= set(site_shards.sites if site_shards else [SITE]):
+            return jsonify({"error": "Unknown site"}), 400
 
-        return jsonify(output), 200
+        query = (t1_formatted, t2_formatted, f, after_id, limit, sites)
+
+        if ndjson:
+            return Response(stream_with_context(stream_weight_rows(*query)),
+                            mimetype='application/x-ndjson')
+
+        output = [format_weight_row(row) for row in iter_weighings(*query)]
+
+        response = jsonify(output)
+        if limit is not None and len(output) == limit:
+            # Full page, the client continues with after_id=<X-Next-After-Id>
+            response.headers['X-Next-After-Id'] = str(output[-1]["id"])
+        return response, 200
+
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+def iter_export_rows(t1: datetime, t2: datetime, directions: List[str]) -> Iterator[tuple]:
+    """Full transaction rows for an export, the live table merged with the archive by id"""
+    rows = get_read_repository().iter_transactions(t1, t2, directions)
+    archive = archive_for(t1, t2)
+    if archive is None:
+        return rows
+    return merge_by_id(archive.iter_transactions(t1, t2, directions), rows)
+
+@app.route('/weight/export', methods=['GET'])
+def export_weights():
+    """
+    Stream the transactions between from/to as a file for analysis.
+    - format: csv (default), parquet or arrow (Arrow IPC stream), the last two with containers as a list column
+    - from/to/filter: same as GET /weight
+    Rows are streamed from the database in id order and written in batches, so memory stays bounded.
+    """
+    t1 = request.args.get('from', datetime.now().strftime('%Y%m%d') + "000000")
+    t2 = request.args.get('to', datetime.now().strftime('%Y%m%d%H%M%S'))
+    f = [direction for direction in request.args.get('filter', 'in,out,none').split(',') if direction]
+    export_format = request.args.get('format', 'csv')
+
+    try:
+        t1_formatted = datetime.strptime(t1, '%Y%m%d%H%M%S')
+        t2_formatted = datetime.strptime(t2, '%Y%m%d%H%M%S')
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Expected format: YYYYMMDDHHMMSS"}), 400
+    if not f:
+        return jsonify({"error": "Filter parameter cannot be empty"}), 400
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Invalid format. Expected one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format != 'csv' and not archive_available():
+        return jsonify({"error": f"The {export_format} format requires pyarrow"}), 400
+
+    def generate() -> Iterator[bytes]:
+        # The repository is opened inside the streaming context, as for format=ndjson
+        rows = iter_export_rows(t1_formatted, t2_formatted, f)
+        if export_format == 'csv':
+            yield from iter_csv(rows)
+        else:
+            yield from iter_columnar(rows, export_format)
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="transactions-{t1}-{t2}.{extension}"'
+    return response
+
+def iter_weight_events(position: Optional[int], directions: List[str]) -> Iterator[str]:
+    """
+    Server-sent events of the weighings committed after the feed position, without any database query.
+    A reset event (position None, or the subscriber fell behind the buffer) tells the client to reload
+    its window with GET /weight, the stream continues from there
+    """
+    while True:
+        if position is None:
+            position = weight_feed.position()
+            yield f"id: {weight_feed.event_id(position)}\nevent: reset\ndata: {{}}\n\n"
+        events = weight_feed.wait(position, WEIGHT_STREAM_HEARTBEAT_SECONDS)
+        if events is None:
+            position = None
+            continue
+        if not events:
+            yield ": heartbeat\n\n"
+            continue
+        for position, event in events:
+            if event["direction"] in directions:
+                yield f"id: {weight_feed.event_id(position)}\nevent: weighing\ndata: {json.dumps(event)}\n\n"
+
+@app.route('/weight/stream', methods=['GET'])
+def stream_weights():
+    """
+    Live feed of committed weighings as server-sent events ("weighing" events carrying a /weight row with truck
+    and datetime), filter as for GET /weight. A reconnecting EventSource sends Last-Event-ID and gets the events
+    it missed. State is per process
+    """
+    directions = [direction for direction in request.args.get('filter', 'in,out,none').split(',') if direction]
+    if not directions:
+        return jsonify({"error": "Filter parameter cannot be empty"}), 400
+    last_event_id = request.headers.get('Last-Event-ID')
+    position = weight_feed.resume_position(last_event_id) if last_event_id else weight_feed.position()
+
+    response = Response(iter_weight_events(position, directions), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def weighing_event(data: Dict, timestamp: datetime, body: Dict) -> Dict:
+    """The /weight/stream event of a committed weighing, from its request data and response body"""
+    return {
+        "id": body["id"],
+        "direction": data["direction"],
+        "bruto": body["bruto"],
+        "neto": body.get("neto", "na"),
+        "produce": data.get("produce", "na"),
+        "containers": parse_containers(data.get("containers", "")),
+        "truck": body["truck"],
+        "datetime": timestamp.strftime('%Y%m%d%H%M%S')
+    }
+
+def format_summary_row(row: tuple) -> Dict:
+    """Format a summary query row, percentile columns follow the fixed columns in SUMMARY_PERCENTILES order"""
+    bucket, direction, produce, count, bruto_sum, neto_sum, neto_known = row[:7]
+    percentiles = row[7:]
+    to_int = lambda value: int(value) if value is not None else None
+    result = {
+        "bucket": bucket,
+        "direction": direction,
+        "produce": produce,
+        "count": count,
+        "bruto": {"sum": to_int(bruto_sum)},
+        "neto": {"sum": to_int(neto_sum), "known": neto_known},
+    }
+    for i, p in enumerate(SUMMARY_PERCENTILES):
+        result["bruto"][f"p{p}"] = to_int(percentiles[2 * i])
+        result["neto"][f"p{p}"] = to_int(percentiles[2 * i + 1])
+    return result
+
+@app.route('/weight/summary', methods=['GET'])
+def get_weight_summary():
+    """
+    Aggregate weighings between from/to per time bucket, direction and produce.
+    - bucket: hour/day/week, default is day
+    - from/to/filter: same as GET /weight
+    Returns one object per (bucket, direction, produce) with count, bruto/neto sums and percentiles.
+    """
+    try:
+        t1 = request.args.get('from', datetime.now().strftime('%Y%m%d') + "000000")
+        t2 = request.args.get('to', datetime.now().strftime('%Y%m%d%H%M%S'))
+        f = [direction for direction in request.args.get('filter', 'in,out,none').split(',') if direction]
+        bucket = request.args.get('bucket', 'day')
+
+        try:
+            t1_formatted = datetime.strptime(t1, '%Y%m%d%H%M%S')
+            t2_formatted = datetime.strptime(t2, '%Y%m%d%H%M%S')
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Expected format: YYYYMMDDHHMMSS"}), 400
+
+        if bucket not in SUMMARY_BUCKETS:
+            return jsonify({"error": f"Invalid bucket. Expected one of: {', '.join(SUMMARY_BUCKETS)}"}), 400
+        if not f:
+            return jsonify({"error": "Filter parameter cannot be empty"}), 400
+
+        results = get_read_repository().weight_summary(t1_formatted, t2_formatted, f, bucket)
+
+        return jsonify([format_summary_row(row) for row in results]), 200
+
+    except Exception as e:
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+# Rollup totals per day or per month
+ROLLUP_BUCKETS = ('day', 'month')
+
+def parse_day(value: str) -> date:
+    """A YYYYMMDD date, or the day of a YYYYMMDDhhmmss datetime"""
+    if len(value) not in (8, 14):
+        raise ValueError(value)
+    return datetime.strptime(value[:8], '%Y%m%d').date()
+
+@app.route('/weight/rollup', methods=['GET'])
+def get_weight_rollup():
+    """
+    Totals per day or month, direction and produce, read from the daily rollups instead of the transactions.
+    - from/to: YYYYMMDD or YYYYMMDDhhmmss (whole days), the current month by default
+    - filter: same as GET /weight, produce: only this produce
+    - bucket: day (default) or month
+    Returns one object per (bucket, direction, produce) with count and bruto/neto sums, like /weight/summary
+    """
+    try:
+        today = date.today()
+        try:
+            d1 = parse_day(request.args.get('from') or today.strftime('%Y%m01'))
+            d2 = parse_day(request.args.get('to') or today.strftime('%Y%m%d'))
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Expected format: YYYYMMDD or YYYYMMDDHHMMSS"}), 400
+        f = [direction for direction in request.args.get('filter', 'in,out,none').split(',') if direction]
+        produce = request.args.get('produce')
+        bucket = request.args.get('bucket', 'day')
+        if bucket not in ROLLUP_BUCKETS:
+            return jsonify({"error": f"Invalid bucket. Expected one of: {', '.join(ROLLUP_BUCKETS)}"}), 400
+        if not f:
+            return jsonify({"error": "Filter parameter cannot be empty"}), 400
+
+        totals: Dict[Tuple[str, str, str], List[int]] = {}
+        for day, row_produce, direction, weighings, bruto_sum, neto_sum, neto_unknown in \
+                get_read_repository().daily_rollups(d1, d2, f):
+            if produce is not None and row_produce != produce:
+                continue
+            start = day if bucket == 'day' else day.replace(day=1)
+            row = totals.setdefault((f"{start:%Y-%m-%d} 00:00:00", direction, row_produce), [0, 0, 0, 0])
+            for i, value in enumerate((weighings, bruto_sum, neto_sum, neto_unknown)):
+                row[i] += int(value)
+
+        return jsonify([{
+            "bucket": key[0],
+            "direction": key[1],
+            "produce": key[2],
+            "count": weighings,
+            "bruto": {"sum": bruto_sum},
+            "neto": {"sum": neto_sum, "known": weighings - neto_unknown}
+        } for key, (weighings, bruto_sum, neto_sum, neto_unknown) in sorted(totals.items())]), 200
 
     except Exception as e:
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 @app.route('/unknown', methods=['GET'])
 def get_unknown_containers():
+    """
+    Containers with an unknown tara, read from the set the weighings and batch uploads maintain
+    When sharded, the containers unknown on any site, in id order
+    """
     try:
-        cursor = mysql.connection.cursor()
-        cursor.execute("""
-        SELECT container_id
-        FROM containers_registered
-        WHERE weight IS NULL OR weight = 0
-        """)
-        result = cursor.fetchall()
-        container_ids = [row[0] for row in result]
-        return jsonify(container_ids), 200
+        unknown = get_read_repository().unknown_containers()
+        if site_shards is not None:
+            for found in site_shards.gather(lambda repository: repository.unknown_containers()).values():
+                unknown += found
+            unknown = sorted(set(unknown))
+        return jsonify(unknown), 200
     except Exception as e:
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
-    finally:
-        cursor.close()
+
+@app.route('/tara-cache', methods=['GET'])
+def get_tara_cache_stats():
+    """Version, size and hit/miss counters of the shared container tara cache"""
+    return jsonify(tara_cache.stats()), 200
+
+def item_tag(id: str) -> str:
+    # MySQL compares ids case-insensitively and ignores trailing spaces
+    return f"item:{id.rstrip().lower()}"
+
+def session_tag(session_id: Union[int, str]) -> str:
+    return f"session:{int(session_id)}"
+
+def cached_response(key: str, tag: str, render: Callable[[], Tuple[Dict, int]]) -> Response:
+    """
+    Serve a GET from the response cache, rendering and caching it on a miss
+    A matching If-None-Match gets a 304 straight away, only 200 responses are cached and get an ETag
+    """
+    version = response_cache.version(tag)
+    etag = response_cache.etag(key, version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    body = response_cache.get(key, version)
+    if body is None:
+        # The body is cached at version, so it must be read from data holding the write that set it
+        get_read_repository(response_cache.invalidated_at(tag))
+        result, status = render()
+        if status != 200:
+            return jsonify(result), status
+        body = jsonify(result).get_data()
+        response_cache.put(key, tag, version, body)
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 @app.route('/item/<id>', methods=['GET'])
 def get_item(id):
     """Get information about a specific truck or container"""
-    cursor = None
     try:
         # Get date range parameters with defaults
         from_date = request.args.get('from')
@@ -126,191 +605,609 @@ def get_item(id):
             
             if to_datetime < from_datetime:
                 return jsonify({"error": "to_date cannot be earlier than from_date"}), 400
-                
-            from_date = from_datetime.strftime('%Y-%m-%d %H:%M:%S')
-            to_date = to_datetime.strftime('%Y-%m-%d %H:%M:%S')
             
         except ValueError as e:
             return jsonify({"error": "Invalid date format. Use YYYYMMDDhhmmss"}), 400
 
-        # Create cursor after date validation
-        cursor = mysql.connection.cursor()
-        
-        # First check if id exists as a container
-        cursor.execute("""
-            SELECT weight as tara 
-            FROM containers_registered 
-            WHERE container_id = %s
-        """, (id,))
-        container_result = cursor.fetchone()
-        
-        if container_result:
-            # Handle container case
-            tara = container_result[0] if container_result[0] is not None else "na" 
-            
-            # Get container's sessions using FIND_IN_SET or LIKE
-            cursor.execute("""
-                SELECT id 
-                FROM transactions 
-                WHERE (FIND_IN_SET(%s, containers) > 0
-                    OR containers = %s
-                    OR containers LIKE %s
-                    OR containers LIKE %s  
-                    OR containers LIKE %s)
-                AND datetime BETWEEN %s AND %s
-                ORDER BY datetime  
-            """, (id, id, f"{id},%", f"%,{id},%", f"%,{id}", from_date, to_date))
-                
-        else:
-            # Check if exists as a truck
-            cursor.execute("""
-                SELECT DISTINCT truck 
-                FROM transactions 
-                WHERE truck = %s
-                LIMIT 1
-            """, (id,))  
-            truck_exists = cursor.fetchone()
-            
-            if not truck_exists:
-                return jsonify({"error": "Item not found"}), 404
-            
-            # Get truck's last known tara  
-            cursor.execute("""
-                SELECT truckTara as tara 
-                FROM transactions 
-                WHERE truck = %s 
-                AND truckTara IS NOT NULL 
-                ORDER BY datetime DESC 
-                LIMIT 1
-            """, (id,))
-            tara_result = cursor.fetchone()
-            tara = tara_result[0] if tara_result and tara_result[0] is not None else "na"
-            
-            # Get truck's sessions
-            cursor.execute("""
-                SELECT id 
-                FROM transactions 
-                WHERE truck = %s 
-                AND datetime BETWEEN %s AND %s 
-                ORDER BY datetime
-            """, (id, from_date, to_date))
-        
-        sessions = [str(row[0]) for row in cursor.fetchall()]
-        
-        response = {
-            "id": id,
-            "tara": tara,
-            "sessions": sessions
-        }
-        
-        return jsonify(response), 200
-        
+        if site_shards is not None:
+            # Weighings at other sites don't invalidate this instance's response cache
+            body, status = item_body(id, from_datetime, to_datetime)
+            return jsonify(body), status
+
+        # A defaulted to is "now" and left out of the key: sessions weighed since the body was cached invalidate it.
+        # Container taras come from the tara cache, so its version is part of the key
+        to_key = f"{to_datetime:%Y%m%d%H%M%S}" if request.args.get('to') else "now"
+        key = f"item:{id}:{from_datetime:%Y%m%d%H%M%S}:{to_key}:{tara_cache.version()}"
+        return cached_response(key, item_tag(id), lambda: item_body(id, from_datetime, to_datetime))
+
     except Exception as e:
         print(f"Detailed error in get_item: {str(e)}")  # More detailed error logging
         return jsonify({"error": "An error occurred while processing the request"}), 500
-    finally:
-        if cursor:
-            cursor.close()
+
+def item_body(id: str, from_datetime: datetime, to_datetime: datetime) -> Tuple[Dict, int]:
+    """
+    Tara and sessions of a truck or container in the range, as the /item response body and status
+    When sharded, an id that is a container on any site is a container, a truck gets the tara
+    of its latest weigh-out on any site, and the sessions of several sites are listed in id order
+    """
+    found = [item_lookup(get_read_repository(), id, from_datetime, to_datetime)]
+    if site_shards is not None:
+        found += site_shards.gather(
+            lambda repository: item_lookup(repository, id, from_datetime, to_datetime, local=False)).values()
+    found = [item for item in found if item is not None]
+    if not found:
+        return {"error": "Item not found"}, 404
+
+    containers = [item for item in found if item[0]]
+    if containers:
+        found = containers
+        weights = [weight for _, weight, _, _ in found if weight is not None]
+        tara = weights[0] if weights else "na"
+    else:
+        taras = [(tara_at or datetime.min, weight) for _, weight, tara_at, _ in found if weight is not None]
+        tara = max(taras)[1] if taras else "na"
+    # Each shard lists its sessions by datetime, archived ones first, so several shards' lists are sorted together
+    sessions = found[0][3] if len(found) == 1 else sorted(session_id for _, _, _, ids in found for session_id in ids)
+    return format_item(id, tara, sessions), 200
+
+def item_lookup(repository: WeightRepository, id: str, from_datetime: datetime, to_datetime: datetime,
+                local: bool = True) -> Optional[Tuple[bool, Optional[int], Optional[datetime], List[int]]]:
+    """
+    (is a container, tara, time of the truck tara, session ids) of an id on one shard, None if it is unknown there
+    Only the local shard reads the tara cache and the archive, which hold the local site's data
+    """
+    # Archived sessions are closed and older than the live ones, so they are listed first
+    archive = archive_for(from_datetime, to_datetime) if local else None
+    
+    # First check if id exists as a container
+    if local:
+        taras = lookup_container_taras(repository, [id])
+        registered, weight = id in taras, taras.get(id)
+    else:
+        registered, weight = repository.container_tara(id)
+    
+    if registered:
+        # Handle container case
+        sessions = repository.container_sessions(id, from_datetime, to_datetime)
+        if archive:
+            sessions = [session_id for _, session_id in archive.container_sessions(id, from_datetime, to_datetime)] + sessions
+        return True, weight, None, sessions
+
+    # Check if exists as a truck, the registry row also holds its last known tara, archived weighings included
+    truck = repository.get_truck(id)
+    if truck is None:
+        return None
+    
+    # Get truck's sessions
+    sessions = repository.truck_sessions(id, from_datetime, to_datetime)
+    if archive:
+        sessions = [session_id for _, session_id in archive.truck_sessions(id, from_datetime, to_datetime)] + sessions
+    return False, truck["last_tara"], truck["tara_at"], sessions
+
+def format_item(id: str, tara, sessions: List[int]) -> Dict:
+    """The /item result object, sessions listed once each in order"""
+    return {
+        "id": id,
+        "tara": tara,
+        "sessions": [str(session_id) for session_id in dict.fromkeys(sessions)]
+    }
 
 
 @app.route('/session/<id>', methods=['GET'])
 def get_session(id):
     try:
-        cursor= mysql.connection.cursor()
-        cursor.execute("SELECT * FROM transactions WHERE id = %s", (id,))
-        session = cursor.fetchone()
-        if not session:
-            return jsonify({"error": "Session not found"}), 404
-        
-        column_names = [desc[0] for desc in cursor.description]
-        session_dict = dict(zip(column_names, session))
-
-        response = {
-            "id": session_dict["id"],
-            "truck": session_dict["truck"] if session_dict["truck"] else "na",
-            "bruto": session_dict["bruto"],
-        }
-
-        if session_dict["direction"] == "out":
-            response["truckTara"] = session_dict["truckTara"]
-            if session_dict["neto"] is None:
-               response["neto"] = "na"
-            else:   
-               response["neto"] = session_dict["neto"]
-
-        return jsonify(response),200
+        if not id.isdigit() or (site_shards is not None and site_shards.site_of(int(id)) != SITE):
+            # Sessions of other sites are not cached, their writes don't invalidate this instance's cache
+            body, status = session_body(id)
+            return jsonify(body), status
+        return cached_response(session_tag(id), session_tag(id), lambda: session_body(id))
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
-def process_csv_file(file_path: Path) -> List[Tuple[str, int]]:
+def session_body(id: str) -> Tuple[Dict, int]:
     """
-    Process CSV file and return list of (container_id, weight_kg) tuples
-    Supports both formats:
-    - id,weight
-    - id,weight,unit
+    The /session response body and status of a live or archived session, read from its site's shard.
+    An id from before sharding is looked up on the local site first, then on the others in shard order
     """
-    records = []
+    site = site_shards.site_of(int(id)) if site_shards is not None and id.isdigit() else SITE
+    session_dict = None
+    if site in (SITE, None):
+        session_dict = get_read_repository().get_session(id)
+        if not session_dict and transaction_archive and id.isdigit():
+            session_dict = transaction_archive.get_session(int(id))
+    if not session_dict and site != SITE:
+        found = site_shards.gather(lambda repository: repository.get_session(id), None if site is None else [site])
+        session_dict = next((remote for remote in found.values() if remote), None)
+    if not session_dict:
+        return {"error": "Session not found"}, 404
+    return format_session(session_dict), 200
+
+def format_session(session_dict: Dict) -> Dict:
+    """Format a transactions row as a /session result object"""
+    response = {
+        "id": session_dict["id"],
+        "truck": session_dict["truck"] if session_dict["truck"] else "na",
+        "bruto": session_dict["bruto"],
+    }
+
+    if session_dict["direction"] == "out":
+        response["truckTara"] = session_dict["truckTara"]
+        if session_dict["neto"] is None:
+           response["neto"] = "na"
+        else:   
+           response["neto"] = session_dict["neto"]
+
+    return response
+
+# Upper bound for the number of ids in one POST /sessions or /items
+LOOKUP_MAX_IDS = 10000
+# Ids per IN list of the set-based lookups
+LOOKUP_CHUNK_SIZE = 500
+
+def lookup_ids() -> Optional[List[str]]:
+    """The JSON array of ids in the request body as strings, None if the body is not one"""
+    ids = request.get_json(silent=True)
+    if not isinstance(ids, list) or not all(isinstance(i, (str, int)) and not isinstance(i, bool) for i in ids):
+        return None
+    return [str(i) for i in ids]
+
+@app.route('/sessions', methods=['POST'])
+def get_sessions():
+    """
+    Resolve a JSON array of session ids in one request
+    Returns an object keyed by id with the /session result of each, or {"error": "Session not found"}
+    """
+    ids = lookup_ids()
+    if ids is None:
+        return jsonify({"error": "Request body must be an array of session ids"}), 400
+    if len(ids) > LOOKUP_MAX_IDS:
+        return jsonify({"error": f"At most {LOOKUP_MAX_IDS} ids per request"}), 400
+
     try:
-        with open(file_path, 'r') as f:
-            csv_reader = csv.reader(f)
-            header = next(csv_reader, None)  # Skip header if exists
-            
-            # Check if header exists and skip if it does
-            if header and header[0].lower() == 'id':
-                pass
-            else:
-                # If no header, process the first row as data
-                process_row(header, records)  # Process the header row as data
-            
-            # Process remaining rows
-            for row in csv_reader:
-                process_row(row, records)
-                
+        session_ids = sorted({int(i) for i in ids if i.isdigit()})
+        repository = get_read_repository(max((response_cache.invalidated_at(session_tag(i)) for i in session_ids),
+                                             default=0.0))
+        found = {}
+        for chunk in iter_chunks(session_ids, LOOKUP_CHUNK_SIZE):
+            found.update(repository.get_sessions(chunk))
+        if transaction_archive:
+            for session_id in session_ids:
+                if session_id not in found:
+                    archived = transaction_archive.get_session(session_id)
+                    if archived:
+                        found[session_id] = archived
+
+        not_found = {"error": "Session not found"}
+        return jsonify({i: format_session(found[int(i)]) if i.isdigit() and int(i) in found else not_found
+                        for i in ids}), 200
     except Exception as e:
-        raise ValueError(f"Error processing CSV file: {str(e)}")
-        
-    return records
+        print(f"Error: {e}")
+        return jsonify({"error": "Internal server error"}), 500
 
-def process_row(row: List[str], records: List[Tuple[str, int]]) -> None:
-    """Helper function to process a single CSV row"""
-    if not row:
-        return
-        
-    if len(row) >= 3:  # Format: id,weight,unit
-        container_id, weight, unit = row[0], row[1], row[2]
-        weight_kg = convert_to_kg(weight, unit)
-    else:  # Format: id,weight (assuming kg)
-        container_id, weight = row[0], row[1]
-        weight_kg = convert_to_kg(weight)
-        
-    records.append((container_id, weight_kg))
+@app.route('/items', methods=['POST'])
+def get_items():
+    """
+    Resolve a JSON array of truck or container ids in one request, from and to as for /item
+    Returns an object keyed by id with the /item result of each, or {"error": "Item not found"}
+    """
+    ids = lookup_ids()
+    if ids is None:
+        return jsonify({"error": "Request body must be an array of item ids"}), 400
+    if len(ids) > LOOKUP_MAX_IDS:
+        return jsonify({"error": f"At most {LOOKUP_MAX_IDS} ids per request"}), 400
+
+    now = datetime.now()
+    try:
+        from_datetime = datetime.strptime(request.args.get('from') or now.strftime('%Y%m01000000'), '%Y%m%d%H%M%S')
+        to_datetime = datetime.strptime(request.args.get('to') or now.strftime('%Y%m%d%H%M%S'), '%Y%m%d%H%M%S')
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYYMMDDhhmmss"}), 400
+    if to_datetime < from_datetime:
+        return jsonify({"error": "to_date cannot be earlier than from_date"}), 400
+
+    try:
+        return jsonify(items_bodies(list(dict.fromkeys(ids)), from_datetime, to_datetime)), 200
+    except Exception as e:
+        print(f"Detailed error in get_items: {str(e)}")
+        return jsonify({"error": "An error occurred while processing the request"}), 500
+
+def items_bodies(ids: List[str], from_datetime: datetime, to_datetime: datetime) -> Dict[str, Dict]:
+    """item_body of each id with a query per LOOKUP_CHUNK_SIZE ids and lookup, instead of per id"""
+    repository = get_read_repository(max((response_cache.invalidated_at(item_tag(i)) for i in ids), default=0.0))
+    archive = archive_for(from_datetime, to_datetime)
+
+    # Containers first, as in item_body
+    registered = lookup_container_taras(repository, ids)
+    containers = [i for i in ids if i in registered]
+    trucks = [i for i in ids if i not in registered]
+
+    sessions: Dict[str, List] = {}
+    for chunk in iter_chunks(containers, LOOKUP_CHUNK_SIZE):
+        if archive:
+            for container_id, found in archive.containers_sessions(chunk, from_datetime, to_datetime).items():
+                sessions[container_id] = [session_id for _, session_id in found]
+        for container_id, found in repository.containers_sessions(chunk, from_datetime, to_datetime).items():
+            sessions[container_id] = sessions.get(container_id, []) + found
+
+    truck_taras: Dict[str, int] = {}
+    existing = set()
+    for chunk in iter_chunks(trucks, LOOKUP_CHUNK_SIZE):
+        for truck, row in repository.get_trucks(chunk).items():
+            existing.add(truck)
+            if row["last_tara"] is not None:
+                truck_taras[truck] = row["last_tara"]
+        if archive:
+            for truck, found in archive.trucks_sessions(chunk, from_datetime, to_datetime).items():
+                sessions[truck] = [session_id for _, session_id in found]
+        for truck, found in repository.trucks_sessions(chunk, from_datetime, to_datetime).items():
+            sessions[truck] = sessions.get(truck, []) + found
+
+    bodies = {}
+    for i in ids:
+        if i in registered:
+            tara = registered[i] if registered[i] is not None else "na"
+        elif i in existing:
+            tara = truck_taras.get(i, "na")
+        else:
+            bodies[i] = {"error": "Item not found"}
+            continue
+        bodies[i] = format_item(i, tara, sessions.get(i, []))
+    return bodies
+
+# Upper bound for ?limit= of GET /trucks
+TRUCKS_MAX_LIMIT = 100
+
+@app.route('/trucks', methods=['GET'])
+def list_trucks():
+    """
+    Registered trucks whose id starts with ?prefix= (all by default) in id order, at most ?limit= (10), for autocomplete
+    Each is {"id", "tara", "lastSeen" (yyyymmddhhmmss), "sessions"}, tara is "na" until the truck is weighed out
+    """
+    prefix = request.args.get('prefix', '').strip()
+    try:
+        limit = int(request.args.get('limit', '10'))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if not 1 <= limit <= TRUCKS_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {TRUCKS_MAX_LIMIT}"}), 400
+
+    try:
+        trucks = get_read_repository().search_trucks(prefix, limit)
+        return jsonify([{
+            "id": truck["truck"],
+            "tara": truck["last_tara"] if truck["last_tara"] is not None else "na",
+            "lastSeen": truck["last_seen"].strftime('%Y%m%d%H%M%S') if truck["last_seen"] else None,
+            "sessions": truck["sessions"]
+        } for truck in trucks]), 200
+    except Exception as e:
+        print(f"Error in list_trucks: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+# Records per multi-row upsert, bounds both memory and the number of DB round trips
+BATCH_CHUNK_SIZE = 1000
+
+def iter_chunks(records: Iterable, size: int = BATCH_CHUNK_SIZE) -> Iterator[List]:
+    """Group an iterable into lists of at most size items"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Sessions updated per statement by the neto backfill
+NETO_UPDATE_CHUNK_SIZE = 1000
+
+def backfill_neto(repository: WeightRepository, container_ids: List[str]) -> List[int]:
+    """
+    Fill in the NULL neto of "out" sessions that weighed any of the containers, once all their taras are known
+    Sessions are found through the transaction_containers index, taras are read from the registry
+    since the tara cache is invalidated while the batch runs. Returns the ids of the sessions that got a neto
+    """
+    sessions = repository.sessions_missing_neto(container_ids)
+    if not sessions:
+        return []
+    weights = {}
+    for chunk in iter_chunks(sorted({c for session in sessions for c in parse_containers(session[3])})):
+        weights.update(repository.container_taras(chunk))
+
+    netos = []
+    for session_id, bruto, truck_tara, containers in sessions:
+        if bruto is None or truck_tara is None:
+            continue
+        neto = calculate_neto(bruto, truck_tara, [weights.get(c) for c in parse_containers(containers)])
+        if neto is not None:
+            netos.append((session_id, neto))
+    for chunk in iter_chunks(netos, NETO_UPDATE_CHUNK_SIZE):
+        repository.update_netos(chunk)
+        # The sessions move from the unknown neto count to the neto sum of their rollup rows
+        found = repository.get_sessions([session_id for session_id, _ in chunk])
+        add_to_rollups(repository, [(found[session_id]["datetime"].date(), found[session_id]["produce"] or 'na', 'out',
+                                     0, 0, neto, -1) for session_id, neto in chunk if session_id in found])
+    return [session_id for session_id, _ in netos]
+
+class BatchIngestError(Exception):
+    """A batch that failed after records_committed records were committed, the failure is its __cause__"""
+
+    def __init__(self, records_committed: int):
+        super().__init__(records_committed)
+        self.records_committed = records_committed
 
-def process_json_file(file_path: Path) -> List[Tuple[str, int]]:
+    def __str__(self) -> str:
+        return str(self.__cause__)
+
+def ingest_batch_file(file_path: Path, records: Iterable[Tuple[str, int]],
+                      on_chunk: Optional[Callable] = None) -> Dict:
     """
-    Process JSON file and return list of (container_id, weight_kg) tuples
-    Expected format: [{"id": "...", "weight": ..., "unit": "..."}]
+    Stream records into containers_registered in BATCH_CHUNK_SIZE upserts, committing each chunk
+    together with the neto backfill of the sessions waiting for those containers
+    Only records whose weight differs from the stored tara are written
+    on_chunk(repository, records_so_far, neto_updated_so_far) runs before every commit,
+    so progress it writes is committed with the chunk
+    The tara cache is invalidated by the first changed chunk and rebuilt when the batch ends, failed or not
+    Returns throughput statistics for the batch-weight response, a failure raises BatchIngestError
+    as the chunks before it stay committed
     """
+    started = time.monotonic()
+    total = 0
+    committed = 0
+    changed = 0
+    chunks = 0
+    neto_updated = 0
+    stale = False
+    repository = get_repository()
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            if not isinstance(data, list):
-                raise ValueError("JSON file must contain an array of objects")
-                
-            records = []
-            for item in data:
-                if not isinstance(item, dict):
-                    raise ValueError("Each item in JSON must be an object")
-                if 'id' not in item or 'weight' not in item:
-                    raise ValueError("Each item must have 'id' and 'weight' fields")
-                    
-                weight_kg = convert_to_kg(item['weight'], item.get('unit', 'kg'))
-                records.append((item['id'], weight_kg))
-            return records
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON format: {str(e)}")
+        for chunk in iter_chunks(records):
+            total += len(chunk)
+            chunks += 1
+            # The last record of a container in the chunk wins, as in the multi-row upsert
+            weights = dict(chunk)
+            stored = repository.container_taras(list(weights))
+            chunk = [(container_id, weight) for container_id, weight in weights.items()
+                     if container_id not in stored or stored[container_id] != weight]
+            container_ids = [container_id for container_id, _ in chunk]
+            session_ids = []
+            if chunk:
+                repository.upsert_container_taras(chunk)
+                update_unknown_containers(repository, chunk)
+                session_ids = backfill_neto(repository, container_ids)
+                neto_updated += len(session_ids)
+                changed += len(chunk)
+            if on_chunk:
+                on_chunk(repository, total, neto_updated)
+            repository.commit()
+            committed = total
+            if chunk:
+                # After every chunk, a rebuild of another batch may have read the registry before it
+                tara_cache.invalidate()
+                stale = True
+            response_cache.invalidate([*map(item_tag, container_ids), *map(session_tag, session_ids)])
     except Exception as e:
-        raise ValueError(f"Error processing JSON file: {str(e)}")
+        repository.rollback()
+        raise BatchIngestError(committed) from e
+    finally:
+        # Holds the chunks committed before a failure too
+        tara_version = refresh_tara_cache() if stale else tara_cache.current_version()
+
+    seconds = time.monotonic() - started
+    return {
+        "file": file_path.name,
+        "records": total,
+        "records_changed": changed,
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "records_per_second": int(total / seconds) if seconds > 0 else total,
+        "neto_updated": neto_updated,
+        "tara_cache_version": tara_version
+    }
+
+# Folder batch files are read from
+BATCH_IN_FOLDER = Path(os.environ.get('WEIGHT_IN_FOLDER', '/app/in'))
+BATCH_JOB_WORKERS = int(os.environ.get('BATCH_JOB_WORKERS', '2'))
+batch_job_executor = ThreadPoolExecutor(max_workers=BATCH_JOB_WORKERS, thread_name_prefix='batch-job')
+
+def run_batch_job(job_id: int) -> None:
+    """
+    Process a queued or interrupted batch job in a worker thread
+    Resumes after the rows committed by a previous run if the file size is unchanged,
+    re-applying from the start otherwise (upserts are idempotent)
+    """
+    with app.app_context():
+        repository = get_repository()
+        try:
+            job = repository.get_batch_job(job_id)
+            if not job:
+                return
+            file_path = BATCH_IN_FOLDER / job["file"]
+            size = file_path.stat().st_size
+            resuming = job["total_bytes"] == size
+            rows_committed = job["rows_committed"] if resuming else 0
+            neto_before = job["neto_updated"] if resuming else 0
+
+            now = datetime.now().replace(microsecond=0)
+            repository.update_batch_job(job_id, status='running', total_bytes=size, rows_committed=rows_committed,
+                                        resumed_from=rows_committed, neto_updated=neto_before,
+                                        started_at=now, updated_at=now)
+            repository.commit()
+
+            errors = []
+            def record_error(message: str) -> None:
+                errors.append(message[:1000])
+
+            with open(file_path, 'r', newline='') as f:
+                records = iter_batch_records(f, file_path.suffix.lower(), on_error=record_error)
+
+                def save_progress(chunk_repository: WeightRepository, total: int, neto_updated: int) -> None:
+                    chunk_repository.update_batch_job(
+                        job_id, rows_committed=rows_committed + total, bytes_committed=f.buffer.tell(),
+                        neto_updated=neto_before + neto_updated,
+                        error_count=len(errors), last_error=errors[-1] if errors else None,
+                        updated_at=datetime.now().replace(microsecond=0))
+
+                ingest_batch_file(file_path, itertools.islice(records, rows_committed, None), on_chunk=save_progress)
+
+            now = datetime.now().replace(microsecond=0)
+            repository.update_batch_job(job_id, status='done', bytes_committed=size, error_count=len(errors),
+                                        last_error=errors[-1] if errors else None, updated_at=now, finished_at=now)
+            repository.commit()
+
+        except Exception as e:
+            print(f"Error in batch job {job_id}: {e}")
+            repository.rollback()
+            now = datetime.now().replace(microsecond=0)
+            repository.update_batch_job(job_id, status='failed', last_error=str(e)[:1000],
+                                        updated_at=now, finished_at=now)
+            repository.commit()
+
+# Worker processes parsing the files of a multi-file /batch-weight, one pool shared by every request.
+# They are started by a fork server (spawned where there is none), forking the threaded service is unsafe
+BATCH_PARSE_WORKERS = int(os.environ.get('BATCH_PARSE_WORKERS', str(os.cpu_count() or 1)))
+BATCH_PARSE_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+batch_parse_pool = ProcessPoolExecutor(BATCH_PARSE_WORKERS,
+                                       mp_context=multiprocessing.get_context(BATCH_PARSE_START_METHOD))
+
+def resolve_batch_files(names: List[str]) -> List[Path]:
+    """
+    Expand /batch-weight file names in the /in folder, in the order given:
+    a glob pattern or a folder stands for its batch files sorted by name, other names for themselves
+    """
+    paths = []
+    for name in names:
+        if any(char in name for char in '*?['):
+            matches = sorted(BATCH_IN_FOLDER.glob(name))
+        elif (BATCH_IN_FOLDER / name).is_dir():
+            matches = sorted((BATCH_IN_FOLDER / name).iterdir())
+        else:
+            paths.append(BATCH_IN_FOLDER / name)
+            continue
+        paths.extend(path for path in matches if path.is_file() and path.suffix.lower() in BATCH_FILE_EXTENSIONS)
+    return paths
+
+def ingest_batch_files(label: str, paths: List[Path]) -> Dict:
+    """
+    Parse the files on the batch parse pool and stream each file's records, in file order as the workers
+    return them, through a single ingest_batch_file pass, so the last file listing a container wins and
+    only the files not ingested yet are held in memory
+    Returns its statistics plus the parse throughput of every file
+    """
+    started = time.monotonic()
+    parsed: List[Dict] = []
+    parse_seconds = 0.0
+
+    def records() -> Iterator[Tuple[str, int]]:
+        nonlocal parse_seconds
+        for result in batch_parse_pool.map(parse_batch_file, [str(path) for path in paths]):
+            parse_seconds = time.monotonic() - started
+            parsed.append({
+                "file": result["file"],
+                "records": len(result["records"]),
+                "seconds": round(result["seconds"], 3),
+                "records_per_second": int(len(result["records"]) / result["seconds"]) if result["seconds"] > 0
+                                      else len(result["records"])
+            })
+            yield from result["records"]
+
+    stats = ingest_batch_file(Path(label), records())
+    stats["parse_seconds"] = round(parse_seconds, 3)
+    stats["files"] = parsed
+    return stats
+
+def submit_batch_job(filename: str) -> int:
+    """Record a queued batch job and hand it to the worker pool, returns the job id"""
+    repository = get_repository()
+    job_id = repository.create_batch_job(filename, datetime.now().replace(microsecond=0))
+    repository.commit()
+    batch_job_executor.submit(run_batch_job, job_id)
+    return job_id
+
+def resume_batch_jobs() -> int:
+    """Re-submit jobs left queued or running by a previous process, returns how many were resumed"""
+    job_ids = get_repository().unfinished_batch_jobs()
+    for job_id in job_ids:
+        batch_job_executor.submit(run_batch_job, job_id)
+    return len(job_ids)
+
+# Ingest files dropped into BATCH_IN_FOLDER automatically, inotify is used when inotify_simple is installed
+WATCH_IN_FOLDER = os.environ.get('WEIGHT_WATCH_IN_FOLDER', 'false').lower() == 'true'
+WATCH_POLL_SECONDS = float(os.environ.get('WEIGHT_WATCH_POLL_SECONDS', '5'))
+# Bytes hashed per read
+HASH_READ_SIZE = 1024 * 1024
+
+def file_sha256(file_path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def ingest_watched_file(path: str) -> Optional[Dict]:
+    """
+    Ingest a file reported by the folder watcher unless a file with the same content was already applied
+    Returns the ingest statistics, None for a skipped file
+    """
+    file_path = Path(path)
+    digest = file_sha256(file_path)
+    with app.app_context():
+        repository = get_repository()
+        if repository.file_ingested(digest):
+            return None
+        with open(file_path, 'r', newline='') as f:
+            stats = ingest_batch_file(file_path, iter_batch_records(f, file_path.suffix.lower()))
+        repository.record_ingested_file(digest, file_path.name, stats["records"], datetime.now().replace(microsecond=0))
+        repository.commit()
+    print(f"Ingested watched file {file_path.name}: {stats['records_changed']} of {stats['records']} records changed")
+    return stats
+
+def start_folder_watcher() -> FolderWatcher:
+    watcher = FolderWatcher(str(BATCH_IN_FOLDER), BATCH_FILE_EXTENSIONS, ingest_watched_file, WATCH_POLL_SECONDS)
+    watcher.start()
+    return watcher
+
+def format_batch_job(job: Dict) -> Dict:
+    """Format a batch job with its processing rate (rows/s) and ETA (seconds)"""
+    rows_committed, bytes_committed, total_bytes = job["rows_committed"], job["bytes_committed"], job["total_bytes"]
+    started_at, updated_at = job["started_at"], job["updated_at"]
+
+    rate = None
+    eta = None
+    if started_at and updated_at and updated_at > started_at:
+        rate = round((rows_committed - job["resumed_from"]) / (updated_at - started_at).total_seconds(), 1)
+    if job["status"] == 'running' and rate and bytes_committed and total_bytes:
+        # Estimate the total row count from the share of the file already read
+        estimated_rows = rows_committed * total_bytes / bytes_committed
+        eta = max(int((estimated_rows - rows_committed) / rate), 0)
+
+    to_str = lambda value: value.strftime('%Y%m%d%H%M%S') if value else None
+    return {
+        "id": job["id"],
+        "file": job["file"],
+        "status": job["status"],
+        "rows_processed": rows_committed,
+        "bytes_processed": bytes_committed,
+        "total_bytes": total_bytes,
+        "errors": job["error_count"],
+        "neto_updated": job["neto_updated"],
+        "last_error": job["last_error"],
+        "rate": rate,
+        "eta_seconds": eta,
+        "created": to_str(job["created_at"]),
+        "started": to_str(started_at),
+        "finished": to_str(job["finished_at"])
+    }
+
+@app.route('/batch-weight/jobs/<int:job_id>', methods=['GET'])
+def get_batch_job(job_id):
+    """Report progress of an asynchronous batch-weight job"""
+    try:
+        job = get_repository().get_batch_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(format_batch_job(job)), 200
+    except Exception as e:
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 # Helper function to calculate Neto
 def calculate_neto(bruto, truck_tara, container_taras):
@@ -320,12 +1217,40 @@ def calculate_neto(bruto, truck_tara, container_taras):
     return bruto - truck_tara - sum(container_taras)
 
 
-@app.route('/weight', methods=['POST'])
-def post_weight():
-    data = request.get_json()
+def rollup_delta(timestamp: datetime, produce: Optional[str], direction: str, bruto: Optional[int] = 0,
+                 neto: Optional[int] = None, removed: bool = False) -> Tuple:
+    """The daily_rollups row change of adding or removing a transaction"""
+    sign = -1 if removed else 1
+    return (timestamp.date(), produce or 'na', direction, sign, sign * (bruto or 0), sign * (neto or 0),
+            sign * (neto is None))
+
+def add_to_rollups(repository: WeightRepository, deltas: List[Tuple]) -> None:
+    """Add rollup deltas in one statement, deltas of the same row are summed and the ones that cancel out dropped"""
+    rows: Dict[Tuple, List[int]] = {}
+    for day, produce, direction, *values in deltas:
+        row = rows.setdefault((day, produce, direction), [0, 0, 0, 0])
+        for i, value in enumerate(values):
+            row[i] += value
+    changed = [key + tuple(values) for key, values in rows.items() if any(values)]
+    if changed:
+        repository.add_to_daily_rollups(changed)
+
+# Upper bound for the number of weighings in one POST /weight/bulk
+WEIGHT_BULK_MAX_ITEMS = 10000
+
+def apply_weighing(repository: WeightRepository, data: Dict, timestamp: datetime,
+                   touched: Optional[Set[str]] = None) -> Tuple[Dict, int]:
+    """
+    Validate and apply a single weighing with the in/out/none state machine rules
+    Does not commit, the caller commits on success and rolls back otherwise
+    The response cache tags of what a successful weighing changed are added to touched,
+    for the caller to invalidate once committed
+    Returns the response body and status code
+    """
+    touched = set() if touched is None else touched
     direction = data.get("direction")
     truck = data.get("truck", "na")
-    containers_list = data.get("containers", "").split(",") if "containers" in data else []
+    containers_list = parse_containers(data.get("containers", ""))
     weight = data.get("weight")
     unit = data.get("unit", "kg")
     force = data.get("force", False)
@@ -333,169 +1258,486 @@ def post_weight():
 
     # Validate input
     if direction not in {"in", "out", "none"}:
-        return jsonify({"error": "Invalid direction"}), 400
+        return {"error": "Invalid direction"}, 400
     if not isinstance(weight, int):
-        return jsonify({"error": "Invalid weight"}), 400
+        return {"error": "Invalid weight"}, 400
     if unit not in {"kg", "lbs"}:
-        return jsonify({"error": "Invalid unit"}), 400
+        return {"error": "Invalid unit"}, 400
 
     # Convert to kg if needed
     if unit == "lbs":
         weight = int(weight * 0.453592)
 
-    timestamp = datetime.now().isoformat()
-
-    cursor = mysql.connection.cursor()
-
     # Handle "none"
     if direction == "none":
-        cursor.execute("""
-            SELECT id FROM transactions WHERE truck = %s AND direction = 'in' ORDER BY datetime DESC LIMIT 1
-        """, (truck,))
-        last_in_session = cursor.fetchone()
-
-        if last_in_session:
-            return jsonify({"error": "'none' after 'in' is not allowed"}), 400
-
-        query = """
-            INSERT INTO transactions (datetime, direction, bruto)
-            VALUES (%s, %s, %s)
-        """
-        cursor.execute(query, (timestamp, direction, weight))
-        mysql.connection.commit()
-        session_id = cursor.lastrowid
-        cursor.close()
-        return jsonify({"id": session_id, "truck": "na", "bruto": weight}), 200
+        if repository.find_open_session(truck) is not None:
+            return {"error": "'none' after 'in' is not allowed"}, 400
+
+        session_id = repository.insert_transaction(timestamp, direction, weight)
+        add_to_rollups(repository, [rollup_delta(timestamp, None, direction, weight)])
+        touched.add(session_tag(session_id))
+        return {"id": session_id, "truck": "na", "bruto": weight}, 200
 
     # Handle "in"
     if direction == "in":
-        cursor.execute("""
-            SELECT id FROM transactions WHERE truck = %s AND direction = 'in' ORDER BY datetime DESC LIMIT 1
-        """, (truck,))
-        last_in_session = cursor.fetchone()
-
-        if last_in_session and not force:
-            return jsonify({"error": "Truck already weighed in, use force=true to overwrite"}), 400
-
-        if last_in_session and force:
-            query = """
-                UPDATE transactions 
-                SET datetime = %s, containers = %s, bruto = %s, produce = %s
-                WHERE id = %s
-            """
-            containers_str = ",".join(containers_list)
-            cursor.execute(query, (timestamp, containers_str, weight, produce, last_in_session[0]))
-            mysql.connection.commit()
-            return jsonify({"id": last_in_session[0], "truck": truck, "bruto": weight}), 200
-
-        query = """
-            INSERT INTO transactions (datetime, direction, truck, containers, bruto, produce)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
         containers_str = ",".join(containers_list)
-        cursor.execute(query, (timestamp, direction, truck, containers_str, weight, produce))
-        mysql.connection.commit()
-        session_id = cursor.lastrowid
-        cursor.close()
-        return jsonify({"id": session_id, "truck": truck, "bruto": weight}), 200
+
+        # The open_sessions primary key guarantees a single open session per truck. Claiming it first locks
+        # the truck's row, concurrent weighings of the truck wait for this one without locking a missing row
+        if repository.claim_open_session(truck, timestamp):
+            session_id = repository.insert_transaction(timestamp, direction, weight, truck=truck,
+                                                       containers=containers_str, produce=produce)
+            repository.set_open_session(truck, session_id)
+            repository.record_truck(truck, timestamp)
+            repository.index_session_containers(session_id, timestamp, containers_list)
+            if containers_list:
+                mark_unknown_containers(repository, containers_list,
+                                        get_container_taras(repository, containers_list))
+            add_to_rollups(repository, [rollup_delta(timestamp, produce, direction, weight)])
+            touched.update([session_tag(session_id), item_tag(truck), *map(item_tag, containers_list)])
+            return {"id": session_id, "truck": truck, "bruto": weight}, 200
+
+        if not force:
+            return {"error": "Truck already weighed in, use force=true to overwrite"}, 400
+
+        # Locked by the claim, so no concurrent "out" closes it meanwhile
+        open_session = repository.find_open_session(truck, lock=True)
+
+        # Containers dropped by the overwrite lose the session from their /item history
+        previous = repository.get_session(open_session)
+        touched.update(map(item_tag, parse_containers(previous["containers"] if previous else "")))
+        repository.overwrite_in_transaction(open_session, timestamp, containers_str, weight, produce)
+        repository.record_truck(truck, timestamp)
+        repository.index_session_containers(open_session, timestamp, containers_list)
+        if containers_list:
+            mark_unknown_containers(repository, containers_list, get_container_taras(repository, containers_list))
+        # The overwritten weighing moves out of its rollup row
+        deltas = [rollup_delta(timestamp, produce, direction, weight)]
+        if previous:
+            deltas.append(rollup_delta(previous["datetime"], previous["produce"], previous["direction"],
+                                       previous["bruto"], previous["neto"], removed=True))
+        add_to_rollups(repository, deltas)
+        touched.update([session_tag(open_session), item_tag(truck), *map(item_tag, containers_list)])
+        return {"id": open_session, "truck": truck, "bruto": weight}, 200
 
     # Handle "out"
-    if direction == "out":
-        cursor.execute("""
-            SELECT id, bruto FROM transactions WHERE truck = %s AND direction = 'in' ORDER BY datetime DESC LIMIT 1
-        """, (truck,))
-        previous_session = cursor.fetchone()
-
-        if not previous_session:
-            return jsonify({"error": "'out' without 'in' is not allowed"}), 400
-
-        previous_id, bruto = previous_session
-
-        placeholders = ", ".join(["%s"] * len(containers_list))
-        query = f"SELECT weight FROM containers_registered WHERE container_id IN ({placeholders})"
-        cursor.execute(query, containers_list)
-        container_weights = cursor.fetchall()
-        containers = [cw[0] for cw in container_weights]
-        neto = calculate_neto(bruto, weight, containers)
-
-        query = """
-            INSERT INTO transactions (datetime, direction, truck, containers, bruto, truckTara, neto, produce)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        containers_str = ",".join(containers_list)
-        cursor.execute(query, (timestamp, direction, truck, containers_str, bruto, weight, neto, produce))
-        session_id = cursor.lastrowid
-        mysql.connection.commit()
-        cursor.close()
+    # Locking the open session serializes concurrent weigh-outs of the same truck
+    previous_id = repository.find_open_session(truck, lock=True)
+
+    if previous_id is None:
+        return {"error": "'out' without 'in' is not allowed"}, 400
 
-        return jsonify({
-            "id": session_id,
-            "truck": truck,
-            "bruto": bruto,
-            "truckTara": weight,
-            "neto": neto
-        }), 200
+    bruto = repository.get_transaction_bruto(previous_id)
 
-    return jsonify({"error": "Invalid request"}), 400
+    containers = get_container_taras(repository, containers_list) if containers_list else []
+    neto = calculate_neto(bruto, weight, containers)
+
+    containers_str = ",".join(containers_list)
+    session_id = repository.insert_transaction(timestamp, direction, bruto, truck=truck, containers=containers_str,
+                                               truck_tara=weight, neto=neto, produce=produce)
+    repository.close_open_session(truck, previous_id)
+    repository.record_truck(truck, timestamp, weight)
+    repository.index_session_containers(session_id, timestamp, containers_list)
+    mark_unknown_containers(repository, containers_list, containers)
+    add_to_rollups(repository, [rollup_delta(timestamp, produce, direction, bruto, neto)])
+    touched.update([session_tag(session_id), item_tag(truck), *map(item_tag, containers_list)])
+
+    return {
+        "id": session_id,
+        "truck": truck,
+        "bruto": bruto,
+        "truckTara": weight,
+        "neto": neto
+    }, 200
+
+def apply_weighing_group(items: List[Tuple[Dict, datetime]]) -> List[Union[Tuple[Dict, int], Exception]]:
+    """
+    Apply the (data, timestamp) weighings of a group in order in a single transaction, each under
+    a savepoint so a rejected or failing weighing doesn't affect the others, then commit once
+    """
+    repository = get_repository()
+    try:
+        results = []
+        touched = set()
+        for data, timestamp in items:
+            repository.savepoint("weighing")
+            try:
+                result = apply_weighing(repository, data, timestamp, touched)
+            except Exception as e:
+                result = e
+            if not isinstance(result, tuple) or result[1] != 200:
+                repository.rollback_to_savepoint("weighing")
+            repository.release_savepoint("weighing")
+            results.append(result)
+        repository.commit()
+        response_cache.invalidate(touched)
+        for (data, timestamp), result in zip(items, results):
+            if isinstance(result, tuple) and result[1] == 200:
+                weight_feed.publish(weighing_event(data, timestamp, result[0]))
+        return results
+    except Exception:
+        repository.rollback()
+        raise
+
+# Opt-in group commit: concurrent POST /weight calls within this many milliseconds share one transaction,
+# at most GROUP_COMMIT_MAX_ITEMS each, 0 commits every weighing on its own
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('WEIGHT_GROUP_COMMIT_MS', '0'))
+GROUP_COMMIT_MAX_ITEMS = int(os.environ.get('WEIGHT_GROUP_COMMIT_MAX_ITEMS', '64'))
+group_committer = (GroupCommitter(apply_weighing_group, GROUP_COMMIT_WINDOW_MS / 1000, GROUP_COMMIT_MAX_ITEMS)
+                   if GROUP_COMMIT_WINDOW_MS > 0 else None)
+
+@app.route('/weight', methods=['POST'])
+def post_weight():
+    data = request.get_json()
+    timestamp = datetime.now().replace(microsecond=0)
+    # A weighing of another site goes to that site's instance, which keeps its registry and response cache
+    site = data.get("site", SITE) if isinstance(data, dict) else SITE
+    if site != SITE:
+        if site_shards is None or site not in site_shards.sites:
+            return jsonify({"error": "Unknown site"}), 400
+        return jsonify({"error": f"Weighings of site {site} are written by its own instance", "site": site}), 421
+
+    if group_committer is not None:
+        # Answered once the group holding this weighing is committed
+        body, status = group_committer.submit((data, timestamp))
+        if status == 200:
+            mark_written()
+        return jsonify(body), status
+
+    repository = get_repository()
+    try:
+        touched = set()
+        body, status = apply_weighing(repository, data, timestamp, touched)
+        if status == 200:
+            repository.commit()
+            response_cache.invalidate(touched)
+            mark_written()
+            weight_feed.publish(weighing_event(data, timestamp, body))
+        else:
+            repository.rollback()
+        return jsonify(body), status
+    except Exception:
+        repository.rollback()
+        raise
+
+@app.route('/weight/bulk', methods=['POST'])
+def post_weight_bulk():
+    """
+    Apply an ordered array of weighings, e.g. readings buffered by a terminal while offline
+    Each item takes the POST /weight fields plus an optional "datetime" (yyyymmddhhmmss) of the reading
+    Items are applied in order with the in/out/none rules in a single transaction,
+    an item rejected by the rules or failing is skipped and reported without affecting the others
+    Returns {"applied": n, "failed": n, "results": [{"index": i, "status": code, ...}]}
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "Request body must be an array of weighings"}), 400
+    if len(items) > WEIGHT_BULK_MAX_ITEMS:
+        return jsonify({"error": f"At most {WEIGHT_BULK_MAX_ITEMS} weighings per request"}), 400
+
+    repository = get_repository()
+    try:
+        results = []
+        touched = set()
+        events = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results.append({"index": index, "status": 400, "error": "Each weighing must be an object"})
+                continue
+            try:
+                reading_time = item.get("datetime")
+                timestamp = (datetime.strptime(reading_time, '%Y%m%d%H%M%S') if reading_time
+                             else datetime.now().replace(microsecond=0))
+            except (TypeError, ValueError):
+                results.append({"index": index, "status": 400,
+                                "error": "Invalid datetime format. Use YYYYMMDDhhmmss"})
+                continue
+
+            repository.savepoint("weighing")
+            try:
+                body, status = apply_weighing(repository, item, timestamp, touched)
+            except Exception as e:
+                # Like a rejected item, a failing one is rolled back alone and reported
+                print(f"Error in weight bulk item {index}: {e}")
+                body, status = {"error": f"An error occurred: {str(e)}"}, 500
+            if status != 200:
+                repository.rollback_to_savepoint("weighing")
+            repository.release_savepoint("weighing")
+            results.append({"index": index, "status": status, **body})
+            if status == 200:
+                events.append(weighing_event(item, timestamp, body))
+
+        repository.commit()
+        response_cache.invalidate(touched)
+        mark_written()
+        for event in events:
+            weight_feed.publish(event)
+        applied = sum(1 for result in results if result["status"] == 200)
+        return jsonify({"applied": applied, "failed": len(results) - applied, "results": results}), 200
+
+    except Exception as e:
+        repository.rollback()
+        print(f"Error in weight bulk: {e}")
+        return jsonify({"error": f"An error occurred, no weighing was applied: {str(e)}"}), 500
 
 @app.route('/batch-weight', methods=['POST'])
 def batch_weight() -> tuple:
     """
     Process a batch file containing container tara weights
     Accepts CSV files (id,kg/id,weight,unit) and JSON files
+    With async=true the file is processed as a background job, poll /batch-weight/jobs/<job_id>
+    Several file fields, a glob pattern (e.g. *.csv) or a folder name are parsed in parallel and written
+    in one pass, a container listed in several files gets the weight from the last one
+    Sessions waiting for the weighed containers get their neto, reported as neto_updated
+    Records are committed in chunks of BATCH_CHUNK_SIZE, a file failing partway keeps the chunks before
+    the failure: 207 with the error, records_committed and the line of an invalid record
     """
     try:
         # Validate request
         if 'file' not in request.form:
             return jsonify({"error": "No file specified"}), 404
+
+        filenames = request.form.getlist('file')
+        if (len(filenames) > 1 or any(char in filenames[0] for char in '*?[')
+                or (BATCH_IN_FOLDER / filenames[0]).is_dir()):
+            if request.form.get('async', 'false').lower() == 'true':
+                return jsonify({"error": "async mode takes a single file"}), 400
+            paths = resolve_batch_files(filenames)
+            if not paths:
+                return jsonify({"error": f"No batch files match {', '.join(filenames)} in /in folder"}), 404
+            for path in paths:
+                if not path.exists():
+                    return jsonify({"error": f"File {path.name} not found in /in folder"}), 404
+                if path.suffix.lower() not in BATCH_FILE_EXTENSIONS:
+                    return jsonify({"error": f"Unsupported file format: {path.name}"}), 404
+
+            stats = ingest_batch_files(",".join(filenames), paths)
+            mark_written()
+            message = f"Successfully processed {stats['records']} records from {len(paths)} files"
+            return jsonify({"message": message, **stats}), 200
             
-        filename = request.form['file']
-        file_path = Path('/app/in') / filename
+        filename = filenames[0]
+        file_path = BATCH_IN_FOLDER / filename
         
         # Validate file exists
         if not file_path.exists():
             return jsonify({"error": f"File {filename} not found in /in folder"}), 404
 
-        # Process file based on extension
         ext = file_path.suffix.lower()
-        if ext == '.json':
-            records = process_json_file(file_path)
-        elif ext == '.csv':
-            records = process_csv_file(file_path)
-        else:
+        if ext not in BATCH_FILE_EXTENSIONS:
             return jsonify({"error": "Unsupported file format"}), 404
 
-        # Update database
-        cursor = mysql.connection.cursor()
-        try:
-            for container_id, weight in records:
-                cursor.execute(
-                    """INSERT INTO containers_registered 
-                       (container_id, weight, unit) 
-                       VALUES (%s, %s, 'kg')
-                       ON DUPLICATE KEY UPDATE weight=%s, unit='kg'""",
-                    (container_id, weight, weight)
-                )
-            
-            mysql.connection.commit()
-            return jsonify({"message": f"Successfully processed {len(records)} records"}), 200
-            
-        except Exception as db_error:
-            mysql.connection.rollback()
-            raise db_error
-        finally:
-            cursor.close()
+        # Job mode: return immediately and process in the background worker pool
+        if request.form.get('async', 'false').lower() == 'true':
+            job_id = submit_batch_job(filename)
+            response = jsonify({"job_id": job_id, "status": "queued"})
+            response.headers['Location'] = f"/batch-weight/jobs/{job_id}"
+            return response, 202
+
+        # Parse lazily, records are written chunk by chunk
+        with open(file_path, 'r', newline='') as f:
+            stats = ingest_batch_file(file_path, iter_batch_records(f, ext))
+        mark_written()
+        return jsonify({"message": f"Successfully processed {stats['records']} records", **stats}), 200
+
+    except BatchIngestError as e:
+        print(f"Error in batch-weight: {e}")
+        body = {"error": str(e), "records_committed": e.records_committed}
+        if isinstance(e.__cause__, BatchRecordError):
+            body["line"] = e.__cause__.line
+        if e.records_committed:
+            mark_written()
+            return jsonify(body), 207
+        return jsonify(body), 500
 
     except Exception as e:
         print(f"Error in batch-weight: {e}")
         return jsonify({"error": str(e)}), 500
 
+def archive_closed_transactions(cutoff: datetime) -> int:
+    """
+    Move closed transactions older than cutoff from the live table to the archive, ARCHIVE_CHUNK_SIZE at a time.
+    Each chunk is written to part files of its months before it is deleted, so an interrupted run loses nothing,
+    and the months are compacted once at the end. Returns the number of transactions archived
+    """
+    if transaction_archive is None:
+        raise RuntimeError("Archiving requires pyarrow")
+    repository = get_repository()
+    archived = 0
+    while True:
+        rows = repository.archivable_transactions(cutoff, ARCHIVE_CHUNK_SIZE)
+        if not rows:
+            break
+        transaction_archive.write(rows)
+        register_archived_trucks(repository, (tuple(row[column] for column in TRANSACTION_COLUMNS) for row in rows))
+        repository.delete_transactions([row["id"] for row in rows])
+        repository.commit()
+        archived += len(rows)
+    transaction_archive.compact()
+    return archived
+
+def register_archived_trucks(repository: WeightRepository, rows: Iterable[tuple]) -> int:
+    """
+    Upsert the trucks of archived transactions (TRANSACTION_COLUMNS rows) into the registry, so truck lookups
+    never read the archive: the tara of the latest "out", last seen, and the completed sessions of trucks
+    not registered yet. Not committed. Returns the number of trucks
+    """
+    trucks: Dict[str, List] = {}
+    for _, timestamp, direction, truck, _, _, truck_tara, _, _ in rows:
+        if not truck or timestamp is None:
+            continue
+        seen = trucks.setdefault(truck, [None, None, timestamp, 0])
+        seen[2] = max(seen[2], timestamp)
+        if direction == "out":
+            seen[3] += 1
+            if truck_tara is not None and (seen[1] is None or timestamp >= seen[1]):
+                seen[0], seen[1] = truck_tara, timestamp
+    for chunk in iter_chunks(trucks, LOOKUP_CHUNK_SIZE):
+        registered = repository.get_trucks(chunk)
+        repository.upsert_trucks([(truck, *trucks[truck][:3], 0 if truck in registered else trucks[truck][3])
+                                  for truck in chunk])
+    return len(trucks)
+
+# Rollup rows written per statement by the rebuild
+ROLLUP_REBUILD_CHUNK_SIZE = 1000
+
+def rebuild_daily_rollups() -> int:
+    """
+    Regenerate the daily rollups from the live transactions and the archive in a single transaction.
+    The rows are cleared first, so a weighing committed meanwhile waits for the rebuild on its rollup row
+    and is added on top of it. Returns the number of rollup rows written
+    """
+    repository = get_repository()
+    try:
+        repository.clear_daily_rollups()
+        t1, t2 = datetime(1000, 1, 1), datetime(9999, 12, 31)
+        rows = repository.iter_transactions(t1, t2, ['in', 'out', 'none'])
+        archive = archive_for(t1, t2)
+        if archive is not None:
+            rows = merge_by_id(archive.iter_transactions(t1, t2, ['in', 'out', 'none']), rows)
+        totals: Dict[Tuple, List[int]] = {}
+        for _, timestamp, direction, _, _, bruto, _, neto, produce in rows:
+            if timestamp is None:
+                continue
+            day, produce, direction, *values = rollup_delta(timestamp, produce, direction or 'na', bruto, neto)
+            row = totals.setdefault((day, produce, direction), [0, 0, 0, 0])
+            for i, value in enumerate(values):
+                row[i] += value
+        for chunk in iter_chunks(totals.items(), ROLLUP_REBUILD_CHUNK_SIZE):
+            repository.add_to_daily_rollups([key + tuple(values) for key, values in chunk])
+        repository.commit()
+        return len(totals)
+    except Exception:
+        repository.rollback()
+        raise
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command() -> None:
+    """Regenerate the daily rollups from all transactions, live and archived"""
+    written = rebuild_daily_rollups()
+    print(f"Rebuilt {written} daily rollup rows")
+
+@app.cli.command('archive')
+def archive_command() -> None:
+    """Archive closed transactions older than WEIGHT_ARCHIVE_AFTER_DAYS, run periodically e.g. from cron"""
+    cutoff = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived = archive_closed_transactions(cutoff)
+    print(f"Archived {archived} transactions older than {cutoff:%Y-%m-%d} to {ARCHIVE_FOLDER}")
+
+def apply_migrations(repository: WeightRepository) -> List[int]:
+    """Apply the pending MySQL schema migrations, returns the versions applied"""
+    # The unknown_containers migration reads transaction_containers
+    repository.ensure_schema()
+    repository.backfill_transaction_containers(BACKFILL_CHUNK_SIZE)
+    return migrations.migrate(repository.connection)
+
+@app.cli.command('migrate')
+def migrate_command() -> None:
+    """Apply pending MySQL schema migrations, see migrations.py, run once per deployment before the service starts"""
+    applied = apply_migrations(get_repository())
+    print(f"Applied migrations: {applied or 'none pending'}")
+
+@app.cli.command('check-query-plans')
+@click.option('--min-rows', default=1000, help="Tables smaller than this may be scanned when an index exists")
+def check_query_plans_command(min_rows: int) -> None:
+    """EXPLAIN every query the service issues, exits with status 1 if any plan is a full scan"""
+    problems = migrations.check_query_plans(mysql.connection, min_rows)
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print("All query plans use an index")
+
+if STORAGE_ENGINE != 'mysql':
+    # Local engines start empty, create their tables on import
+    with app.app_context():
+        get_repository().ensure_schema()
+
+# wsgi serves with the Flask development server, asgi with uvicorn on an event loop, see asgi_service.py
+SERVING_MODE = os.environ.get('WEIGHT_SERVING_MODE', 'wsgi')
+SERVING_PORT = int(os.environ.get('WEIGHT_PORT', '5000'))
+# Migrations may rebuild whole tables, so they are applied by flask migrate rather than by every starting instance.
+# true applies them on startup too, e.g. for a single local instance
+MIGRATE_ON_STARTUP = os.environ.get('WEIGHT_MIGRATE_ON_STARTUP', 'false').lower() == 'true'
+
+def run_startup_maintenance() -> None:
+    """Schema, backfills, interrupted batch jobs and the tara cache, run once before serving"""
+    with app.app_context():
+        repository = get_repository()
+        repository.ensure_schema()
+        if site_shards is not None:
+            # Only this site's own instance moves its id range, other instances never write it
+            repository.set_transaction_id_floor(site_shards.first_id(SITE))
+            repository.commit()
+        indexed = repository.backfill_transaction_containers(BACKFILL_CHUNK_SIZE)
+        print(f"Indexed {indexed} container/session links")
+        if STORAGE_ENGINE == 'mysql' and MIGRATE_ON_STARTUP:
+            print(f"Applied migrations {apply_migrations(repository)}")
+        elif STORAGE_ENGINE == 'mysql':
+            applied = migrations.applied_versions(repository.connection)
+            pending = [version for version, _, _ in migrations.MIGRATIONS if version not in applied]
+            if pending:
+                print(f"Pending migrations {pending}, apply them with flask migrate")
+        opened = repository.backfill_open_sessions()
+        print(f"Found {opened} open sessions")
+        first_start = not repository.search_trucks('', 1)
+        registered = repository.backfill_trucks()
+        if first_start and transaction_archive is not None:
+            # Trucks whose weighings were archived before the registry existed
+            archived = register_archived_trucks(
+                repository, transaction_archive.iter_transactions(datetime(1000, 1, 1), datetime(9999, 12, 31),
+                                                                   ['in', 'out', 'none']))
+            repository.commit()
+            print(f"Registered the {archived} trucks of archived weighings")
+        print(f"Registered {registered} trucks")
+        resumed = resume_batch_jobs()
+        print(f"Resumed {resumed} batch jobs")
+        version = refresh_tara_cache()
+        print(f"Tara cache at version {version}")
+        if WATCH_IN_FOLDER:
+            watcher = start_folder_watcher()
+            print(f"Watching {BATCH_IN_FOLDER} with {'inotify' if watcher.use_inotify else 'polling'}")
+
+# The weight service as an ASGI application, e.g. uvicorn weight_service:asgi_app
+asgi_app = WSGIToASGI(app, on_startup=run_startup_maintenance)
+
 if __name__ == '__main__':
     # Verify database connection on startup
     try:
         with app.app_context():  # This ensures you are inside the app context
-            cursor = mysql.connection.cursor()
-            print("Successfully connected to MySQL database!")
+            get_repository().ping()
+            print(f"Successfully connected to {STORAGE_ENGINE} storage!")
     except Exception as e:
-        print(f"Error connecting to MySQL: {e}")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+        print(f"Error connecting to {STORAGE_ENGINE} storage: {e}")
+    if SERVING_MODE == 'asgi':
+        import uvicorn
+        uvicorn.run(asgi_app, host='0.0.0.0', port=SERVING_PORT, backlog=4096)
+    else:
+        # debug=True re-runs this module in a reloader child that serves the requests,
+        # run startup maintenance only there so background jobs are not started twice
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            try:
+                run_startup_maintenance()
+            except Exception as e:
+                print(f"Error running startup maintenance: {e}")
+        app.run(debug=True, host='0.0.0.0', port=SERVING_PORT)
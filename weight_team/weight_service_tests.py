@@ -1,19 +1,60 @@
-import unittest,sys,json
+import unittest,sys,json,time,tempfile,os,io,asyncio,threading,sqlite3,itertools
+from unittest import mock
+from datetime import datetime, timedelta
 from flask import Flask
 from flask.testing import FlaskClient 
 from pathlib import Path
-from weight_service import app, calculate_neto 
+from weight_service import app, asgi_app, register_archived_trucks, rebuild_daily_rollups, calculate_neto, archive_closed_transactions, ingest_watched_file
+from archive import archive_available, TransactionArchive
+from tara_cache import TaraCache
+from response_cache import ResponseCache
+from folder_watcher import FolderWatcher
+from group_commit import GroupCommitter
+from replicas import ReplicaRouter
+from event_feed import EventFeed
+from asgi_service import WSGIToASGI
+from shards import ShardSet, SHARD_ID_SPAN
+import weight_service
+from storage import create_repository_factory, WeightRepository, MySQLRepository, FIRST_TRANSACTION_ID
+from migrations import query_plan_workload, record_queries, check_sqlite_query_plans
 sys.path.append(str(Path(__file__).parent.resolve()))
 id_exsist=''
+# A distinct base per test (with room for +1..+9), so the trucks and containers a test creates are its own
+SUFFIXES = itertools.count(int(time.time() * 1000) % 10 ** 8 * 10, 10)
 
 class TestWeightAPI(unittest.TestCase):
 
     def setUp(self):
         """
-        Set up the Flask test client before each test.
+        Set up the Flask test client, an id suffix and an empty /in folder for batch files before each test.
         """
         self.client = app.test_client()
         self.client.testing = True
+        self.suffix = next(SUFFIXES)
+        in_folder = tempfile.TemporaryDirectory()
+        self.addCleanup(in_folder.cleanup)
+        self.in_folder = Path(in_folder.name)
+        patcher = mock.patch.object(weight_service, 'BATCH_IN_FOLDER', self.in_folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def weigh(self, direction, weight, **fields):
+        """POST /weight of a weighing with the given fields"""
+        return self.client.post('/weight', data=json.dumps({"direction": direction, "weight": weight, **fields}),
+                                content_type='application/json')
+
+    def write_batch_file(self, name, content):
+        """Write a batch file to the /in folder, CSV text or a JSON list, returns its name"""
+        with open(self.in_folder / name, 'w') as f:
+            if isinstance(content, str):
+                f.write(content)
+            else:
+                json.dump(content, f)
+        return name
+
+    def post_batch_file(self, name, **fields):
+        return self.client.post('/batch-weight', data={"file": name, **fields},
+                                content_type='application/x-www-form-urlencoded')
 
     def test_health_endpoint(self):
         """
@@ -45,6 +86,61 @@ class TestWeightAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIsInstance(response.json, list)
 
+    def test_get_weight_keyset_pagination(self):
+        """
+        Test the /weight endpoint pages by id with after_id and limit.
+        """
+        params = {'from': '20200101000000', 'limit': 1}
+        response = self.client.get('/weight', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.json), 1)
+        if response.json:
+            params['after_id'] = response.headers['X-Next-After-Id']
+            response = self.client.get('/weight', query_string=params)
+            self.assertEqual(response.status_code, 200)
+            for row in response.json:
+                self.assertGreater(row["id"], int(params['after_id']))
+
+    def test_get_weight_ndjson(self):
+        """
+        Test the /weight endpoint streams one JSON object per line with format=ndjson.
+        """
+        params = {'from': '20200101000000', 'format': 'ndjson'}
+        response = self.client.get('/weight', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row["id"] for row in rows], sorted(row["id"] for row in rows))
+
+    def test_get_weight_invalid_limit(self):
+        """
+        Test the /weight endpoint rejects a non numeric limit.
+        """
+        response = self.client.get('/weight', query_string={'limit': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json)
+
+    def test_get_weight_summary(self):
+        """
+        Test the /weight/summary endpoint returns one aggregate per bucket, direction and produce.
+        """
+        params = {'from': '20200101000000', 'bucket': 'day'}
+        response = self.client.get('/weight/summary', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.json, list)
+        for row in response.json:
+            self.assertIn("count", row)
+            self.assertIn("sum", row["bruto"])
+            self.assertIn("p50", row["neto"])
+
+    def test_get_weight_summary_invalid_bucket(self):
+        """
+        Test the /weight/summary endpoint rejects an unknown bucket size.
+        """
+        response = self.client.get('/weight/summary', query_string={'bucket': 'minute'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json)
+
     def test_post_weight_in(self):
         """
         Test the /weight endpoint for direction "in".
@@ -80,6 +176,97 @@ class TestWeightAPI(unittest.TestCase):
         response = self.client.post('/weight', data=json.dumps(data), content_type='application/json')
         self.assertIn(response.status_code, [200, 400])  # Depending on session existence
 
+    def test_post_weight_open_session_cycle(self):
+        """
+        Test a truck can only hold one open session: in, in, out, out, in.
+        """
+        truck = f"T-{self.suffix}"
+        weighing = {"truck": truck, "containers": "", "unit": "kg", "produce": "oranges"}
+
+        first_in = self.weigh("in", 20000, **weighing)
+        self.assertEqual(first_in.status_code, 200)
+        self.assertEqual(self.weigh("in", 20000, **weighing).status_code, 400)
+        out = self.weigh("out", 8000, **weighing)
+        self.assertEqual(out.status_code, 200)
+        self.assertEqual(out.json["bruto"], 20000)
+        self.assertEqual(out.json["neto"], 12000)
+        self.assertEqual(self.weigh("out", 8000, **weighing).status_code, 400)
+        second_in = self.weigh("in", 21000, **weighing)
+        self.assertEqual(second_in.status_code, 200)
+        self.assertNotEqual(second_in.json["id"], first_in.json["id"])
+
+    @unittest.skipUnless(archive_available(), "pyarrow is not installed")
+    def test_archived_sessions_stay_readable(self):
+        """
+        Test closed sessions moved to the archive are still served by /session, /item and /weight.
+        """
+        truck = f"T-{self.suffix}"
+        weighing = {"truck": truck, "containers": "", "unit": "kg", "produce": "oranges"}
+        session_in = self.weigh("in", 20000, **weighing).json["id"]
+        session_out = self.weigh("out", 8000, **weighing).json["id"]
+
+        with app.app_context():
+            self.assertGreaterEqual(archive_closed_transactions(datetime.now() + timedelta(days=1)), 2)
+
+        response = self.client.get(f'/session/{session_out}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["neto"], 12000)
+        response = self.client.get(f'/item/{truck}', query_string={'from': '20200101000000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["tara"], 8000)
+        self.assertEqual(response.json["sessions"], [str(session_in), str(session_out)])
+        response = self.client.get('/weight', query_string={'from': '20200101000000', 'filter': 'in,out'})
+        ids = [row["id"] for row in response.json]
+        self.assertIn(session_out, ids)
+        self.assertEqual(ids, sorted(set(ids)))
+
+    def test_post_weight_bulk(self):
+        """
+        Test the /weight/bulk endpoint applies buffered readings in order and reports each one.
+        """
+        truck = f"T-{self.suffix + 1}"
+        readings = [
+            {"direction": "in", "truck": truck, "weight": 20000, "produce": "apples", "datetime": "20250105080000"},
+            {"direction": "in", "truck": truck, "weight": 20000, "produce": "apples"},
+            {"direction": "out", "truck": truck, "weight": 9000, "datetime": "20250105081500"}
+        ]
+        response = self.client.post('/weight/bulk', data=json.dumps(readings), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["applied"], 2)
+        self.assertEqual(response.json["failed"], 1)
+        self.assertEqual([r["status"] for r in response.json["results"]], [200, 400, 200])
+        self.assertEqual(response.json["results"][2]["neto"], 11000)
+
+    def test_post_weight_bulk_isolates_failing_item(self):
+        """
+        Test an item that raises is reported with status 500 while the other items are applied.
+        """
+        truck = f"T-{self.suffix + 2}"
+        apply_weighing = weight_service.apply_weighing
+
+        def failing(repository, item, timestamp, touched):
+            if item.get("truck") == "BULK-FAIL":
+                raise RuntimeError("lost connection")
+            return apply_weighing(repository, item, timestamp, touched)
+
+        readings = [{"direction": "in", "truck": "BULK-FAIL", "weight": 1000},
+                    {"direction": "in", "truck": truck, "weight": 20000, "produce": "apples"}]
+        with mock.patch.object(weight_service, 'apply_weighing', side_effect=failing):
+            response = self.client.post('/weight/bulk', data=json.dumps(readings), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in response.json["results"]], [500, 200])
+        self.assertEqual(response.json["applied"], 1)
+        session_id = response.json["results"][1]["id"]
+        self.assertEqual(self.client.get(f'/session/{session_id}').json["truck"], truck)
+
+    def test_post_weight_bulk_requires_array(self):
+        """
+        Test the /weight/bulk endpoint rejects a body that is not an array.
+        """
+        response = self.client.post('/weight/bulk', data=json.dumps({"direction": "in"}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json)
+
     def test_post_weight_invalid_direction(self):
         """
         Test the /weight endpoint with an invalid direction.
@@ -122,18 +309,193 @@ class TestWeightAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertIn("error", response.json)
 
+    def test_get_item_container_sessions(self):
+        """
+        Test the /item/<id> endpoint for a container lists the sessions it was weighed in.
+        """
+        containers = [f"C-{self.suffix}-1", f"C-{self.suffix}-2"]
+        name = self.write_batch_file("containers.csv", f"id,kg\n{containers[0]},296\n{containers[1]},273\n")
+        self.assertEqual(self.post_batch_file(name).status_code, 200)
+        response = self.weigh("in", 18000, truck=f"T-{self.suffix}", containers=",".join(containers),
+                              unit="kg", produce="oranges", force=True)
+        self.assertEqual(response.status_code, 200)
+        session_id = str(response.json["id"])
+
+        params = {'to': (datetime.now() + timedelta(minutes=1)).strftime('%Y%m%d%H%M%S')}
+        response = self.client.get(f'/item/{containers[0]}', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(session_id, response.json["sessions"])
+
     def test_post_batch_weight(self):
         """
-        Test the /batch-weight endpoint with a valid file from Docker volume.
+        Test the /batch-weight endpoint stores the taras of a CSV file, in kg or converted from lbs.
+        """
+        name = self.write_batch_file("containers.csv", f"id,weight,unit\nB-{self.suffix}-1,296,kg\nB-{self.suffix}-2,100,lbs\n")
+        response = self.post_batch_file(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["records"], 2)
+        self.assertEqual([self.client.get(f'/item/B-{self.suffix}-{i}').json["tara"] for i in (1, 2)], [296, 45])
+        self.assertEqual(self.post_batch_file("missing.csv").status_code, 404)
+
+    def test_post_batch_weight_json_throughput(self):
+        """
+        Test the /batch-weight endpoint reports chunked ingest statistics for a JSON file.
         """
-        test_file_path = Path('containers1.csv')  # File mounted from Docker volume
-   
-        response = self.client.post('/batch-weight', 
-                data={"file": str(test_file_path)},
-                content_type='application/x-www-form-urlencoded')
+        records = [{"id": f"J-{self.suffix}-{i}", "weight": 100 + i, "unit": "kg"} for i in range(2500)]
+        response = self.post_batch_file(self.write_batch_file("containers.json", records))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["records"], 2500)
+        self.assertEqual(response.json["chunks"], 3)
+        self.assertIn("records_per_second", response.json)
+        self.assertEqual(self.client.get(f'/item/J-{self.suffix}-2499').json["tara"], 2599)
+
+    def test_post_batch_weight_failing_halfway(self):
+        """
+        Test a file failing after its first chunk reports the committed records and the failing line.
+        """
+        rows = "".join(f"H-{self.suffix}-{i},{i}\n" for i in range(1, 1201))
+        name = self.write_batch_file("containers.csv", f"id,kg\n{rows}H-{self.suffix}-bad,heavy\n")
+        response = self.post_batch_file(name)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.json["records_committed"], response.json["line"]), (1000, 1202))
+        self.assertEqual(self.client.get(f'/item/H-{self.suffix}-1000').json["tara"], 1000)
+        self.assertEqual(self.client.get(f'/item/H-{self.suffix}-1001').status_code, 404)
+
+        name = self.write_batch_file("containers.json", [{"id": f"H-{self.suffix}-j1", "weight": 1}, {"id": "no weight"}])
+        response = self.post_batch_file(name)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual((response.json["records_committed"], response.json["line"]), (0, 2))
+
+    def test_failed_batch_keeps_tara_cache_in_step(self):
+        """
+        Test the containers of the chunks a failed batch committed are found and weighed with their tara.
+        """
+        with app.app_context():
+            weight_service.refresh_tara_cache()
+        rows = "".join(f"Y-{self.suffix}-{i},{i}\n" for i in range(1, 1201))
+        name = self.write_batch_file("containers.csv", f"id,kg\n{rows}Y-{self.suffix}-bad,heavy\n")
+        self.assertEqual(self.post_batch_file(name).status_code, 207)
+
+        container = f"Y-{self.suffix}-5"
+        self.assertEqual(self.client.get(f'/item/{container}').json["tara"], 5)
+        weighing = {"truck": f"T-{self.suffix}", "containers": container, "unit": "kg", "produce": "na"}
+        self.weigh("in", 20000, **weighing)
+        self.assertEqual(self.weigh("out", 8000, **weighing).json["neto"], 11995)
+
+    def test_post_batch_weight_folder_last_file_wins(self):
+        """
+        Test a folder given to /batch-weight is ingested in one pass, the last file by name winning per container.
+        """
+        suffix = self.suffix
+        os.mkdir(self.in_folder / "folder")
+        self.write_batch_file("folder/a.csv", f"id,kg\nM-{suffix}-1,100\nM-{suffix}-2,200\n")
+        self.write_batch_file("folder/b.json", [{"id": f"M-{suffix}-1", "weight": 150}])
+        response = self.post_batch_file("folder")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f["file"] for f in response.json["files"]], ["a.csv", "b.json"])
+        self.assertEqual([f["records"] for f in response.json["files"]], [2, 1])
+        self.assertEqual(response.json["records"], 3)
+        self.assertEqual(self.client.get(f'/item/M-{suffix}-1').json["tara"], 150)
+
+    def test_ingest_watched_file_skips_applied_content(self):
+        """
+        Test a watched file is applied once per content and only rows with a new tara are written.
+        """
+        suffix = self.suffix
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(f"id,kg\nW-{suffix}-1,100\nW-{suffix}-2,200\n")
+        try:
+            self.assertEqual(ingest_watched_file(f.name)["records_changed"], 2)
+            self.assertIsNone(ingest_watched_file(f.name))
+            with open(f.name, "w") as changed:
+                changed.write(f"id,kg\nW-{suffix}-1,100\nW-{suffix}-2,250\n")
+            self.assertEqual(ingest_watched_file(f.name)["records_changed"], 1)
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(self.client.get(f'/item/W-{suffix}-2').json["tara"], 250)
+
+    def test_post_batch_weight_fills_missing_neto(self):
+        """
+        Test registering the taras of unknown containers fills in the neto of their sessions.
+        """
+        truck, containers = f"T-{self.suffix}", [f"N-{self.suffix}-1", f"N-{self.suffix}-2"]
+        weighing = {"truck": truck, "containers": ",".join(containers), "unit": "kg", "produce": "oranges"}
+        self.weigh("in", 20000, **weighing)
+        out = self.weigh("out", 8000, **weighing)
+        self.assertEqual(out.json["neto"], None)
+
+        name = self.write_batch_file("containers.json", [{"id": containers[0], "weight": 300},
+                                                         {"id": containers[1], "weight": 200}])
+        response = self.post_batch_file(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["neto_updated"], 1)
+        self.assertEqual(self.client.get(f'/session/{out.json["id"]}').json["neto"], 11500)
+
+    def test_weigh_out_during_a_batch_gets_a_neto(self):
+        """
+        Test weigh-outs between the chunks of a batch end up with a neto, from the committed chunk or the later one.
+        """
+        with app.app_context():
+            weight_service.refresh_tara_cache()
+        first, second = f"W-{self.suffix}-1", f"W-{self.suffix}-{weight_service.BATCH_CHUNK_SIZE + 1}"
+        trucks = {f"T-{self.suffix}-1": first, f"T-{self.suffix}-2": f"{first},{second}"}
+        for truck, containers in trucks.items():
+            self.weigh("in", 20000, truck=truck, containers=containers)
+        outs = []
+
+        def records():
+            for i in range(1, 2 * weight_service.BATCH_CHUNK_SIZE + 1):
+                if i == weight_service.BATCH_CHUNK_SIZE + 1:
+                    # The first chunk is committed, the second one is not read yet
+                    outs.extend(self.weigh("out", 8000, truck=truck, containers=containers).json
+                                for truck, containers in trucks.items())
+                yield f"W-{self.suffix}-{i}", 100
+
+        with app.app_context():
+            weight_service.ingest_batch_file(Path("containers.csv"), records())
+        self.assertEqual([out["neto"] for out in outs], [11900, None])
+        self.assertEqual([self.client.get(f'/session/{out["id"]}').json["neto"] for out in outs], [11900, 11800])
+
+    def test_unknown_containers_follow_weighings_and_batches(self):
+        """
+        Test containers weighed before being registered are listed by /unknown until a batch gives them a tara.
+        """
+        containers = [f"U-{self.suffix}-1", f"U-{self.suffix}-2"]
+        self.weigh("in", 20000, truck=f"T-{self.suffix}", containers=",".join(containers))
+        self.assertTrue(set(containers) <= set(self.client.get('/unknown').json))
+
+        name = self.write_batch_file("containers.json", [{"id": containers[0], "weight": 300},
+                                                         {"id": containers[1], "weight": 0}])
+        self.assertEqual(self.post_batch_file(name).status_code, 200)
+        unknown = self.client.get('/unknown').json
+        self.assertNotIn(containers[0], unknown)
+        self.assertIn(containers[1], unknown)
+
+    def test_post_batch_weight_async_job(self):
+        """
+        Test the /batch-weight endpoint in job mode returns a job id that can be polled until done.
+        """
+        name = self.write_batch_file("containers.csv", f"id,kg\nA-{self.suffix}-1,310\nA-{self.suffix}-2,320\n")
+        response = self.post_batch_file(name, **{"async": "true"})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json["job_id"]
+        for _ in range(50):
+            job = self.client.get(f'/batch-weight/jobs/{job_id}').json
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.1)
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["rows_processed"], 2)
+        self.assertEqual(self.client.get(f'/item/A-{self.suffix}-2').json["tara"], 320)
+
+    def test_get_batch_job_not_found(self):
+        """
+        Test the /batch-weight/jobs/<id> endpoint with an unknown job id.
+        """
+        response = self.client.get('/batch-weight/jobs/999999')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("error", response.json)
 
-        self.assertIn(response.status_code, [200, 404])  # File might not exist
-        self.assertIsInstance(response.json, dict)
     def test_session_valid_id(self):
         """
         Test the /session/<id> endpoint with a valid session ID.
@@ -207,6 +569,810 @@ class TestWeightAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("id", response.json)
 
+    def test_get_tara_cache_stats(self):
+        """
+        Test the /tara-cache endpoint exposes the hit/miss counters.
+        """
+        response = self.client.get('/tara-cache')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("hits", response.json)
+        self.assertIn("misses", response.json)
+
+
+    def test_post_sessions_batch_lookup(self):
+        """
+        Test /sessions resolves several ids at once and marks the unknown ones.
+        """
+        response = self.client.post('/weight', data=json.dumps({"direction": "none", "weight": 500}),
+                                    content_type='application/json')
+        session_id = str(response.json["id"])
+        response = self.client.post('/sessions', data=json.dumps([session_id, "99999999", "abc"]),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[session_id]["bruto"], 500)
+        self.assertEqual(response.json["99999999"], {"error": "Session not found"})
+        self.assertEqual(response.json["abc"], {"error": "Session not found"})
+        self.assertEqual(self.client.post('/sessions', data=json.dumps({"ids": []}),
+                                          content_type='application/json').status_code, 400)
+
+    def test_post_items_batch_lookup(self):
+        """
+        Test /items returns the same result as /item for each id.
+        """
+        suffix = self.suffix
+        truck, container = f"T-{suffix}", f"I-{suffix}"
+        for direction, weight in (("in", 20000), ("out", 8000)):
+            self.weigh(direction, weight, truck=truck, containers=container)
+        response = self.client.post('/items', data=json.dumps([truck, f"X-{suffix}"]),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[truck], self.client.get(f'/item/{truck}').json)
+        self.assertEqual(response.json[truck]["tara"], 8000)
+        self.assertEqual(response.json[f"X-{suffix}"], {"error": "Item not found"})
+
+    def test_export_weights(self):
+        """
+        Test /weight/export streams the day's transactions as CSV and, with pyarrow, as Parquet.
+        """
+        suffix = self.suffix
+        self.weigh("in", 15000, truck=f"E-{suffix}", containers="C-1,C-2")
+        response = self.client.get('/weight/export?format=csv&filter=in')
+        self.assertEqual(response.status_code, 200)
+        lines = response.data.decode().splitlines()
+        self.assertEqual(lines[0], "id,datetime,direction,truck,containers,bruto,truckTara,neto,produce")
+        self.assertTrue(any(f"E-{suffix},\"C-1,C-2\",15000" in line for line in lines[1:]))
+        self.assertEqual(self.client.get('/weight/export?format=xml').status_code, 400)
+
+        if archive_available():
+            import pyarrow.parquet as pq
+            response = self.client.get('/weight/export?format=parquet&filter=in')
+            table = pq.read_table(io.BytesIO(response.data))
+            rows = [row for row in table.to_pylist() if row["truck"] == f"E-{suffix}"]
+            self.assertEqual(rows[0]["containers"], ["C-1", "C-2"])
+
+    def test_session_etag_revalidation(self):
+        """
+        Test /session answers If-None-Match with 304 until a force overwrite changes the session.
+        """
+        truck = f"T-{self.suffix}"
+        session_id = self.weigh("in", 10000, truck=truck, force=False).json["id"]
+        first = self.client.get(f'/session/{session_id}')
+        etag = first.headers["ETag"]
+        self.assertEqual(self.client.get(f'/session/{session_id}', headers={"If-None-Match": etag}).status_code, 304)
+
+        self.weigh("in", 12000, truck=truck, force=True)
+        second = self.client.get(f'/session/{session_id}', headers={"If-None-Match": etag})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json["bruto"], 12000)
+        self.assertNotEqual(second.headers["ETag"], etag)
+
+    def test_item_etag_revalidation_without_to(self):
+        """
+        Test /item without "to" answers If-None-Match with 304 in a later second, until the item is weighed again.
+        """
+        truck = f"T-{self.suffix}"
+        self.weigh("in", 10000, truck=truck)
+        etag = self.client.get(f'/item/{truck}').headers["ETag"]
+
+        class Later(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.now(tz) + timedelta(seconds=5)
+
+        with mock.patch.object(weight_service, 'datetime', Later):
+            self.assertEqual(self.client.get(f'/item/{truck}', headers={"If-None-Match": etag}).status_code, 304)
+        session_id = self.weigh("out", 4000, truck=truck).json["id"]
+        second = self.client.get(f'/item/{truck}', headers={"If-None-Match": etag})
+        self.assertEqual((second.status_code, second.json["tara"]), (200, 4000))
+        self.assertIn(str(session_id), second.json["sessions"])
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def test_invalidate_drops_entries_and_late_puts(self):
+        cache = ResponseCache(max_entries=2)
+        version = cache.version("session:1")
+        cache.put("session:1", "session:1", version, b"old")
+        self.assertEqual(cache.get("session:1", version), b"old")
+        cache.invalidate(["session:1"])
+        self.assertIsNone(cache.get("session:1", cache.version("session:1")))
+        # Rendered from data read before the invalidation
+        cache.put("session:1", "session:1", version, b"stale")
+        self.assertIsNone(cache.get("session:1", cache.version("session:1")))
+
+    def test_evicted_versions_do_not_revive_entries(self):
+        cache = ResponseCache(max_entries=1)
+        cache.max_tags = 1
+        version = cache.version("item:a")
+        cache.invalidate(["item:a"])
+        cache.invalidate(["item:b"])
+        cache.put("item:a", "item:a", version, b"stale")
+        self.assertIsNone(cache.get("item:a", cache.version("item:a")))
+
+
+class TestFolderWatcher(unittest.TestCase):
+
+    def test_polling_reports_stable_files(self):
+        folder = tempfile.mkdtemp()
+        reported = []
+        watcher = FolderWatcher(folder, ('.csv', '.json'), reported.append, use_inotify=False)
+        path = os.path.join(folder, "containers.csv")
+        with open(path, "w") as f:
+            f.write("id,kg\n")
+        with open(os.path.join(folder, "notes.txt"), "w") as f:
+            f.write("skipped")
+        self.assertEqual(watcher.poll_once(), [])
+        self.assertEqual(watcher.poll_once(), [path])
+        self.assertEqual(watcher.poll_once(), [])
+        with open(path, "a") as f:
+            f.write("C-1,100\n")
+        watcher.poll_once()
+        self.assertEqual(watcher.poll_once(), [path])
+        self.assertEqual(reported, [path, path])
+
+
+@unittest.skipUnless(archive_available(), "pyarrow is not installed")
+class TestTransactionArchive(unittest.TestCase):
+
+    def test_chunks_are_parts_until_compacted(self):
+        archive = TransactionArchive(tempfile.mkdtemp())
+        at = datetime(2024, 3, 1, 8, 0, 0)
+        row = lambda session_id, bruto: {"id": session_id, "datetime": at, "direction": "in", "truck": "A-T1",
+                                         "containers": "A-C1", "bruto": bruto, "truckTara": None, "neto": None,
+                                         "produce": "na"}
+        archive.write([row(2, 100), row(4, 100)])
+        # A chunk archived again after an interrupted run, with a later id of the same month
+        archive.write([row(3, 100), row(4, 200)])
+        self.assertEqual(len(os.listdir(archive.folder)), 2)
+        self.assertEqual([r[0] for r in archive.iter_weighings(at, at, ["in"])], [2, 3, 4, 4])
+        self.assertEqual(archive.get_session(4)["bruto"], 200)
+
+        self.assertEqual(archive.compact(), 1)
+        self.assertEqual(os.listdir(archive.folder), ["transactions-2024-03.arrow"])
+        self.assertEqual([(r[0], r[2]) for r in archive.iter_weighings(at, at, ["in"])], [(2, 100), (3, 100), (4, 200)])
+        self.assertEqual(archive.compact(), 0)
+
+
+class TestASGIService(unittest.TestCase):
+
+    def scope(self, method, path, headers=()):
+        path, _, query = path.partition('?')
+        return {'type': 'http', 'http_version': '1.1', 'method': method, 'path': path, 'root_path': '',
+                'query_string': query.encode(), 'scheme': 'http', 'server': ('testserver', 80),
+                'client': ('127.0.0.1', 50000),
+                'headers': [(b'content-type', b'application/json')] + list(headers)}
+
+    def call(self, method, path, body=b"", headers=(), application=asgi_app):
+        """Run one request through the ASGI app, the body arrives in two messages"""
+        messages = [{'type': 'http.request', 'body': body[:5], 'more_body': True},
+                    {'type': 'http.request', 'body': body[5:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # Like a server, nothing more arrives while the client stays connected
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(application(self.scope(method, path, headers), receive, send))
+        status = sent[0]['status']
+        response_headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+        self.assertFalse(sent[-1].get('more_body', False))
+        return status, response_headers, b"".join(message.get('body', b'') for message in sent[1:])
+
+    def test_routes_served_over_asgi(self):
+        weighing = {"direction": "in", "truck": "ASGI-T1", "containers": "", "weight": 9000,
+                    "unit": "kg", "force": True, "produce": "na"}
+        status, _, body = self.call('POST', '/weight', json.dumps(weighing).encode())
+        self.assertEqual(status, 200)
+        session_id = json.loads(body)["id"]
+
+        status, headers, body = self.call('GET', f'/session/{session_id}')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["truck"], "ASGI-T1")
+        status, _, body = self.call('GET', f'/session/{session_id}',
+                                    headers=[(b'if-none-match', headers['etag'].encode())])
+        self.assertEqual((status, body), (304, b""))
+
+        # Streamed routes keep their request context between chunks
+        status, _, body = self.call('GET', f'/weight?after_id={session_id - 1}&limit=1&format=ndjson')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body.splitlines()[0])["id"], session_id)
+
+    def test_disconnected_stream_releases_its_thread(self):
+        # A single handler thread, the next request is only served once the stream has given it back
+        application = WSGIToASGI(app, max_threads=1)
+
+        async def subscribe():
+            streaming = asyncio.Event()
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await streaming.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.body':
+                    streaming.set()
+
+            await asyncio.wait_for(application(self.scope('GET', '/weight/stream'), receive, send), 5)
+
+        with mock.patch.object(weight_service, 'WEIGHT_STREAM_HEARTBEAT_SECONDS', 0.05):
+            asyncio.run(subscribe())
+        status, _, _ = self.call('GET', '/unknown', application=application)
+        self.assertEqual(status, 200)
+
+
+class TestConcurrentWeighings(unittest.TestCase):
+    """Weighings of one truck racing on their own connections, run with WEIGHT_STORAGE=mysql for InnoDB locking"""
+
+    def race(self, weighing, count=8):
+        barrier = threading.Barrier(count)
+        responses = [None] * count
+
+        def post(index):
+            client = app.test_client()
+            barrier.wait()
+            responses[index] = client.post('/weight', json={"unit": "kg", "containers": "", "produce": "na",
+                                                            **weighing, "weight": 8000 + index})
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_first_weigh_ins_of_a_truck_open_one_session(self):
+        truck = f"RACE-T{next(SUFFIXES)}"
+        responses = self.race({"direction": "in", "truck": truck})
+        self.assertEqual(sorted(response.status_code for response in responses), [200] + [400] * 7)
+
+        responses = self.race({"direction": "in", "truck": truck, "force": True})
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.json["id"] for response in responses}), 1)
+        out = app.test_client().post('/weight', json={"direction": "out", "truck": truck, "weight": 4000})
+        self.assertEqual(out.status_code, 200)
+
+
+class TestGroupCommit(unittest.TestCase):
+
+    def test_concurrent_weighings_share_one_commit(self):
+        committer = GroupCommitter(weight_service.apply_weighing_group, window=5, max_items=4)
+        weighings = [{"direction": "in", "truck": f"GROUP-T{i}", "containers": "", "weight": 8000 + i,
+                      "unit": "kg", "force": True, "produce": "na"} for i in range(3)]
+        weighings.append({"direction": "sideways", "truck": "GROUP-T3", "weight": 1})
+        responses = [None] * len(weighings)
+
+        def post(index):
+            responses[index] = app.test_client().post('/weight', json=weighings[index])
+
+        with mock.patch.object(weight_service, 'group_committer', committer):
+            threads = [threading.Thread(target=post, args=(i,)) for i in range(len(weighings))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(committer.stats(), {"groups": 1, "items": 4})
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 400])
+        ids = {response.json["id"] for response in responses[:3]}
+        self.assertEqual(len(ids), 3)
+        client = app.test_client()
+        for session_id in ids:
+            self.assertEqual(client.get(f'/session/{session_id}').status_code, 200)
+
+    def test_failing_item_is_raised_to_its_submitter_only(self):
+        def apply_group(items):
+            return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+        committer = GroupCommitter(apply_group, window=0)
+        self.assertEqual(committer.submit(3), 6)
+        with self.assertRaises(ValueError):
+            committer.submit(-1)
+
+
+class TestReadReplicas(unittest.TestCase):
+
+    def setUp(self):
+        # A second, empty instance stands in for a replica that hasn't received the primary's writes
+        replica_path = tempfile.mkstemp(suffix='.sqlite3')[1]
+        self.replica_factory = create_repository_factory('sqlite', replica_path)
+        replica = self.replica_factory()
+        replica.ensure_schema()
+        replica.close()
+        self.router = ReplicaRouter([self.replica_factory], max_lag=5, check_seconds=0)
+        patcher = mock.patch.object(weight_service, 'replica_router', self.router)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def test_reads_use_replica_unless_they_need_newer_writes(self):
+        weighing = {"direction": "in", "truck": "REPLICA-T1", "containers": "", "weight": 7000,
+                    "unit": "kg", "force": True, "produce": "na"}
+        response = self.client.post('/weight', json=weighing)
+        self.assertEqual(response.status_code, 200)
+        session_id = response.json["id"]
+        write_time = response.headers['X-Write-Time']
+        page = f'/weight?after_id={session_id - 1}&limit=1'
+
+        self.assertEqual(self.client.get(page).json, [])
+        fresh = self.client.get(page, headers={'X-Read-After': write_time})
+        self.assertEqual([row["id"] for row in fresh.json], [session_id])
+        # Its cache tag was just invalidated, so the session is read from the primary
+        self.assertEqual(self.client.get(f'/session/{session_id}').status_code, 200)
+
+        self.router.max_lag = -1
+        self.assertEqual([row["id"] for row in self.client.get(page).json], [session_id])
+
+    def test_unreachable_replica_is_skipped(self):
+        def unreachable():
+            raise ConnectionError("replica down")
+
+        router = ReplicaRouter([unreachable, self.replica_factory], max_lag=5, check_seconds=60)
+        for _ in range(3):
+            repository = router.open()
+            self.assertIsNotNone(repository)
+            repository.close()
+        self.assertIsNone(router.stats()[0]["fresh_as_of"])
+        self.assertIsNone(router.open(time.time()))
+
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        class LaggingReplica(WeightRepository):
+            def replication_lag(self):
+                return 60.0
+
+            def close(self):
+                pass
+
+        session_id = self.client.post('/weight', json={"direction": "none", "containers": "", "weight": 100,
+                                                       "unit": "kg", "produce": "na"}).json["id"]
+        router = ReplicaRouter([LaggingReplica], max_lag=5, check_seconds=0)
+        with mock.patch.object(weight_service, 'replica_router', router):
+            page = self.client.get(f'/weight?filter=none&after_id={session_id - 1}&limit=1').json
+        self.assertEqual([row["id"] for row in page], [session_id])
+        self.assertEqual(router.stats()[0]["lag"], 60.0)
+        self.assertIsNone(router.stats()[0]["fresh_as_of"])
+
+    def test_replica_status_of_older_mysql(self):
+        class Cursor:
+            description = [('Seconds_Behind_Master',)]
+
+            def execute(self, query, params):
+                if query == "SHOW REPLICA STATUS":
+                    raise RuntimeError("You have an error in your SQL syntax")
+
+            def fetchone(self):
+                return (3,)
+
+            def close(self):
+                pass
+
+        connection = mock.Mock(cursor=Cursor)
+        self.assertEqual(MySQLRepository(connection).replication_lag(), 3.0)
+
+
+class TestWeightStream(unittest.TestCase):
+
+    def test_stream_resumes_after_last_event_id(self):
+        feed = weight_service.weight_feed
+        last_event_id = feed.event_id(feed.position())
+        client = app.test_client()
+        weighing = {"direction": "in", "truck": "STREAM-T1", "containers": "S-1,S-2", "weight": 6000,
+                    "unit": "kg", "force": True, "produce": "apples"}
+        session_id = client.post('/weight', json=weighing).json["id"]
+
+        response = client.get('/weight/stream?filter=in,out', headers={'Last-Event-ID': last_event_id},
+                              buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        lines = next(iter(response.response)).decode().strip().split("\n")
+        response.close()
+        self.assertEqual(lines[:2], [f"id: {feed.event_id(feed.position())}", "event: weighing"])
+        event = json.loads(lines[2][len("data: "):])
+        self.assertEqual((event["id"], event["truck"], event["containers"]), (session_id, "STREAM-T1", ["S-1", "S-2"]))
+
+        response = client.get('/weight/stream', headers={'Last-Event-ID': "unknown-1"}, buffered=False)
+        self.assertIn("event: reset", next(iter(response.response)).decode())
+        response.close()
+
+    def test_feed_reports_events_lost_from_the_buffer(self):
+        feed = EventFeed(buffer_size=2)
+        first = feed.publish({"n": 1})
+        feed.publish({"n": 2})
+        self.assertEqual([data for _, data in feed.wait(feed.resume_position(first), 0)], [{"n": 2}])
+        feed.publish({"n": 3})
+        feed.publish({"n": 4})
+        self.assertIsNone(feed.resume_position(first))
+        self.assertIsNone(feed.wait(0, 0))
+        self.assertEqual(feed.wait(feed.position(), 0), [])
+
+
+class TestSiteShards(unittest.TestCase):
+
+    def setUp(self):
+        # Two remote sites on local SQLite files, after the service's own database as the first site
+        sites = [weight_service.SITE, "north", "south"]
+        self.factories, read_factories = {}, {}
+        for site in sites[1:]:
+            path = tempfile.mkstemp(suffix='.sqlite3')[1]
+            self.factories[site] = create_repository_factory('sqlite', path)
+            read_factories[site] = create_repository_factory('sqlite', path, read_only=True)
+        self.shards = ShardSet(sites, weight_service.SITE, read_factories)
+        for site in sites[1:]:
+            repository = self.factories[site]()
+            repository.ensure_schema()
+            if site == "north":
+                # Weighed before sharding, with the last id of the range every site used then
+                repository.set_transaction_id_floor(FIRST_TRANSACTION_ID + SHARD_ID_SPAN - 1)
+                self.legacy_north = repository.insert_transaction(datetime(2025, 1, 1), "in", 5000, truck="LEGACY-T1")
+            # What the site's own instance does at startup
+            repository.set_transaction_id_floor(self.shards.first_id(site))
+            repository.commit()
+            repository.close()
+        patcher = mock.patch.object(weight_service, 'site_shards', self.shards)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def weigh(self, site=weight_service.SITE, **weighing) -> int:
+        """Weighing posted to this service, or applied to a remote site's shard as its own instance does"""
+        weighing = {"unit": "kg", "force": True, "produce": "na", **weighing}
+        if site == weight_service.SITE:
+            response = self.client.post('/weight', json=weighing)
+            self.assertEqual(response.status_code, 200, response.json)
+            return response.json["id"]
+        repository = self.factories[site]()
+        try:
+            body, status = weight_service.apply_weighing(repository, weighing, datetime.now().replace(microsecond=0))
+            repository.commit()
+        finally:
+            repository.close()
+        self.assertEqual(status, 200, body)
+        return body["id"]
+
+    def test_weighings_of_other_sites_are_refused(self):
+        weighing = {"direction": "in", "truck": "SHARD-T2", "weight": 8000}
+        response = self.client.post('/weight', json={**weighing, "site": "north"})
+        self.assertEqual((response.status_code, response.json["site"]), (421, "north"))
+        self.assertEqual(self.client.post('/weight', json={**weighing, "site": "east"}).status_code, 400)
+        self.assertEqual(self.client.get('/item/SHARD-T2').status_code, 404)
+
+    def test_sessions_are_read_from_their_site(self):
+        local = self.weigh(direction="in", truck="SHARD-T1", containers="SHARD-C1", weight=9000)
+        north = self.weigh(direction="in", truck="SHARD-T1", containers="SHARD-C1,SHARD-C2", weight=8000, site="north")
+        south = self.weigh(direction="in", truck="SHARD-T3", containers="", weight=7000, site="south")
+        self.assertEqual([self.shards.site_of(i) for i in (north, south)], ["north", "south"])
+        self.assertEqual(north, self.shards.first_id("north"))
+        self.assertEqual(south - north, SHARD_ID_SPAN)
+
+        # Sessions are read from their own site's shard
+        self.assertEqual(self.client.get(f'/session/{north}').json["truck"], "SHARD-T1")
+        self.assertEqual(self.client.get('/item/SHARD-T1').json["sessions"], [str(local), str(north)])
+        self.assertEqual(self.client.get('/item/SHARD-T3').json["sessions"], [str(south)])
+        self.assertIn("SHARD-C2", self.client.get('/unknown').json)
+
+    def test_weight_pages_merge_every_site_by_id(self):
+        ids = [self.weigh(direction="none", containers=f"SHARD-P{i}", weight=100 + i, site=site)
+               for i, site in enumerate(["south", "north", weight_service.SITE, "north", "south"])]
+        listed, after_id = [], min(ids) - 1
+        while True:
+            response = self.client.get(f'/weight?filter=none&after_id={after_id}&limit=2')
+            listed += [row["id"] for row in response.json]
+            if 'X-Next-After-Id' not in response.headers:
+                break
+            after_id = response.headers['X-Next-After-Id']
+        self.assertEqual([i for i in listed if i in ids], sorted(ids))
+        north_only = [row["id"] for row in self.client.get('/weight?filter=none&site=north').json]
+        self.assertEqual(north_only, [ids[1], ids[3]])
+        self.assertEqual(self.client.get('/weight?site=east').status_code, 400)
+
+    def test_ids_from_before_sharding_are_found_on_any_site(self):
+        local = self.weigh(direction="none", containers="", weight=100)
+        self.assertEqual([self.shards.site_of(i) for i in (local, self.legacy_north)], [None, None])
+        self.assertEqual(self.client.get(f'/session/{local}').json["id"], local)
+        self.assertEqual(self.client.get(f'/session/{self.legacy_north}').json["truck"], "LEGACY-T1")
+        self.assertEqual(self.client.get(f'/session/{self.shards.first_id("south") - 2}').status_code, 404)
+
+    def test_item_sessions_of_several_sites_in_id_order(self):
+        local = self.weigh(direction="in", truck="SHARD-T4", containers="", weight=9000)
+        repository = self.factories["north"]()
+        now = datetime.now().replace(microsecond=0)
+        # North lists its sessions by datetime, the later id first
+        first = repository.insert_transaction(now, "in", 9000, truck="SHARD-T4")
+        second = repository.insert_transaction(now - timedelta(seconds=1), "in", 9000, truck="SHARD-T4")
+        repository.record_truck("SHARD-T4", now)
+        repository.commit()
+        repository.close()
+        self.assertEqual(self.client.get('/item/SHARD-T4').json["sessions"], [str(i) for i in (local, first, second)])
+
+    def test_remote_shards_are_read_only(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            self.shards.gather(lambda repository: repository.insert_transaction(datetime.now(), "none", 1), ["north"])
+
+    def test_gather_pages_remote_shards(self):
+        for i in range(5):
+            self.weigh(direction="none", containers="", weight=i, site="north")
+        pages = []
+        fetch = lambda repository, after_id, size: pages.append(after_id) or list(
+            repository.iter_weighings(datetime(2000, 1, 1), datetime.now(), ["none"], after_id, size))
+        rows = list(self.shards.iter_merged(fetch, iter(()), None, None, page_size=2, sites=["north"]))
+        self.assertEqual([row[2] for row in rows], [0, 1, 2, 3, 4])
+        # Two full pages, then the short one that ends the shard
+        self.assertEqual(pages, [None, rows[1][0], rows[3][0]])
+
+
+class TestDailyRollups(unittest.TestCase):
+
+    def test_incremental_rollups_match_rebuild(self):
+        client = app.test_client()
+        produce = "rollup-plums"
+        weighings = [
+            {"direction": "in", "truck": "ROLLUP-T1", "containers": "", "weight": 9000, "force": True},
+            # Overwrites the first weighing, which leaves the rollups
+            {"direction": "in", "truck": "ROLLUP-T1", "containers": "", "weight": 9500, "force": True},
+            {"direction": "out", "truck": "ROLLUP-T1", "containers": "", "weight": 4000},
+        ]
+        for weighing in weighings:
+            response = client.post('/weight', json={"unit": "kg", "produce": produce, **weighing})
+            self.assertEqual(response.status_code, 200)
+
+        query = f'/weight/rollup?produce={produce}&filter=in,out'
+        incremental = client.get(query).json
+        self.assertEqual([(row["direction"], row["count"], row["bruto"]["sum"], row["neto"]) for row in incremental],
+                         [("in", 1, 9500, {"sum": 0, "known": 0}), ("out", 1, 9500, {"sum": 5500, "known": 1})])
+        with app.app_context():
+            rebuild_daily_rollups()
+        self.assertEqual(client.get(query).json, incremental)
+        monthly = client.get(query + '&bucket=month').json
+        self.assertEqual([row["bucket"][8:] for row in monthly], ["01 00:00:00"] * 2)
+
+
+class TestTruckRegistry(unittest.TestCase):
+
+    def test_weighings_update_registry_and_autocomplete(self):
+        client = app.test_client()
+        for weighing in [
+            {"direction": "in", "truck": "REGISTRY-T1", "weight": 9000},
+            {"direction": "out", "truck": "REGISTRY-T1", "weight": 4000},
+            {"direction": "in", "truck": "REGISTRY-T2", "weight": 8000},
+        ]:
+            response = client.post('/weight', json={"unit": "kg", "containers": "", "force": True, **weighing})
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(client.get('/item/REGISTRY-T1').json["tara"], 4000)
+        self.assertEqual(client.get('/item/REGISTRY-T2').json["tara"], "na")
+        self.assertEqual(client.post('/items', json=["REGISTRY-T1", "REGISTRY-T3"]).json,
+                         {"REGISTRY-T1": client.get('/item/REGISTRY-T1').json,
+                          "REGISTRY-T3": {"error": "Item not found"}})
+
+        trucks = client.get('/trucks?prefix=REGISTRY-&limit=5').json
+        self.assertEqual([(truck["id"], truck["tara"], truck["sessions"]) for truck in trucks],
+                         [("REGISTRY-T1", 4000, 1), ("REGISTRY-T2", "na", 0)])
+        self.assertEqual(len(trucks[0]["lastSeen"]), 14)
+        self.assertEqual(client.get('/trucks?limit=0').status_code, 400)
+
+    def test_backfill_from_transactions(self):
+        repository = create_repository_factory('sqlite')()
+        repository.ensure_schema()
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        repository.insert_transaction(at, "in", 1000, truck="T-1")
+        repository.insert_transaction(at + timedelta(hours=1), "out", 1000, truck="T-1", truck_tara=300)
+        repository.insert_transaction(at + timedelta(hours=2), "in", 1000, truck="T-1")
+        repository.insert_transaction(at, "in", 900, truck="T-2")
+        repository.commit()
+        self.assertEqual(repository.backfill_trucks(), 2)
+        self.assertEqual(repository.get_truck("T-1"), {"truck": "T-1", "last_tara": 300, "tara_at": at + timedelta(hours=1),
+                                                      "last_seen": at + timedelta(hours=2), "sessions": 1})
+        self.assertEqual(repository.get_truck("T-2")["last_tara"], None)
+        self.assertEqual(repository.backfill_trucks(), 0)
+        repository.close()
+
+    def test_archived_trucks_are_registered(self):
+        repository = create_repository_factory('sqlite')()
+        repository.ensure_schema()
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        rows = [(1, at, "in", "T-1", "", 1000, None, None, "na"),
+                (2, at + timedelta(hours=2), "out", "T-1", "", 1000, 350, None, "na"),
+                (3, at + timedelta(hours=1), "out", "T-1", "", 1000, 300, None, "na"),
+                (4, at, "none", None, "C-1", 50, None, None, "na")]
+        self.assertEqual(register_archived_trucks(repository, rows), 1)
+        self.assertEqual(repository.get_truck("T-1"), {"truck": "T-1", "last_tara": 350, "tara_at": at + timedelta(hours=2),
+                                                      "last_seen": at + timedelta(hours=2), "sessions": 2})
+        # A registered truck keeps its newer tara and its session count
+        repository.record_truck("T-1", at + timedelta(hours=3), 400)
+        register_archived_trucks(repository, rows)
+        self.assertEqual((repository.get_truck("T-1")["last_tara"], repository.get_truck("T-1")["sessions"]), (400, 3))
+        repository.close()
+
+
+class TestTaraCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'tara_cache.bin')
+        self.cache = TaraCache(self.path)
+
+    def test_lookup_without_table_falls_back(self):
+        self.assertIsNone(self.cache.lookup(["C-1"]))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_lookup_registered_and_unknown(self):
+        self.cache.rebuild([("C-2", 300), ("C-1", None), ("C-3", 0)])
+        result = self.cache.lookup(["C-1", "C-2", "C-404"])
+        self.assertEqual(result, {"C-1": (True, None), "C-2": (True, 300), "C-404": (False, None)})
+        self.assertEqual(sorted(self.cache.unknown_ids()), ["C-1", "C-3"])
+
+    def test_rebuild_bumps_version_for_other_readers(self):
+        reader = TaraCache(self.path)
+        self.assertEqual(self.cache.rebuild([("C-1", 100)]), 1)
+        self.assertEqual(reader.lookup(["C-1"])["C-1"], (True, 100))
+        self.assertEqual(self.cache.rebuild([("C-1", 120)]), 2)
+        self.assertEqual(reader.lookup(["C-1"])["C-1"], (True, 120))
+        self.assertEqual(reader.stats()["version"], 2)
+
+    def test_invalidate_falls_back_until_rebuild(self):
+        self.cache.rebuild([("C-1", 100)])
+        self.assertEqual(self.cache.invalidate(), 2)
+        self.assertIsNone(self.cache.lookup(["C-1"]))
+        self.assertEqual(self.cache.rebuild([("C-1", 120)]), 3)
+        self.assertEqual(self.cache.lookup(["C-1"])["C-1"], (True, 120))
+
+
+
+class RepositoryContract:
+    """Behaviour every storage engine must share, run against each local engine below"""
+
+    engine = None
+
+    def setUp(self):
+        self.repository = create_repository_factory(self.engine)()
+        self.repository.ensure_schema()
+
+    def tearDown(self):
+        self.repository.close()
+
+    def test_weighing_cycle(self):
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        self.assertTrue(self.repository.claim_open_session("T-1", at))
+        self.assertFalse(self.repository.claim_open_session("T-1", at))
+        session_id = self.repository.insert_transaction(at, "in", 1000, truck="T-1", containers="C-1", produce="apple")
+        self.repository.set_open_session("T-1", session_id)
+        self.repository.index_session_containers(session_id, at, ["C-1"])
+        self.repository.commit()
+
+        self.assertEqual(session_id, 10001)
+        self.assertEqual(self.repository.find_open_session("T-1", lock=True), session_id)
+        self.assertEqual(self.repository.get_transaction_bruto(session_id), 1000)
+        self.repository.close_open_session("T-1", session_id)
+        self.repository.commit()
+        self.assertIsNone(self.repository.find_open_session("T-1"))
+        self.assertEqual(self.repository.get_session(session_id)["datetime"], at)
+        self.assertEqual(self.repository.container_sessions("C-1", at, at), [session_id])
+
+    def test_rollback_to_savepoint(self):
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        self.repository.savepoint("weighing")
+        kept = self.repository.insert_transaction(at, "none", 10)
+        self.repository.release_savepoint("weighing")
+        self.repository.savepoint("weighing")
+        self.repository.insert_transaction(at, "none", 20)
+        self.repository.rollback_to_savepoint("weighing")
+        self.repository.release_savepoint("weighing")
+        self.repository.commit()
+        rows = list(self.repository.iter_weighings(at, at, ["none"]))
+        self.assertEqual([(row[0], row[2]) for row in rows], [(kept, 10)])
+
+    def test_transaction_id_floor(self):
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        self.assertEqual(self.repository.insert_transaction(at, "none", 10), 10001)
+        self.repository.set_transaction_id_floor(20001)
+        self.repository.commit()
+        self.assertEqual(self.repository.insert_transaction(at, "none", 20), 20001)
+        # A lower floor never hands out ids again
+        self.repository.set_transaction_id_floor(15001)
+        self.assertEqual(self.repository.insert_transaction(at, "none", 30), 20002)
+        self.repository.commit()
+        self.assertEqual([row[0] for row in self.repository.iter_weighings(at, at, ["none"])], [10001, 20001, 20002])
+
+    def test_upsert_container_taras(self):
+        self.repository.upsert_container_taras([("C-1", 100), ("C-2", None)])
+        self.repository.upsert_container_taras([("C-1", 120)])
+        self.repository.commit()
+        self.assertEqual(self.repository.container_taras(["C-1", "C-2", "C-3"]), {"C-1": 120, "C-2": None})
+        self.assertEqual(self.repository.container_tara("C-3"), (False, None))
+
+    def test_truck_registry(self):
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        self.repository.record_truck("T-1", at)
+        self.repository.record_truck("T-1", at + timedelta(hours=2), 400)
+        # An older reading uploaded late counts its session but keeps the newer tara
+        self.repository.record_truck("T-1", at + timedelta(hours=1), 300)
+        self.repository.record_truck("T-10", at)
+        self.repository.record_truck("U-1", at, 500)
+        self.repository.commit()
+        self.assertEqual(self.repository.get_truck("T-1"),
+                         {"truck": "T-1", "last_tara": 400, "tara_at": at + timedelta(hours=2),
+                          "last_seen": at + timedelta(hours=2), "sessions": 2})
+        self.assertIsNone(self.repository.get_truck("T-2"))
+        self.assertEqual({truck: row["last_tara"] for truck, row in self.repository.get_trucks(["T-10", "T-2"]).items()},
+                         {"T-10": None})
+        self.assertEqual([row["truck"] for row in self.repository.search_trucks("T-", 10)], ["T-1", "T-10"])
+        self.assertEqual([row["truck"] for row in self.repository.search_trucks("", 2)], ["T-1", "T-10"])
+
+    def test_daily_rollups(self):
+        day = datetime(2025, 1, 1).date()
+        self.repository.add_to_daily_rollups([(day, "apple", "in", 1, 1000, 0, 1), (day, "apple", "out", 1, 1000, 600, 0)])
+        self.repository.add_to_daily_rollups([(day, "apple", "in", 1, 500, 0, 1)])
+        self.repository.commit()
+        self.assertEqual(self.repository.daily_rollups(day, day, ["in"]), [(day, "apple", "in", 2, 1500, 0, 2)])
+        self.repository.clear_daily_rollups()
+        self.repository.commit()
+        self.assertEqual(self.repository.daily_rollups(day, day, ["in", "out"]), [])
+
+    def test_unknown_containers(self):
+        self.repository.add_unknown_containers(["C-1", "C-2"])
+        self.repository.add_unknown_containers(["C-2", "C-3"])
+        self.repository.remove_unknown_containers(["C-1", "C-4"])
+        self.repository.commit()
+        self.repository.add_unknown_containers(["C-5"])
+        self.repository.rollback()
+        self.assertEqual(sorted(self.repository.unknown_containers()), ["C-2", "C-3"])
+
+    def test_set_based_lookups(self):
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        first = self.repository.insert_transaction(at, "out", 1000, truck="T-1", truck_tara=300)
+        second = self.repository.insert_transaction(at + timedelta(hours=1), "out", 1000, truck="T-1", truck_tara=400)
+        self.repository.index_session_containers(first, at, ["C-1", "C-2"])
+        self.repository.commit()
+        self.assertEqual(set(self.repository.get_sessions([first, 99])), {first})
+        self.assertEqual(self.repository.containers_sessions(["C-1", "C-3"], at, at), {"C-1": [first]})
+        self.assertEqual(self.repository.trucks_sessions(["T-1"], at, at + timedelta(hours=1)), {"T-1": [first, second]})
+
+    def test_weight_summary_percentiles(self):
+        at = datetime(2025, 1, 1, 8, 0, 0)
+        for bruto in (100, 200, 300, 400):
+            self.repository.insert_transaction(at, "in", bruto, truck="T-1", produce="apple")
+        self.repository.commit()
+        (row,) = self.repository.weight_summary(at, at, ["in"], "week")
+        self.assertEqual(row[:7], ("2024-12-30 00:00:00", "in", "apple", 4, 1000, None, 0))
+        self.assertEqual([int(value) for value in row[7::2]], [200, 400, 400])
+
+
+class TestSQLiteRepository(RepositoryContract, unittest.TestCase):
+    engine = 'sqlite'
+
+
+class TestMemoryRepository(RepositoryContract, unittest.TestCase):
+    engine = 'memory'
+
+
+
+class TestQueryPlanWorkload(unittest.TestCase):
+
+    def test_workload_covers_every_query(self):
+        transaction_control = {'ensure_schema', 'ping', 'commit', 'rollback', 'savepoint',
+                               'rollback_to_savepoint', 'release_savepoint', 'close'}
+        methods = {name for name in vars(WeightRepository) if not name.startswith('_')} - transaction_control
+        covered = {method for method, _, _ in query_plan_workload(datetime.now())}
+        self.assertEqual(methods - covered, set())
+
+    def test_record_queries(self):
+        _, statements = record_queries(None)
+        recorded = {method for method, _, _ in statements}
+        self.assertIn('container_sessions', recorded)
+        self.assertTrue(all(query.count('%s') == len(params) for _, query, params in statements
+                            if not query.lstrip().upper().startswith('INSERT')))
+
+    def test_sqlite_query_plans_use_indexes(self):
+        repository = create_repository_factory('sqlite')()
+        repository.ensure_schema()
+        self.assertEqual(check_sqlite_query_plans(repository.connection), [])
+        repository.close()
+
 
 if __name__ == '__main__':
     # Define the output file for the test results